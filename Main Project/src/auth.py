@@ -6,22 +6,23 @@ Implemented by Yue (Yuelanda) Dai (zid: z5310546)
 """
 
 # libraies
-import hashlib
 import jwt
 import string
 import re
 from random import choice
 
-# libraies for emails
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
-import imaplib
-import email
-
 # src files
 import error as err
-from users_channels import users, SECRET
+from users_channels import users, tokens, emails, handles, handle_counters, SECRET
+from channel import decode_token
+import persistence
+import mailer
+import hashing
+from locks import users_lock
+
+# length of the random part of the reset codes, the length of the
+# SHA-256 hex digests the passwords used to be stored as
+RESET_CODE_LENGTH = 64
 
 
 # ---------------------------------------------------------------------------------------- #
@@ -47,6 +48,33 @@ def test_email(email):
     return re.search(regex, email) is not None
 
 
+def normalise_email(email):
+    """ Normalise the email into the key used by the email index
+        (emails in users_channels.py). Emails are case-insensitive.
+
+    Parameters:
+        email (str): email of the user
+
+    Returns:
+        (str): lowercased email
+    """
+
+    return email.lower()
+
+
+def email_to_uid(email):
+    """ Find the user who registered with the email.
+
+    Parameters:
+        email (str): email of the user
+
+    Returns:
+        (int): uid of the user, None if the email is not registered
+    """
+
+    return emails.get(normalise_email(email))
+
+
 def handle_generate(name_first, name_last):
     """ Generates a handle from the user's first name and last name
 
@@ -56,28 +84,29 @@ def handle_generate(name_first, name_last):
 
     Returns:
         handle (str): concatentation of a lowercase-only first name and last name
-                      The last two characters in the handle is reserved for
-                      numerical values to make each handle unique.
+                      followed by a numerical suffix that makes each handle
+                      unique. The name is truncated to keep the handle
+                      within 20 characters.
     """
 
-    handle = name_first.lower() + name_last.lower()
-    if len(handle) >= 19:
-        handle = handle[:18]
-
-    # handle = handle + '0'
-    handle += '0'
+    base = (name_first.lower() + name_last.lower())[:18]
 
-    for u_id in users:
-        if users[u_id].get('username') == handle:
-            last = int(handle[-1]) + 1
-            handle = handle[:-1] + str(last)
+    # start from the next suffix of the base handle instead of scanning users,
+    # the loop only skips handles taken by user_profile_sethandle
+    suffix = handle_counters.get(base, 0)
+    handle = base[:20 - len(str(suffix))] + str(suffix)
+    while handle in handles:
+        suffix += 1
+        handle = base[:20 - len(str(suffix))] + str(suffix)
+    handle_counters[base] = suffix + 1
+    persistence.handle_counter_changed(base)
 
     return handle
 
 
 def password_encryption(password):
     """ Encrypts user's password for security reasons in stroing data
-        with hashing.
+        with hashing (PBKDF2 with a random salt, see hashing.py).
 
     Parameter:
         password (str): user's actual password before encryption
@@ -85,7 +114,7 @@ def password_encryption(password):
     Return: user's encrypted password
     """
 
-    return hashlib.sha256(password.encode()).hexdigest()
+    return hashing.hash_password(password)
 
 
 def token_encryption(email):
@@ -115,13 +144,38 @@ def token_decryption(token):
     Return: the email of the user
     """
 
-    encoded = token.encode()
-    decrypted = jwt.decode(encoded, SECRET, algorithms=['HS256'])
-    return decrypted['email']
+    return decode_token(token)
+
+
+def session_update(u_id, token):
+    """ Store the decoded token of the user and keep the token index
+        (tokens in users_channels.py) in sync with it.
+        If another user is holding the same decoded token (e.g. the email
+        was released by user_profile_setemail and registered again),
+        the session of that user is invalidated.
+
+    Parameters:
+        u_id (int): uid of the user
+        token (str): the decoded token, an empty string logs the user out
+    """
+
+    with users_lock:
+        old_token = users[u_id]['token']
+        if tokens.get(old_token) == u_id:
+            del tokens[old_token]
+
+        if token != '':
+            holder = tokens.get(token)
+            if holder is not None and holder != u_id:
+                users[holder]['token'] = ''
+                persistence.user_changed(holder)
+            tokens[token] = u_id
+        users[u_id]['token'] = token
+        persistence.user_changed(u_id)
 
 
 def generate_reset_code(email):
-    """ Generate/ Create reset_code that is the same length as the user's password,
+    """ Generate/ Create reset_code whose random part is RESET_CODE_LENGTH long,
         with a combination of uppercase, lowercase letters and digits.
 
     Parameter:
@@ -131,29 +185,24 @@ def generate_reset_code(email):
         reset_code (str): reset_code that is going to be sent as the content to the email.
     """
 
-    length = int
-    uid = str
-    is_user_email = False
-    for u_id, user in users.items():
-        if user['email'] == email:
-            is_user_email = True
-            length = len(user['password'])
-            uid = str(u_id)
-
-    if not is_user_email:
+    u_id = email_to_uid(email)
+    if u_id is None:
         raise err.AccessError(f"Error, {email} is not a registered email.")
 
+    uid = str(u_id)
+
     # Assumption: secret_code is a fixed string 'RS' followed by the user's uid then '-', finally the
-    # randomly generated stringt that is of the same length of the user's orginal encrypted password.
+    # randomly generated stringt that is RESET_CODE_LENGTH long.
     choices = string.digits + string.ascii_letters
-    random_str = ''.join((choice(choices) for i in range(length)))
+    random_str = ''.join((choice(choices) for i in range(RESET_CODE_LENGTH)))
     secret_code = 'RS' + uid + '-' + random_str
     return u_id, secret_code
 
 
 def send_email(target_email, SECRET_CODE):
     """
-    Send email using Python to the target_email with body message SECRET_CODE
+    Send email using Python to the target_email with body message SECRET_CODE.
+    The email is only queued, it's sent in the background by mailer.py.
 
     Parameters:
         target_email (str): target email address
@@ -162,27 +211,7 @@ def send_email(target_email, SECRET_CODE):
     Written by Yiyang Huang. Modified by Yue Dai.
     """
 
-    # Header
-    __ = "smtp.gmail.com"
-    mail_pass = "Flockr-COMP1531"
-    sent_from = target_email
-
-    # Content
-    subject = 'Flockr: Reset Password'
-    mail_body = f'Security code: {SECRET_CODE}'
-    mail_message = f'''
-    From: {sent_from}
-    To: {target_email}
-    Subject: {subject}
-
-    {mail_body}
-    '''
-
-    server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-    server.ehlo()
-    server.login(sent_from, mail_pass)
-    server.sendmail(sent_from, target_email, mail_message)
-    server.close()
+    mailer.send_mail(target_email, 'Flockr: Reset Password', f'Security code: {SECRET_CODE}')
 
 
 # ---------------------------------------------------------------------------------------- #
@@ -205,21 +234,29 @@ def auth_login(email, password):
     if not test_email(email): # Invalid email
         raise err.InputError(f"Error, invalid email: {email}")
     
-    for u_id in users:
-        if users[u_id].get('email') == email:
-            encripted_pw = password_encryption(password)
-            if users[u_id].get('password') != encripted_pw:
-                # Password is not correct
-                raise err.InputError("Incorrect password")
-            users[u_id]['token'] = email
-            # Correct email and password
-            return {
-                'u_id': u_id,
-                'token': token_encryption(email),
-            }
-
-    # Email entered does not belong to a user
-    raise err.InputError(f"Email: {email} does not belong to a user")
+    u_id = email_to_uid(email)
+    if u_id is None:
+        # Email entered does not belong to a user
+        raise err.InputError(f"Email: {email} does not belong to a user")
+
+    encripted_pw = users[u_id].get('password')
+    matches, rehash = hashing.check_password(password, encripted_pw)
+    if not matches:
+        # Password is not correct
+        raise err.InputError("Incorrect password")
+    if rehash:
+        # Legacy (or outdated) hash, store the password hashed the current way
+        upgraded_pw = password_encryption(password)
+        with users_lock:
+            if users[u_id]['password'] == encripted_pw:
+                users[u_id]['password'] = upgraded_pw
+                persistence.user_changed(u_id)
+    session_update(u_id, email)
+    # Correct email and password
+    return {
+        'u_id': u_id,
+        'token': token_encryption(email),
+    }
 
 
 def auth_logout(token):
@@ -234,12 +271,13 @@ def auth_logout(token):
 
     decrypted_token = token_decryption(token)
     # In iteration_1 the token is the email of the logged in user.
-    for u_id in users:
-        if users[u_id].get('token') == decrypted_token: # token is valid
-            # Invalidate the token as an empty string to log the user out
-            users[u_id]['token'] = ''
-            return {'is_success': True}
-    return {'is_success': False}
+    u_id = tokens.get(decrypted_token)
+    if u_id is None:
+        return {'is_success': False}
+
+    # Invalidate the token as an empty string to log the user out
+    session_update(u_id, '')
+    return {'is_success': True}
 
 
 def auth_register(email, password, name_first, name_last):
@@ -262,14 +300,6 @@ def auth_register(email, password, name_first, name_last):
     if not test_email(email): # Invalid email
         raise err.InputError(f"Invalid email: {email}")
     
-    # Email address is already being used by another user
-    u_id = 0
-    for u_id in users:
-        if users[u_id].get('email') == email:
-            raise err.InputError(f"Error, {email} already used by another user")
-    # u_id += 1
-    u_id = len(users)
-    
     # Password entered is less than 6 characters long
     if len(password) < 6:
         raise err.InputError("Password entered is less than 6 characters long")
@@ -282,34 +312,54 @@ def auth_register(email, password, name_first, name_last):
     if len(name_last) < 1 or len(name_last) > 50:
         raise err.InputError("name_last not is between 1 and 50 characters in length")
 
-    # Set permission_id for each member
-    # 1 for the first user register (owner), and 2 for the rest (member)
-    if u_id == 0:
-        permission_id = 1
-    else:
-        permission_id = 2
-
-    # New user
-    users[u_id] = {
-        'username': handle_generate(name_first, name_last),
-        'token': email,
-        'name_first': name_first,
-        'name_last': name_last,
-        'email': email,
-        'password': password_encryption(password),
-        'reset_code': '',
-        'permission_id': permission_id,
-        'in_channels': [],
-        'msg_sent': [],
-        'profile_img_url': '',
-    }
+    # Email address is already being used by another user.
+    # Checked before hashing, so duplicates never cost a hash
+    if email_to_uid(email) is not None:
+        raise err.InputError(f"Error, {email} already used by another user")
+
+    # Hashing is slow, so it's done before taking the lock
+    encripted_pw = password_encryption(password)
+
+    with users_lock:
+        # Checked again, in case the email is registered while hashing
+        if email_to_uid(email) is not None:
+            raise err.InputError(f"Error, {email} already used by another user")
+        u_id = len(users)
+
+        # Set permission_id for each member
+        # 1 for the first user register (owner), and 2 for the rest (member)
+        if u_id == 0:
+            permission_id = 1
+        else:
+            permission_id = 2
+
+        # New user
+        handle = handle_generate(name_first, name_last)
+        users[u_id] = {
+            'username': handle,
+            'token': '',
+            'name_first': name_first,
+            'name_last': name_last,
+            'email': email,
+            'password': encripted_pw,
+            'reset_code': '',
+            'permission_id': permission_id,
+            'in_channels': {},
+            'msg_sent': set(),
+            'profile_img_url': '',
+            'img_urls': {},
+        }
+        emails[normalise_email(email)] = u_id
+        handles[handle] = u_id
+        persistence.user_changed(u_id)
 
     # Assume automatic login after registration.
-    # The token returned for auth_register is the same token returned from auth_login
-    dictionary = auth_login(email, password)
+    # The token returned for auth_register is the same token returned from auth_login,
+    # without checking the password again
+    session_update(u_id, email)
     return {
         'u_id': u_id,
-        'token': dictionary['token'],
+        'token': token_encryption(email),
     }
 
 
@@ -328,7 +378,9 @@ def auth_passwordreset_request(email):
     u_id, secret_code = generate_reset_code(email)
     # store the reset_code (secret_code) into the users database.
 
-    users[u_id]['reset_code'] = secret_code
+    with users_lock:
+        users[u_id]['reset_code'] = secret_code
+        persistence.user_changed(u_id)
 
     send_email(email, secret_code)
     return {}
@@ -348,14 +400,18 @@ def auth_passwordreset_reset(reset_code, newpassword):
     if len(newpassword) < 6:
         raise err.InputError("Invalid password: password entered is less than 6 characters long")
 
-    # store new password into the users dictionary
-    reseted = False
-    for u_id in users:
-        if users[u_id].get('reset_code') == reset_code:
-            users[u_id]['password'] = password_encryption(newpassword)
-            reseted = True
-
-    if not reseted:
+    reset_uids = [u_id for u_id in list(users) if users[u_id].get('reset_code') == reset_code]
+    if not reset_uids:
         raise err.InputError("Incorrect reset code")
 
+    # Hashing is slow, so it's done before taking the lock
+    encripted_pw = password_encryption(newpassword)
+
+    # store new password into the users dictionary
+    with users_lock:
+        for u_id in reset_uids:
+            if users[u_id].get('reset_code') == reset_code:
+                users[u_id]['password'] = encripted_pw
+                persistence.user_changed(u_id)
+
     return {}
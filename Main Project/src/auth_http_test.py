@@ -17,12 +17,6 @@ Reviewed by Yiyang (Sophia) Huang (z5313425)
 import requests
 import pytest
 
-# emails
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
-import imaplib
-import email
 
 # ------------------------------------------------------------------------------------------------- #
 # --------------------------------- http tests for auth/login ------------------------------------- #
@@ -151,7 +145,7 @@ def test_auth_passwordreset_reset_inputerror(urls, auth_passwordreset_setup):
     assert response.status_code == 400
 
 
-def test_auth_passwordreset_reset_normal_behaviour(urls):
+def test_auth_passwordreset_reset_normal_behaviour(urls, read_reset_code):
     """ Test normal http behaviour for auth/passwordreset_reset request
         in the front-end. Reset the password to the new password entered.
         If new password is setted correctly, then user should be able to
@@ -183,18 +177,8 @@ def test_auth_passwordreset_reset_normal_behaviour(urls):
     response2 = requests.post(urls['auth_request'], json=data)
     assert response2.status_code == 200
 
-    # Recieve email.
-    mail = imaplib.IMAP4_SSL('imap.gmail.com')
-    mail.login("comp1531.20t3.flockr@gmail.com", 'Flockr-COMP1531')
-    mail.select(readonly=True)
-    __, message_ids = mail.search(None, 'ALL')
-    # Get the latest email received.
-    msg_ids = message_ids[0].split()
-    latest_msg = msg_ids[-1]
-    __, message_data = mail.fetch(latest_msg, '(RFC822)')
-    # Get the message content needed from the latest email.
-    msg = email.message_from_bytes(message_data[0][1]).get_payload()
-    reset_code = msg.partition("Security code: ")[2].rstrip()
+    # Recieve email, written by the server to mail_dir.
+    reset_code = read_reset_code("comp1531.20t3.flockr@gmail.com")
 
     data1 = {
         "reset_code": reset_code,
@@ -13,15 +13,11 @@ Reviewed by Yiyang (Sophia) Huang (zid: z5313425)
 
 import pytest
 import auth as au
+import channel as ch
 import error as err
+import config
 import other
-
-# libraies for emails
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
-import imaplib
-import email
+import mailer
 
 
 # pylint: disable=unused-argument
@@ -35,10 +31,25 @@ def reset():
 
 
 @pytest.fixture
-def registration(reset_dict):
-    """ A standard registered used for tests use"""
+def registration(reset_dict, monkeypatch):
+    """ A standard registered used for tests use.
+        The mails are sent with the 'memory' transport (see received_reset_code).
+    """
+
+    monkeypatch.setattr(config, 'MAIL_TRANSPORT', 'memory')
+    mailer.outbox.clear()
+    yield au.auth_register('comp1531.20t3.flockr@gmail.com', 'password', 'name_first', 'name_last')
+    mailer.flush()
+    mailer.outbox.clear()
 
-    return au.auth_register('comp1531.20t3.flockr@gmail.com', 'password', 'name_first', 'name_last')
+
+def received_reset_code(target_email):
+    """ Return the reset code in the latest mail sent to the email
+        (the mails are queued, so call mailer.flush() first)
+    """
+
+    mail = [mail for mail in mailer.outbox if mail['To'] == target_email][-1]
+    return mail.get_payload().partition("Security code: ")[2].rstrip()
 
 
 # ------------------------------------------------------------------------------------------------- #
@@ -106,6 +117,21 @@ def test_auth_login_after_logout(registration):
     assert isinstance(login['u_id'], int) and login['token'] is not None
 
 
+def test_auth_logout_cached_token(registration):
+    """ A token that is already verified (cached) is rejected once the user logged out"""
+
+    token = registration['token']
+    assert ch.token_to_uid(token) == registration['u_id']
+    assert au.auth_logout(token)['is_success']
+
+    with pytest.raises(err.AccessError):
+        ch.token_to_uid(token)
+    assert not au.auth_logout(token)['is_success']
+
+    login = au.auth_login('comp1531.20t3.flockr@gmail.com', 'password')
+    assert ch.token_to_uid(login['token']) == registration['u_id']
+
+
 # ------------------------------------------------------------------------------------------------- #
 # ---------------------------------- Tests for auth_register -------------------------------------- #
 # ------------------------------------------------------------------------------------------------- #
@@ -220,6 +246,20 @@ def test_auth_register_long_handle_generation(registration):
     assert isinstance(d_reg['u_id'], int) and d_reg['token'] == d_login['token']
 
 
+def test_auth_register_many_identical_names(reset_dict):
+    """ Handles stay unique and within 20 characters when many users share
+        the same (long) name.
+    """
+
+    for i in range(150):
+        au.auth_register(f'validemail{i}@testdata.com', 'password',
+                         'longFisrtNameLongFisrtName', 'longLastNameLongLast')
+
+    handles = [user['username'] for user in au.users.values()]
+    assert len(set(handles)) == 150
+    assert all(len(handle) <= 20 for handle in handles)
+
+
 # ------------------------------------------------------------------------------------------------- #
 # --------------------------- Tests for auth_passwordreset_resquest ------------------------------- #
 # ------------------------------------------------------------------------------------------------- #
@@ -235,19 +275,10 @@ def test_auth_passwordreset_request(registration):
     u_id = registration['u_id']
 
     au.auth_passwordreset_request('comp1531.20t3.flockr@gmail.com')
+    mailer.flush()
 
     # Recieve email.
-    mail = imaplib.IMAP4_SSL('imap.gmail.com')
-    mail.login('comp1531.20t3.flockr@gmail.com', 'Flockr-COMP1531')
-    mail.select(readonly=True)
-    __, message_ids = mail.search(None, 'ALL')
-    # Get the latest email received.
-    msg_ids = message_ids[0].split()
-    latest_msg = msg_ids[-1]
-    __, message_data = mail.fetch(latest_msg, '(RFC822)')
-    # Get the message content needed from the latest email.
-    msg = email.message_from_bytes(message_data[0][1]).get_payload()
-    reset_code = msg.partition("Security code: ")[2].rstrip()
+    reset_code = received_reset_code('comp1531.20t3.flockr@gmail.com')
 
     assert reset_code[0:4] == 'RS' + str(u_id) + '-'
 
@@ -276,19 +307,10 @@ def test_auth_passwordreset_reset(registration):
     au.auth_logout(registration['token'])
 
     au.auth_passwordreset_request('comp1531.20t3.flockr@gmail.com')
+    mailer.flush()
 
     # Recieve email.
-    mail = imaplib.IMAP4_SSL('imap.gmail.com')
-    mail.login('comp1531.20t3.flockr@gmail.com', 'Flockr-COMP1531')
-    mail.select(readonly=True)
-    __, message_ids = mail.search(None, 'ALL')
-    # Get the latest email received.
-    msg_ids = message_ids[0].split()
-    latest_msg = msg_ids[-1]
-    __, message_data = mail.fetch(latest_msg, '(RFC822)')
-    # Get the message content needed from the latest email.
-    msg = email.message_from_bytes(message_data[0][1]).get_payload()
-    reset_code = msg.partition("Security code: ")[2].rstrip()
+    reset_code = received_reset_code('comp1531.20t3.flockr@gmail.com')
 
     au.auth_passwordreset_reset(reset_code, 'newPassword')
     login = au.auth_login('comp1531.20t3.flockr@gmail.com', 'newPassword')
@@ -313,19 +335,10 @@ def test_auth_passwordreset_reset_invalid_password(registration):
 
     au.auth_logout(registration['token'])
     au.auth_passwordreset_request('comp1531.20t3.flockr@gmail.com')
+    mailer.flush()
 
     # Recieve email.
-    mail = imaplib.IMAP4_SSL('imap.gmail.com')
-    mail.login('comp1531.20t3.flockr@gmail.com', 'Flockr-COMP1531')
-    mail.select(readonly=True)
-    __, message_ids = mail.search(None, 'ALL')
-    # Get the latest email received.
-    msg_ids = message_ids[0].split()
-    latest_msg = msg_ids[-1]
-    __, message_data = mail.fetch(latest_msg, '(RFC822)')
-    # Get the message content needed from the latest email.
-    msg = email.message_from_bytes(message_data[0][1]).get_payload()
-    reset_code = msg.partition("Security code: ")[2].rstrip()
+    reset_code = received_reset_code('comp1531.20t3.flockr@gmail.com')
 
     with pytest.raises(err.InputError):
         au.auth_passwordreset_reset(reset_code, 'pw')
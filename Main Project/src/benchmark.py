@@ -0,0 +1,259 @@
+""" Benchmarks for the hot paths of the Flockr backend.
+
+    Usage (from '/project'):
+        python3 src/benchmark.py                # run every benchmark
+        python3 src/benchmark.py auth_register  # run the named benchmarks
+
+@date 18/10/2026
+"""
+
+import json
+import sys
+import threading
+import tracemalloc
+from copy import deepcopy
+from time import perf_counter, sleep
+
+import auth as au
+import channel as ch
+import channels as chs
+import config
+import fragments
+import hashing
+import message as msg
+import other
+import scheduler
+import standup as st
+import users_channels as uc
+
+
+def timed(func, *args):
+    """ Return the seconds taken to call func(*args) """
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def allocations(func, *args):
+    """ Return the (amount of allocated blocks, bytes) still alive
+        after calling func(*args), including its return value.
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = func(*args)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    del result
+    return (sum(stat.count_diff for stat in stats),
+            sum(stat.size_diff for stat in stats))
+
+
+def register_users(amount):
+    """ Register amount of users with unique emails and the same name """
+    register_users_from(0, amount)
+
+
+def register_users_from(first, amount):
+    """ Register amount of users, starting at the email of user number first """
+    for i in range(first, first + amount):
+        au.auth_register(f"z{i}@ad.unsw.edu.au", "password", "first", "last")
+
+
+def bench_auth_register():
+    """ Registration must scale linearly: the time per user stays
+        (roughly) the same when the user base grows, even though
+        every user has the same name (and so the same base handle).
+        The passwords are hashed cheaply, on the calling thread.
+    """
+    hash_config = config.HASH_ITERATIONS, config.HASH_WORKERS
+    config.HASH_ITERATIONS, config.HASH_WORKERS = 1, 0
+    for amount in (25000, 50000, 100000):
+        other.clear()
+        seconds = timed(register_users, amount)
+        assert len(uc.handles) == amount
+        print(f"auth_register {amount:>7} users: {seconds:8.3f}s "
+              f"({seconds / amount * 1e6:.1f} us/user)", flush=True)
+    config.HASH_ITERATIONS, config.HASH_WORKERS = hash_config
+
+
+def bench_auth_login():
+    """ Login throughput of 16 threads logging in at once, against the amount
+        of processes hashing the passwords (0: hashed on the request threads).
+    """
+    threads, logins = 16, 10
+    other.clear()
+    register_users(threads)
+
+    def login(i):
+        for __ in range(logins):
+            au.auth_login(f"z{i}@ad.unsw.edu.au", "password")
+
+    for workers in sorted({0, 1, 2, 4, config.HASH_WORKERS}):
+        hashing.shutdown()
+        config.HASH_WORKERS = workers
+        login(0) # start the pool
+        pool = [threading.Thread(target=login, args=(i,)) for i in range(threads)]
+        start = perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        seconds = perf_counter() - start
+        print(f"auth_login {workers} workers, {config.HASH_ITERATIONS} iterations: "
+              f"{threads * logins / seconds:8.1f} logins/s", flush=True)
+    hashing.shutdown()
+
+
+def channel_setup(amount):
+    """ Register 10 users in a channel with amount of messages,
+        every user reacted to each message.
+
+        Returns: (token, channel_id)
+    """
+    other.clear()
+    register_users(10)
+    tokens = [au.auth_login(f"z{i}@ad.unsw.edu.au", "password")['token']
+              for i in range(10)]
+    channel_id = chs.channels_create(tokens[0], "bench", True)['channel_id']
+    for token in tokens[1:]:
+        ch.channel_join(token, channel_id)
+    for i in range(amount):
+        msg_id = msg.message_send(tokens[i % 10], channel_id, "Hello " * 20)['message_id']
+        for token in tokens:
+            msg.message_react(token, msg_id, 1)
+    return tokens[0], channel_id
+
+
+def deepcopy_page(token, channel_id, start):
+    """ The page of channel_messages as it used to be built,
+        by deepcopying the stored messages.
+    """
+    uid = ch.token_to_uid(token)
+    page = deepcopy(list(ch.msg_log_newest(channel_id, start, 50)))
+    for message in page:
+        for react in message['reacts']:
+            react['is_this_user_reacted'] = uid in react['u_ids']
+    return page
+
+
+def bench_channel_messages():
+    """ Allocations and time to build one page (50 messages) of channel_messages
+        compared to deepcopying the page.
+    """
+    token, channel_id = channel_setup(1000)
+    for name, func in (('deepcopy', deepcopy_page),
+                       ('channel_messages', ch.channel_messages)):
+        blocks, size = allocations(func, token, channel_id, 0)
+        seconds = timed(lambda: [func(token, channel_id, 0) for __ in range(1000)])
+        print(f"{name:>16}: {blocks:6} blocks {size:8} bytes per page, "
+              f"{seconds * 1000:.1f} us per page", flush=True)
+
+
+def encode_page(token, channel_id):
+    """ Encode a page of channel_messages as the /channel/messages route does """
+    since = fragments.last_change
+    page = ch.channel_messages(token, channel_id, 0)
+    page['messages'] = fragments.encode_records(
+        page['messages'], 'message', 'message_id', since,
+        lambda message: tuple(react['is_this_user_reacted'] for react in message['reacts']))
+    return fragments.encode_object(page)
+
+
+def encode_users(token):
+    """ Encode users_all as the /users/all route does """
+    since = fragments.last_change
+    users_all = other.users_all(token)
+    users_all['users'] = fragments.encode_records(users_all['users'], 'user', 'u_id', since,
+                                                  lambda user: ('http://localhost/', None))
+    return fragments.encode_object(users_all)
+
+
+def bench_encoding():
+    """ Time to build and encode the responses of /channel/messages (one page)
+        and /users/all (5000 users), with json.dumps against the cached
+        records of fragments.py with each encoder.
+    """
+    hash_config = config.HASH_ITERATIONS, config.HASH_WORKERS
+    config.HASH_ITERATIONS, config.HASH_WORKERS = 1, 0
+    token, channel_id = channel_setup(50)
+    register_users_from(10, 5000)
+    config.HASH_ITERATIONS, config.HASH_WORKERS = hash_config
+
+    def dumps_page():
+        return json.dumps(ch.channel_messages(token, channel_id, 0))
+
+    def dumps_users():
+        return json.dumps(other.users_all(token))
+
+    cases = (('channel_messages', 1000, dumps_page, lambda: encode_page(token, channel_id)),
+             ('users_all', 20, dumps_users, lambda: encode_users(token)))
+    for name, repeat, dumps, cached in cases:
+        seconds = timed(lambda: [dumps() for __ in range(repeat)])
+        print(f"{name:>16} json.dumps: {seconds / repeat * 1e6:9.1f} us per response", flush=True)
+        for encoder in sorted(fragments.ENCODERS):
+            config.JSON_ENCODER = encoder
+            fragments.cache.clear()
+            cached()
+            seconds = timed(lambda: [cached() for __ in range(repeat)])
+            print(f"{name:>16} {encoder:>10}: {seconds / repeat * 1e6:9.1f} us per response "
+                  "(cached records)", flush=True)
+
+
+def bench_message_send():
+    """ message_send throughput of 8 threads sending to the same channel at once """
+    threads, per_thread = 8, 2000
+    token, channel_id = channel_setup(0)
+
+    def send_many():
+        for i in range(per_thread):
+            msg.message_send(token, channel_id, f"message {i}")
+
+    pool = [threading.Thread(target=send_many) for __ in range(threads)]
+    start = perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    seconds = perf_counter() - start
+    print(f"message_send: {threads * per_thread / seconds:8.0f} messages/s "
+          f"with {threads} threads", flush=True)
+
+
+def bench_standup():
+    """ Start 10k standups at once, they all run on the scheduler thread.
+        Reports the threads alive and how late the last standup finishes.
+    """
+    amount, length = 10000, 2
+    other.clear()
+    register_users(1)
+    token = au.auth_login("z0@ad.unsw.edu.au", "password")['token']
+    channel_ids = [chs.channels_create(token, f"c{i}", True)['channel_id']
+                   for i in range(amount)]
+
+    start = perf_counter()
+    for channel_id in channel_ids:
+        st.standup_start(token, channel_id, length)
+    seconds = perf_counter() - start
+    print(f"standup_start {amount} standups: {seconds:.3f}s, "
+          f"{len(scheduler.pending_jobs())} jobs pending, "
+          f"{threading.active_count()} threads", flush=True)
+
+    while any(uc.channel[channel_id]['standup']['is_active'] for channel_id in channel_ids):
+        sleep(0.01)
+    print(f"every standup finished {perf_counter() - start - length:.3f}s late", flush=True)
+
+
+BENCHMARKS = {
+    'auth_register': bench_auth_register,
+    'auth_login': bench_auth_login,
+    'channel_messages': bench_channel_messages,
+    'message_send': bench_message_send,
+    'standup': bench_standup,
+    'encoding': bench_encoding,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
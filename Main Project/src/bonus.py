@@ -10,10 +10,12 @@
 @date 2020/11/15
 """
 
-from datetime import datetime, timezone
 from channel import token_to_uid, is_channel_id_valid, is_user_member, is_user_owner
+from message import message_broadcast # pylint: disable=unused-import
 import users_channels as uc
 import error
+import persistence
+from locks import channel_lock
 
 
 def find_todo(channel_id, todo_id): # pragma: no cover
@@ -52,11 +54,13 @@ def channel_todo_create(token, channel_id):
     if not is_user_member(uid, channel_id):
         raise error.AccessError("You are not an member of the channel.")
 
-    try:
-        __ = uc.channel[channel_id]['todos']
-        raise error.InputError("There is already a todo list in this channel.")
-    except KeyError:
-        uc.channel[channel_id]['todos'] = []
+    with channel_lock(channel_id):
+        try:
+            __ = uc.channel[channel_id]['todos']
+            raise error.InputError("There is already a todo list in this channel.")
+        except KeyError:
+            uc.channel[channel_id]['todos'] = []
+            persistence.channel_changed(channel_id)
 
     return {}
 
@@ -118,16 +122,18 @@ def channel_todo_add(token, channel_id, message, level):
     if not is_user_member(uid, channel_id):
         raise error.AccessError("You are not an member of the channel.")
 
-    try:
-        todo_id = len(uc.channel[channel_id]['todos'])
-        uc.channel[channel_id]['todos'].append({
-            'todo_id': todo_id,
-            'message': message,
-            'level': level,
-            'status': False,
-        })
-    except KeyError:
-        raise error.AccessError("Todo list not created in this channel.")
+    with channel_lock(channel_id):
+        try:
+            todo_id = len(uc.channel[channel_id]['todos'])
+            uc.channel[channel_id]['todos'].append({
+                'todo_id': todo_id,
+                'message': message,
+                'level': level,
+                'status': False,
+            })
+            persistence.channel_changed(channel_id)
+        except KeyError:
+            raise error.AccessError("Todo list not created in this channel.")
 
     return {
         'todo_id': todo_id,
@@ -135,61 +141,9 @@ def channel_todo_add(token, channel_id, message, level):
 
 
 # ======== message_broadcast ========
+# message_broadcast lives in message.py (imported above), so that messages are
+# only ever stored in one place together with the message index.
 
-def generate_timestamp():
-    """ Generate unix timestamp, accurate to seconds.
-    :return: (int) timestamp
-    """
-    timestamp = round(datetime.now().replace(tzinfo=timezone.utc).timestamp())
-    return timestamp
-
-
-def message_broadcast(token, message):
-    """ Allow owner of the flockr to send a message over all channels
-    :param token: token of the authorized user
-    :param message: the message that user want to send.
-    Return: List of dictionaries, where each dictionary contains types { message_id }
-    Exception:
-        InputError when message is longer than 1000 characters
-        AccessError when:
-            - Token input is invalid
-            - the authorised user is not owner of Flockr
-    """
-
-    uid = token_to_uid(token)
-    message = str(message)
-    msg_list = []
-
-    if uc.users[uid]['permission_id'] == 2:
-        raise error.AccessError("The authorised user is not owner of Flockr")
-    if len(message) > 1000 or len(message) < 1:
-        raise error.InputError("Message is more than 1000 characters")
-    for channel_id in uc.channel:
-        # Update in database
-        msg_id = uc.TOTAL_MSG
-        new_msg = {
-            'message_id': msg_id,
-            'u_id': uid,
-            'message': message,
-            'time_created': generate_timestamp(),
-            'reacts': [
-                {
-                    'react_id': 1,
-                    'u_ids': [],
-                }
-            ],
-            'is_pinned': False,
-        }
-        uc.channel[channel_id]['messages'].insert(0, new_msg)
-        uc.users[uid]['msg_sent'].append(msg_id)
-        msg_list.append({
-            'message_id': msg_id,
-        })
-        uc.TOTAL_MSG += 1
-
-    return {
-        'messages': msg_list
-    }
 
 # def channel_todo_update(token, channel_id, todo_id, status=True): # pragma: no cover
 #     """ Update the status of a todo list item
@@ -11,16 +11,47 @@ Miriam Tuvel (z5257404): channel_invite, channel_addowner, channel_removeowner
 """
 
 import time
-from copy import deepcopy
 from datetime import datetime, timezone
 
 import jwt
 
 import error
 import users_channels as uc
+import persistence
+from locks import channel_lock
+from message_log import msg_log_count, msg_log_newest, msg_log_position, \
+                        msg_log_older, msg_log_newer
+from pagination import page_limit
+
+# amount of messages returned by channel_messages when no limit is given
+MESSAGES_PAGE_SIZE = 50
 
 
 # Helper functions
+def decode_token(token):
+    """ Return the decoded token (i.e. email) of the jwt token.
+        Tokens that are verified recently are looked up in
+        uc.verified_tokens, so the HMAC verification is skipped.
+
+    Args:
+        token (string): jwt token of a user
+
+    Returns:
+        (string): the email stored in the token
+    """
+
+    try:
+        decoded = uc.verified_tokens[token]
+        uc.verified_tokens.move_to_end(token)
+    except KeyError:
+        decrypted = jwt.decode(token.encode(), uc.SECRET, algorithms=['HS256'])
+        decoded = decrypted['email']
+        uc.verified_tokens[token] = decoded
+        if len(uc.verified_tokens) > uc.TOKEN_CACHE_SIZE:
+            uc.verified_tokens.popitem(last=False)
+    return decoded
+
+
 def token_to_uid(token):
     """ Return the corresponding uid of the token
 
@@ -34,14 +65,10 @@ def token_to_uid(token):
         uid (int): corresponding uid of of the token
     """
 
-    encoded = token.encode()
-    decrypted = jwt.decode(encoded, uc.SECRET, algorithms=['HS256'])
-    token = decrypted['email']
-
-    for uid, user_info in uc.users.items():
-        if user_info['token'] == token:
-            return uid
-    raise error.AccessError("Invalid token")
+    uid = uc.tokens.get(decode_token(token))
+    if uid is None:
+        raise error.AccessError("Invalid token")
+    return uid
 
 
 def generate_timestamp():
@@ -63,33 +90,45 @@ def is_global_owner(uid):
     return uc.users[uid]['permission_id'] == 1
 
 
-def is_user_reacted(uid, msg):
-    """ Update msg's dictionary key of 'is_this_user_reacted'
-        Only applies to the react_id 0 for now.
+def msg_view(uid, msg):
+    """ Return the message as seen by the user, with the key
+        'is_this_user_reacted' added to each react.
+        The stored message is not modified, only the fields returned
+        to the user are copied.
 
     Args:
         uid (int): uid of the authorized user
         msg (dictionary): a message's info dictionary that contains
                           timestamp, message_id, reacts etc.
+
+    Returns:
+        (dictionary): the message's info dictionary for the user
     """
-    for react in msg['reacts']:
-        reacted = uid in react['u_ids']
-        react['is_this_user_reacted'] = reacted
-    return msg
+    return {
+        'message_id': msg['message_id'],
+        'u_id': msg['u_id'],
+        'message': msg['message'],
+        'time_created': msg['time_created'],
+        'reacts': [{
+            'react_id': react['react_id'],
+            'u_ids': list(react['u_ids']),
+            'is_this_user_reacted': uid in react['u_ids'],
+        } for react in msg['reacts']],
+        'is_pinned': msg['is_pinned'],
+    }
 
 
 def update_messages_with_react(uid, msg_returned):
-    """ Return the updated list of message dictionaries.
+    """ Return the list of message dictionaries as seen by the user.
 
     Args:
         uid (int): uid of the authorized user that calls the function
-        msg_returned (list): the message dictionaries without 'is_this_user_reacted'
+        msg_returned (list): the stored message dictionaries
 
     Returns:
-        (list): list of updated message dictionaries
+        (list): list of message dictionaries with 'is_this_user_reacted'
     """
-    return list(map(is_user_reacted, [uid] * len(msg_returned),
-                    msg_returned))
+    return [msg_view(uid, msg) for msg in msg_returned]
 
 
 def is_user_member(uid, channel_id):
@@ -105,6 +144,21 @@ def is_user_member(uid, channel_id):
     return uid in uc.channel[channel_id]['members']
 
 
+def add_member(uid, channel_id):
+    """ Add the user to the members of the channel, unless they are one already.
+        Members are numbered from uc.join_ids in the order they join, which is
+        how the order of 'in_channels' is recovered (see persistence.py).
+        The caller holds the lock of the channel.
+
+    Args:
+        uid (int): user joining the channel
+        channel_id (int): the channel
+    """
+    if uid not in uc.channel[channel_id]['members']:
+        uc.channel[channel_id]['members'][uid] = next(uc.join_ids)
+        uc.users[uid]['in_channels'][channel_id] = None
+
+
 def is_user_owner(uid, channel_id):
     """ Return if user is an owner of the channel
 
@@ -118,6 +172,23 @@ def is_user_owner(uid, channel_id):
     return uid in uc.channel[channel_id]['owners']
 
 
+def member_details(uid):
+    """ Return the details of a member shown in channel_details
+
+    Args:
+        uid (int): uid of the member
+
+    Returns:
+        (dict): {u_id, name_first, name_last, profile_img_url}
+    """
+    return {
+        'u_id': uid,
+        'name_first': uc.users[uid]['name_first'],
+        'name_last': uc.users[uid]['name_last'],
+        'profile_img_url': uc.users[uid]['profile_img_url'],
+    }
+
+
 def is_uid_valid(uid):
     """ To determine if the uid exists in the database.
 
@@ -155,16 +226,16 @@ def channel_invite(token, channel_id, u_id):
     is_channel_id_valid(channel_id)
     is_uid_valid(u_id)
 
-    if is_user_member(u_id, channel_id):
-        raise error.InputError("User you want to invite is already a member.")
+    with channel_lock(channel_id):
+        if is_user_member(u_id, channel_id):
+            raise error.InputError("User you want to invite is already a member.")
 
-    if not is_user_member(inviter, channel_id) \
-        and not is_user_owner(inviter, channel_id):
-        raise error.AccessError("You are not inside the channel yet.")
-
-    uc.channel[channel_id]['members'].append(u_id)
+        if not is_user_member(inviter, channel_id) \
+            and not is_user_owner(inviter, channel_id):
+            raise error.AccessError("You are not inside the channel yet.")
 
-    uc.users[u_id]['in_channels'].append(channel_id)
+        add_member(u_id, channel_id)
+        persistence.channel_changed(channel_id)
 
 
 def channel_details(token, channel_id):
@@ -181,38 +252,43 @@ def channel_details(token, channel_id):
         not is_user_owner(user, channel_id):
         raise error.AccessError("You are not inside the channel yet.")
 
-    owners = uc.channel[channel_id]['owners']
-    members = uc.channel[channel_id]['members']
-
-    owner_members = []
-    all_members = []
-
-    for index, u_id in enumerate(owners + members):
-        tmp = {'u_id': u_id,
-             'name_first': uc.users[u_id]['name_first'],
-             'name_last': uc.users[u_id]['name_last'],
-             'profile_img_url': uc.users[u_id]['profile_img_url']
-             }
-        if index < len(owners): owner_members.append(tmp)
-        else: all_members.append(tmp)
-
     return {
         'name': uc.channel[channel_id]['name'],
-        'owner_members': owner_members,
-        'all_members': all_members
+        # copied, the members can join and leave meanwhile (see locks.py)
+        'owner_members': [member_details(u_id)
+                          for u_id in list(uc.channel[channel_id]['owners'])],
+        'all_members': [member_details(u_id)
+                        for u_id in list(uc.channel[channel_id]['members'])]
     }
 
 
-def channel_messages(token, channel_id, start):
-    """ View messages in the channel, return a padding of at most 50
+def channel_messages(token, channel_id, start=0, before_message_id=None,
+                     after_message_id=None, limit=None):
+    """ View messages in the channel, return a padding of at most 50 (or limit)
+
+        The padding starts either at an offset from the newest message
+        (start), or at a message (before_message_id or after_message_id).
+        Offsets shift whenever a message is sent or removed, the message a
+        padding starts at doesn't: following the end returned with each
+        padding gives every message exactly once.
 
     :param token: token of the active user
     :param channel_id: channel_id that the user want to check message in
     :param start: the messasge that user wants to start checking
-    :return: (dict) contains a list of message's dictionary,
-             and start and end of the padding
+    :param before_message_id: message_id, the messages older than it are returned
+    :param after_message_id: message_id, the messages newer than it are returned
+    :param limit: most messages returned, MESSAGES_PAGE_SIZE if None
+    :return: (dict) contains a list of message's dictionary (newest first),
+             and start and end of the padding.
+             With before_message_id (or after_message_id), start is that
+             message_id and end the message_id to pass as before_message_id
+             (after_message_id) for the next padding, -1 when there is none.
+
+        InputError if limit is invalid, if both message_ids are given, or
+            if the message_id isn't a message of the channel (a message
+            removed from the channel still is one)
     """
-    padding = 50
+    padding = page_limit(limit, MESSAGES_PAGE_SIZE)
     active_user = token_to_uid(token)
     is_channel_id_valid(channel_id)
 
@@ -220,23 +296,20 @@ def channel_messages(token, channel_id, start):
        not is_user_owner(active_user, channel_id):
         raise error.AccessError("You are not inside the channel.")
 
-    all_msgs = uc.channel[channel_id]['messages']
+    if before_message_id is not None or after_message_id is not None:
+        return channel_messages_from(active_user, channel_id, before_message_id,
+                                     after_message_id, padding)
 
-    if start > len(all_msgs):
+    total = msg_log_count(channel_id)
+
+    if start > total:
         raise error.InputError("The message start over boundaries.")
 
-    exceed = len(all_msgs) < start + padding
+    exceed = total < start + padding
     end = -1 if exceed else start + padding
-    msgs_returned = deepcopy(all_msgs[start::]) \
-                    if exceed else deepcopy(all_msgs[start:end])
-
-    # don't show the message if it's timestamp > current time
-    msgs_returned = [msg for msg in msgs_returned \
-                    if msg['time_created'] <= generate_timestamp()]
-
-    # sort reversed according to timestamp
-    msgs_returned = sorted(msgs_returned,
-                           key=lambda x:x['time_created'], reverse=True)
+    # messages sent by message_send_later are only in the log once they are due,
+    # so the log is already sorted from the newest to the oldest message
+    msgs_returned = msg_log_newest(channel_id, start, padding)
 
     return {
         'messages': update_messages_with_react(active_user, msgs_returned),
@@ -245,6 +318,48 @@ def channel_messages(token, channel_id, start):
     }
 
 
+def channel_messages_from(uid, channel_id, before_message_id, after_message_id, padding):
+    """ The padding of channel_messages starting at a message.
+        The position of the message is looked up in the message index (or
+        bisected from uc.removed_msgs once it's removed), so seeking costs
+        about the same however large the channel is.
+
+    Args:
+        uid (int): the active user
+        channel_id (int): the channel
+        before_message_id, after_message_id, see channel_messages,
+            exactly one of them is given
+        padding (int): most messages returned
+
+    Returns:
+        (dict): see channel_messages
+    """
+    if before_message_id is not None and after_message_id is not None:
+        raise error.InputError("Only one of before_message_id and after_message_id can be given.")
+    msg_id = before_message_id if after_message_id is None else after_message_id
+
+    with channel_lock(channel_id):
+        position = msg_log_position(channel_id, msg_id)
+        if position is None:
+            raise error.InputError("The message is not in the channel.")
+        # one more message than the padding tells whether there is a next padding
+        if after_message_id is None:
+            msgs_returned = msg_log_older(channel_id, position, padding + 1)
+        else:
+            msgs_returned = msg_log_newer(channel_id, position, padding + 1)
+
+    end = msgs_returned[padding - 1]['message_id'] if len(msgs_returned) > padding else -1
+    msgs_returned = msgs_returned[:padding]
+    if after_message_id is not None:
+        msgs_returned.reverse()
+
+    return {
+        'messages': update_messages_with_react(uid, msgs_returned),
+        'start': msg_id,
+        'end': end,
+    }
+
+
 def channel_leave(token, channel_id):
     """ Given a channel ID, the user removed as a member of this channel
 
@@ -259,14 +374,14 @@ def channel_leave(token, channel_id):
     uid = token_to_uid(token)
     is_channel_id_valid(channel_id)
 
-    if not is_user_member(uid, channel_id):
-        raise error.AccessError("You are not in the channel yet.")
-
-    uc.users[uid]['in_channels'].remove(channel_id)
-    uc.channel[channel_id]['members'].remove(uid)
+    with channel_lock(channel_id):
+        if not is_user_member(uid, channel_id):
+            raise error.AccessError("You are not in the channel yet.")
 
-    if uid in uc.channel[channel_id]['owners']:
-        uc.channel[channel_id]['owners'].remove(uid)
+        del uc.users[uid]['in_channels'][channel_id]
+        del uc.channel[channel_id]['members'][uid]
+        uc.channel[channel_id]['owners'].pop(uid, None)
+        persistence.channel_changed(channel_id)
     return {}
 
 
@@ -291,16 +406,15 @@ def channel_join(token, channel_id):
     uid = token_to_uid(token)
     is_channel_id_valid(channel_id)
 
-    if not uc.channel[channel_id]['is_public'] and not is_global_owner(uid):
-        raise error.AccessError("You don't have permission to join this channel.")
+    with channel_lock(channel_id):
+        if not uc.channel[channel_id]['is_public'] and not is_global_owner(uid):
+            raise error.AccessError("You don't have permission to join this channel.")
 
-    # Avoid joining multiple times
-    if channel_id not in uc.users[uid]['in_channels']:
-        uc.users[uid]['in_channels'].append(channel_id)
-    if not is_user_member(uid, channel_id):
-        uc.channel[channel_id]['members'].append(uid)
-    if not is_user_owner(uid, channel_id) and is_global_owner(uid):
-        uc.channel[channel_id]['owners'].append(uid)
+        # Joining multiple times has no effect
+        add_member(uid, channel_id)
+        if is_global_owner(uid):
+            uc.channel[channel_id]['owners'][uid] = None
+        persistence.channel_changed(channel_id)
     return {}
 
 
@@ -316,21 +430,21 @@ def channel_addowner(token, channel_id, u_id):
     owner_uid = token_to_uid(token)
     is_channel_id_valid(channel_id)
 
-    if not is_user_owner(owner_uid, channel_id) and \
-       not is_global_owner(owner_uid):
-        raise error.AccessError("You are not an owner of the channel '\
+    with channel_lock(channel_id):
+        if not is_user_owner(owner_uid, channel_id) and \
+           not is_global_owner(owner_uid):
+            raise error.AccessError("You are not an owner of the channel '\
                                 ' or owner of the Flockr")
 
-    if is_user_owner(u_id, channel_id):
-        raise error.InputError("You are already an owner of the channel.")
+        if is_user_owner(u_id, channel_id):
+            raise error.InputError("You are already an owner of the channel.")
 
-    # add u_id to the owner of the channel
-    uc.channel[channel_id]['owners'].append(u_id)
+        # add u_id to the owner of the channel
+        uc.channel[channel_id]['owners'][u_id] = None
 
-    # add uid into members if s/he is not already a member
-    if u_id not in uc.channel[channel_id]['members']:
-        uc.channel[channel_id]['members'].append(u_id)
-        uc.users[u_id]['in_channels'].append(channel_id)
+        # add uid into members if s/he is not already a member
+        add_member(u_id, channel_id)
+        persistence.channel_changed(channel_id)
     return {}
 
 
@@ -345,20 +459,22 @@ def channel_removeowner(token, channel_id, u_id):
     owner_uid = token_to_uid(token)
     is_channel_id_valid(channel_id)
 
-    if is_global_owner(u_id):
-        raise error.InputError("Owner of flockr can't be removed '\
+    with channel_lock(channel_id):
+        if is_global_owner(u_id):
+            raise error.InputError("Owner of flockr can't be removed '\
                                'from owner of the channel.")
 
-    if not is_user_owner(owner_uid, channel_id) and \
-        not is_global_owner(owner_uid):
-        raise error.AccessError("You are not an owner of the channel '\
+        if not is_user_owner(owner_uid, channel_id) and \
+            not is_global_owner(owner_uid):
+            raise error.AccessError("You are not an owner of the channel '\
                                 ' or owner of the Flockr")
 
-    # make sure that the u_id is an owner of the channel
-    if not is_user_owner(u_id, channel_id):
-        raise error.InputError("The user you want to removed owner is '\
+        # make sure that the u_id is an owner of the channel
+        if not is_user_owner(u_id, channel_id):
+            raise error.InputError("The user you want to removed owner is '\
                                'not an owner of the channel")
 
-    # remove the u_id from being owner of channel.
-    uc.channel[channel_id]['owners'].remove(u_id)
+        # remove the u_id from being owner of channel.
+        del uc.channel[channel_id]['owners'][u_id]
+        persistence.channel_changed(channel_id)
     return {}
@@ -360,6 +360,36 @@ def test_channel_messages_more_50(urls, pre_test_setup):
     assert channel_messages['messages'][-1]['message'] == 'Hello 1'
 
 
+def test_channel_messages_before_message_id(urls, pre_test_setup):
+    """
+        check that channel_messages pages from a message
+    """
+    __, user_1, __, channel_public, __ = pre_test_setup
+
+    msg_send_data = {
+        'token': user_1['token'],
+        'channel_id': channel_public,
+        'message': "Hello World!",
+    }
+    msg_ids = [requests.post(urls['message_send'], json=msg_send_data).json()['message_id']
+               for __ in range(5)]
+
+    ch_msg_data = {
+        'token': user_1['token'],
+        'channel_id': channel_public,
+        'before_message_id': msg_ids[-1],
+        'limit': 3,
+    }
+    channel_messages = requests.get(urls['channel_messages'], params=ch_msg_data).json()
+    assert [msg['message_id'] for msg in channel_messages['messages']] == msg_ids[3:0:-1]
+    assert channel_messages['end'] == msg_ids[1]
+
+    ch_msg_data['before_message_id'] = channel_messages['end']
+    channel_messages = requests.get(urls['channel_messages'], params=ch_msg_data).json()
+    assert [msg['message_id'] for msg in channel_messages['messages']] == [msg_ids[0]]
+    assert channel_messages['end'] == -1
+
+
 def test_channel_messages_access_error(urls, pre_test_setup):
     """
         Access Error:
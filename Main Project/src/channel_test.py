@@ -19,6 +19,9 @@ Miriam Tuvel (z5257404)
 '''
 
 # Library
+import sys
+import threading
+
 import pytest
 
 # Files
@@ -28,6 +31,8 @@ import auth as au
 import other as o
 import message as msg
 import error
+import message_log
+import users_channels as uc
 
 
 # disable error W0621
@@ -779,6 +784,28 @@ def test_channel_messages_with_msgs(pre_test_setup):
     assert not latest_msg['reacts'][0]['is_this_user_reacted']
 
 
+def test_channel_messages_per_user_view(pre_test_setup):
+    """ 'is_this_user_reacted' depends on the user calling channel_messages,
+        and changing the returned messages doesn't change the stored messages.
+    """
+
+    __, token_1, token_2, channel_1 = pre_test_setup
+    ch.channel_join(token_2, channel_1)
+    msg_id = msg.message_send(token_1, channel_1, "Hello")['message_id']
+    msg.message_react(token_1, msg_id, 1)
+
+    msg_1 = ch.channel_messages(token_1, channel_1, 0)['messages'][0]
+    msg_2 = ch.channel_messages(token_2, channel_1, 0)['messages'][0]
+    assert msg_1['reacts'][0]['is_this_user_reacted']
+    assert not msg_2['reacts'][0]['is_this_user_reacted']
+
+    msg_1['message'] = "Changed"
+    msg_1['reacts'][0]['u_ids'].clear()
+    msg_1 = ch.channel_messages(token_1, channel_1, 0)['messages'][0]
+    assert msg_1['message'] == "Hello"
+    assert msg_1['reacts'][0]['u_ids'] == [msg_1['u_id']]
+
+
 def test_channel_messages_input_error_channel():
     """ Input Error
         channel_id does not refer to a valid channel
@@ -864,3 +891,144 @@ def test_channel_messages_over_50_msg(pre_test_setup):
 
     assert end == 50 and start == 0
     assert msg_list[0] == "Hello 50" and msg_list[-1] == "Hello 1"
+
+
+def test_channel_messages_before_message_id(pre_test_setup):
+    """ Following the end returned with each padding gives every message once,
+        even if messages are sent and removed in between.
+    """
+    __, token_1, __, channel_1 = pre_test_setup
+    msg_ids = [msg.message_send(token_1, channel_1, f"Hello {i}")['message_id']
+               for i in range(10)]
+
+    first = ch.channel_messages(token_1, channel_1, before_message_id=msg_ids[-1], limit=4)
+    assert [each['message_id'] for each in first['messages']] == msg_ids[8:4:-1]
+    assert first['start'] == msg_ids[-1] and first['end'] == msg_ids[5]
+
+    # sending or removing messages doesn't shift the next padding
+    msg.message_send(token_1, channel_1, "Newest")
+    msg.message_remove(token_1, msg_ids[4])
+    second = ch.channel_messages(token_1, channel_1, before_message_id=first['end'], limit=4)
+    assert [each['message_id'] for each in second['messages']] == msg_ids[3::-1]
+    assert second['end'] == -1
+
+
+def test_channel_messages_after_message_id(pre_test_setup):
+    """ The messages after a message are the ones closest to it, newest first """
+    __, token_1, __, channel_1 = pre_test_setup
+    msg_ids = [msg.message_send(token_1, channel_1, f"Hello {i}")['message_id']
+               for i in range(10)]
+
+    first = ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[0], limit=4)
+    assert [each['message_id'] for each in first['messages']] == msg_ids[4:0:-1]
+    assert first['end'] == msg_ids[4]
+
+    second = ch.channel_messages(token_1, channel_1, after_message_id=first['end'], limit=5)
+    assert [each['message_id'] for each in second['messages']] == msg_ids[9:4:-1]
+    assert second['end'] == -1
+
+
+def test_channel_messages_cursor_input_error(pre_test_setup):
+    """ The message must be a message of the channel, and the limit valid """
+    __, token_1, token_2, channel_1 = pre_test_setup
+    msg_id = msg.message_send(token_1, channel_1, "Hello")['message_id']
+    channel_2 = chs.channels_create(token_2, "Channel_2", True)['channel_id']
+    other_id = msg.message_send(token_2, channel_2, "Hello")['message_id']
+
+    with pytest.raises(error.InputError):
+        ch.channel_messages(token_1, channel_1, before_message_id=other_id)
+    with pytest.raises(error.InputError):
+        ch.channel_messages(token_1, channel_1, before_message_id=msg_id,
+                            after_message_id=msg_id)
+    with pytest.raises(error.InputError):
+        ch.channel_messages(token_1, channel_1, before_message_id=msg_id, limit=0)
+
+    msg.message_remove(token_2, other_id)
+    with pytest.raises(error.InputError):
+        ch.channel_messages(token_1, channel_1, after_message_id=other_id)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_channel_messages_removed_cursor(pre_test_setup, monkeypatch, compact):
+    """ A padding can start at a message removed since the previous padding,
+        also once its tombstone is compacted away
+    """
+    __, token_1, __, channel_1 = pre_test_setup
+    if compact:
+        monkeypatch.setattr(message_log, 'COMPACT_MIN_TOMBSTONES', 1)
+    msg_ids = [msg.message_send(token_1, channel_1, f"Hello {i}")['message_id']
+               for i in range(10)]
+
+    first = ch.channel_messages(token_1, channel_1, before_message_id=msg_ids[-1], limit=3)
+    assert first['end'] == msg_ids[6]
+    # removing more than half of the log compacts it
+    for msg_id in (msg_ids[6], msg_ids[7], msg_ids[8], msg_ids[9], msg_ids[2], msg_ids[1]):
+        msg.message_remove(token_1, msg_id)
+    assert (uc.channel[channel_1]['msg_tombstones'] == 0) == compact
+
+    older = ch.channel_messages(token_1, channel_1, before_message_id=first['end'], limit=3)
+    assert [each['message_id'] for each in older['messages']] == \
+        [msg_ids[5], msg_ids[4], msg_ids[3]]
+    assert older['end'] == msg_ids[3]
+
+    newer = ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[2])
+    assert [each['message_id'] for each in newer['messages']] == msg_ids[5:2:-1]
+    assert newer['end'] == -1
+    assert ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[9])['messages'] == []
+
+    # the removed message stays between the same messages after another compaction
+    for msg_id in (msg_ids[4], msg_ids[0], msg_ids[3]):
+        msg.message_remove(token_1, msg_id)
+    assert (uc.channel[channel_1]['msg_tombstones'] == 0) == compact
+    older = ch.channel_messages(token_1, channel_1, before_message_id=first['end'])
+    assert [each['message_id'] for each in older['messages']] == [msg_ids[5]]
+    newer = ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[1])
+    assert [each['message_id'] for each in newer['messages']] == [msg_ids[5]]
+
+
+def test_channel_messages_removed_cursor_forgotten(pre_test_setup, monkeypatch):
+    """ Only the latest removed messages of a channel can start a padding """
+    __, token_1, __, channel_1 = pre_test_setup
+    monkeypatch.setattr(message_log, 'REMOVED_MSGS_KEPT', 2)
+    msg_ids = [msg.message_send(token_1, channel_1, f"Hello {i}")['message_id']
+               for i in range(4)]
+    for msg_id in msg_ids[:3]:
+        msg.message_remove(token_1, msg_id)
+
+    assert list(uc.removed_msgs[channel_1]) == msg_ids[1:3]
+    with pytest.raises(error.InputError):
+        ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[0])
+    newer = ch.channel_messages(token_1, channel_1, after_message_id=msg_ids[1])
+    assert [each['message_id'] for each in newer['messages']] == [msg_ids[3]]
+
+
+def test_channel_read_while_joining(pre_test_setup):
+    """ channel_details, channels_list and search while users join and leave
+        channels on another thread
+    """
+    __, token_1, token_2, channel_1 = pre_test_setup
+    channel_ids = [channel_1] + [chs.channels_create(token_2, f"Channel {i}", True)['channel_id']
+                                 for i in range(20)]
+    tokens = [au.auth_register(f"z{i}@unsw.edu.au", "passWord", "First", "Last")['token']
+              for i in range(50)]
+
+    def join_all():
+        for __ in range(5):
+            for token in tokens:
+                for channel_id in channel_ids:
+                    ch.channel_join(token, channel_id)
+                for channel_id in channel_ids:
+                    ch.channel_leave(token, channel_id)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        worker = threading.Thread(target=join_all)
+        worker.start()
+        while worker.is_alive():
+            ch.channel_details(token_1, channel_1)
+            chs.channels_list(tokens[0])
+            o.search(tokens[0], "Hello")
+        worker.join()
+    finally:
+        sys.setswitchinterval(interval)
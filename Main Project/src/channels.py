@@ -8,6 +8,9 @@ Reviewed by: Yiyang Huang z5313425, 29/09/2020
 # Import files
 import users_channels as data
 from channel import token_to_uid
+import persistence
+from locks import channels_lock
+from pagination import page
 import error
 
 
@@ -27,7 +30,8 @@ def channels_list(token):
 
     channel_list = []
     # Create a list of channel (extract the list that the user is member of)
-    for channel_id in data.users[u_id]['in_channels']:
+    # copied, the user can join and leave channels meanwhile (see locks.py)
+    for channel_id in list(data.users[u_id]['in_channels']):
         channel_tmp = {
             'channel_id': channel_id,
             'name': data.channel[channel_id]['name'],
@@ -39,20 +43,30 @@ def channels_list(token):
     return {'channels': channel_list}
 
 
-def channels_listall(token):
-    """ Provide a list of all channels (and their associated details)
+def channels_listall(token, limit=None, cursor=None):
+    """ Provide a list of all channels (and their associated details),
+        or a page of it when limit or cursor is given (see pagination.py)
     :param token: token of a user
+    :param limit: most channels in the page
+    :param cursor: cursor of the page, returned as next_cursor with the previous page
     :return:
         channels (List of dictionaries, where each dictionary contains types { channel_id, name })
+        next_cursor (str) only when paginated, '' after the last page
 
         AccessError if token is invalid
+        InputError if limit or cursor is invalid
     """
     # Check token is valid
     __ = token_to_uid(token)
 
+    if limit is None and cursor is None:
+        channel_ids, next_cursor = list(data.channel), None
+    else:
+        channel_ids, next_cursor = page(data.channel, 'channels', limit, cursor)
+
     channel_list = []
     # Create a list of all channel (extract the list from data.channel)
-    for channel_id in data.channel:
+    for channel_id in channel_ids:
         channel_tmp = {
             'channel_id': channel_id,
             'name': data.channel[channel_id]['name'],
@@ -61,7 +75,9 @@ def channels_listall(token):
         channel_copy = channel_tmp.copy()
         channel_list.append(channel_copy)
 
-    return {'channels': channel_list}
+    if next_cursor is None:
+        return {'channels': channel_list}
+    return {'channels': channel_list, 'next_cursor': next_cursor}
 
 
 def channels_create(token, name, is_public):
@@ -95,24 +111,29 @@ def channels_create(token, name, is_public):
     #     if data.channel[channel_id].get('name') == name:
     #         raise error.InputError(f"Name '{name}' is already taken")
 
-    # create channel id in numerical order
-    channel_id = int(len(data.channel))
-
-    # add users information
-    data.channel[channel_id] = dict({
-        'name': name,
-        'members': [creator_id],
-        'owners': [creator_id],
-        'is_public': is_public,
-        'messages': [],
-        'standup': {
-            'is_active': False,
-            'token': '',
-            'time_finish': None,
-            'messages': []
-        }
-    })
-    data.users[creator_id]['in_channels'].append(channel_id)
+    with channels_lock:
+        # create channel id in numerical order
+        channel_id = int(len(data.channel))
+
+        # add users information
+        data.channel[channel_id] = dict({
+            'name': name,
+            'members': {creator_id: next(data.join_ids)},
+            'owners': {creator_id: None},
+            'is_public': is_public,
+            'messages': [],
+            'msg_seqs': [],
+            'next_seq': 0,
+            'msg_tombstones': 0,
+            'standup': {
+                'is_active': False,
+                'token': '',
+                'time_finish': None,
+                'messages': []
+            }
+        })
+        data.users[creator_id]['in_channels'][channel_id] = None
+        persistence.channel_changed(channel_id)
 
     return {
         'channel_id': channel_id,
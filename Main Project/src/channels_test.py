@@ -109,6 +109,24 @@ def test_channels_listall():  # Correct Behaviour
     assert channel_list == expected
 
 
+def test_channels_listall_pages():
+    """
+    Paging through channels_listall with a limit returns every channel once
+    """
+    other.clear()
+    token = au.auth_register("z1111111@ad.unsw.edu.au", "Password123", "Testing", "Subject")['token']
+    for i in range(7):
+        chs.channels_create(token, f'Channel_{i}', True)
+
+    pages = [chs.channels_listall(token, limit=3)]
+    while pages[-1]['next_cursor'] != '':
+        pages.append(chs.channels_listall(token, limit=3, cursor=pages[-1]['next_cursor']))
+
+    assert [len(page['channels']) for page in pages] == [3, 3, 1]
+    assert [channel for page in pages for channel in page['channels']] == \
+        chs.channels_listall(token)['channels']
+
+
 def test_channels_listall_error():
     """
     Test for error if invalid token is put
@@ -0,0 +1,99 @@
+""" Compression of the responses of the routes returning large lists.
+
+    The response is compressed with the best encoding the client accepts
+    (see negotiate), brotli when the brotli package is installed, else gzip,
+    else deflate. Responses smaller than config.COMPRESS_MIN_BYTES are sent
+    as they are, compressing them saves too little.
+
+    Compressed responses are cached, keyed by the request (url, host and
+    encoding) and stored with the version of the data the response is built
+    from when the request started (fragments.data_version of e.g. every user
+    for /users/all, the channel and the users for /channel/details, see
+    server.compressed_version). A cached response is only valid while that
+    version is unchanged, so a change to another channel or to a message
+    doesn't drop it. A response is only cached if its version didn't change
+    while it was built.
+
+@date 18/10/2026
+"""
+
+import gzip
+import threading
+import zlib
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# most compressed responses cached, the cache is emptied once it holds more
+RESPONSES_CACHED = 1000
+
+# compression of each encoding, from the most to the least preferred
+ENCODINGS = {
+    'gzip': lambda body: gzip.compress(body, compresslevel=6),
+    'deflate': lambda body: zlib.compress(body, 6),
+}
+if brotli is not None:
+    ENCODINGS = {'br': lambda body: brotli.compress(body, quality=5), **ENCODINGS}
+
+# maps the key of the request to (version of its data, compressed body)
+cache = {}
+cache_lock = threading.Lock()
+
+
+def negotiate(accept_encodings):
+    """ Return the preferred encoding the client accepts.
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): the parsed
+            Accept-Encoding header of the request
+
+    Returns:
+        (str): the encoding, None to send the response uncompressed
+    """
+    for encoding in ENCODINGS:
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def cached(key, version):
+    """ Return the compressed body cached for the request, if still valid.
+
+    Args:
+        key (tuple): key of the request, including its encoding
+        version (int): version of the data of the request now
+
+    Returns:
+        (bytes): the compressed body, None when not cached
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    return None
+
+
+def compress(key, version, body, unchanged):
+    """ Compress the body of the response, and cache it.
+
+    Args:
+        key (tuple): key of the request, its encoding last
+        version (int): version of the data of the request when it started
+        body (bytes): the uncompressed body
+        unchanged (bool): whether the version didn't change while the body was built
+
+    Returns:
+        (bytes): the compressed body, None when the body is too small to compress
+    """
+    if len(body) < config.COMPRESS_MIN_BYTES:
+        return None
+    compressed = ENCODINGS[key[-1]](body)
+    if unchanged:
+        with cache_lock:
+            if len(cache) >= RESPONSES_CACHED:
+                cache.clear()
+            cache[key] = (version, compressed)
+    return compressed
@@ -0,0 +1,48 @@
+'''
+Tests for compression.py
+'''
+
+# Libraries
+import gzip
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+# src files
+import compression
+import config
+
+
+def test_negotiate():
+    """ The preferred encoding the client accepts is chosen """
+    assert compression.negotiate(parse_accept_header('gzip, deflate')) == 'gzip'
+    assert compression.negotiate(parse_accept_header('deflate')) == 'deflate'
+    assert compression.negotiate(parse_accept_header('gzip;q=0, deflate')) == 'deflate'
+    assert compression.negotiate(parse_accept_header('identity')) is None
+    assert compression.negotiate(parse_accept_header('')) is None
+
+
+def test_compress_threshold():
+    """ Only bodies of at least COMPRESS_MIN_BYTES are compressed """
+    small = b'x' * (config.COMPRESS_MIN_BYTES - 1)
+    assert compression.compress(('/small', 'gzip'), 1, small, True) is None
+
+    body = b'{"users":[' + b'{"u_id":0},' * 1000 + b']}'
+    assert gzip.decompress(compression.compress(('/gzip', 'gzip'), 1, body, True)) == body
+    assert zlib.decompress(compression.compress(('/deflate', 'deflate'), 1, body, True)) == body
+
+
+def test_cached_until_changed():
+    """ The compressed body is only cached if nothing changed while it was
+        built, and only valid while nothing changes
+    """
+    compression.cache.clear()
+    body = b'[' + b'1,' * 1000 + b'1]'
+
+    compressed = compression.compress(('/users/all', 'gzip'), 5, body, True)
+    assert compression.cached(('/users/all', 'gzip'), 5) == compressed
+    assert compression.cached(('/users/all', 'gzip'), 6) is None
+    assert compression.cached(('/users/all', 'deflate'), 5) is None
+
+    compression.compress(('/channels/listall', 'gzip'), 5, body, False)
+    assert compression.cached(('/channels/listall', 'gzip'), 5) is None
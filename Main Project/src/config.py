@@ -0,0 +1,68 @@
+""" Configuration of the Flockr server, read from the environment variables.
+
+    FLOCKR_STORAGE          where the data is persisted (see persistence.py),
+                            'memory' (default, nothing is persisted),
+                            'wal' (see wal_store.py) or 'sqlite' (see sqlite_store.py)
+    FLOCKR_DATA_DIR         directory of the persisted data, only one server
+                            can use it at a time
+    FLOCKR_WAL_FSYNC        '0' to skip the fsync after each write of the WAL
+                            (for 'sqlite', PRAGMA synchronous = NORMAL instead of FULL)
+    FLOCKR_SNAPSHOT_EVERY   amount of WAL records written between two snapshots
+
+    FLOCKR_MAIL_TRANSPORT   how mails are sent (see mailer.py), 'smtp' (default),
+                            'file' (written to FLOCKR_MAIL_DIR) or 'memory'
+    FLOCKR_MAIL_DIR         directory of the mails sent by the 'file' transport
+    FLOCKR_SMTP_HOST        host and port of the SMTP (over SSL) server
+    FLOCKR_SMTP_PORT
+    FLOCKR_SMTP_USER        account the mails are sent from
+    FLOCKR_SMTP_PASSWORD
+    FLOCKR_MAIL_RETRIES     times a mail is retried before it's dropped
+    FLOCKR_MAIL_BACKOFF     seconds before the first retry, doubled every retry
+
+    FLOCKR_HASH_ITERATIONS  PBKDF2 iterations of the password hashes (see hashing.py)
+    FLOCKR_HASH_WORKERS     processes hashing the passwords, defaults to the amount
+                            of CPUs, '0' to hash on the request thread instead
+
+    FLOCKR_JSON_ENCODER     encoder of the responses (see fragments.py), 'orjson'
+                            (default, when installed) or 'json'
+    FLOCKR_COMPRESS_MIN_BYTES
+                            smallest response compressed (see compression.py)
+
+    FLOCKR_IMG_MAX_BYTES    largest image downloaded by user_profile_uploadphoto
+    FLOCKR_IMG_TIMEOUT      seconds the download of the image may take
+    FLOCKR_PUBLIC_URL       base url of the server in the urls of the photos, e.g.
+                            'https://flockr.example.com/', defaults to the url
+                            each request was sent to
+    FLOCKR_IMG_WORKERS      processes cropping the photos of the upload jobs (see
+                            images.py), defaults to the amount of CPUs, '0' to
+                            crop on the job's thread instead
+
+@date 18/10/2026
+"""
+
+import os
+
+STORAGE = os.environ.get('FLOCKR_STORAGE', 'memory')
+DATA_DIR = os.environ.get('FLOCKR_DATA_DIR', 'data')
+WAL_FSYNC = os.environ.get('FLOCKR_WAL_FSYNC', '1') != '0'
+SNAPSHOT_EVERY = int(os.environ.get('FLOCKR_SNAPSHOT_EVERY', '100000'))
+
+MAIL_TRANSPORT = os.environ.get('FLOCKR_MAIL_TRANSPORT', 'smtp')
+MAIL_DIR = os.environ.get('FLOCKR_MAIL_DIR', 'mail')
+SMTP_HOST = os.environ.get('FLOCKR_SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('FLOCKR_SMTP_PORT', '465'))
+SMTP_USER = os.environ.get('FLOCKR_SMTP_USER', 'comp1531.20t3.flockr@gmail.com')
+SMTP_PASSWORD = os.environ.get('FLOCKR_SMTP_PASSWORD', 'Flockr-COMP1531')
+MAIL_RETRIES = int(os.environ.get('FLOCKR_MAIL_RETRIES', '5'))
+MAIL_BACKOFF = float(os.environ.get('FLOCKR_MAIL_BACKOFF', '1'))
+
+HASH_ITERATIONS = int(os.environ.get('FLOCKR_HASH_ITERATIONS', '310000'))
+HASH_WORKERS = int(os.environ.get('FLOCKR_HASH_WORKERS', str(os.cpu_count() or 1)))
+
+JSON_ENCODER = os.environ.get('FLOCKR_JSON_ENCODER', 'orjson')
+COMPRESS_MIN_BYTES = int(os.environ.get('FLOCKR_COMPRESS_MIN_BYTES', '1024'))
+
+IMG_MAX_BYTES = int(os.environ.get('FLOCKR_IMG_MAX_BYTES', str(10 * 1024 * 1024)))
+IMG_TIMEOUT = float(os.environ.get('FLOCKR_IMG_TIMEOUT', '10'))
+PUBLIC_URL = os.environ.get('FLOCKR_PUBLIC_URL', '')
+IMG_WORKERS = int(os.environ.get('FLOCKR_IMG_WORKERS', str(os.cpu_count() or 1)))
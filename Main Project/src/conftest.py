@@ -5,36 +5,53 @@
 @date 2020/11/04
 """
 
+import io
 import json
+import os
 import re
 import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from subprocess import PIPE, Popen
 from time import sleep, time
 
 import pytest
 import requests
+from PIL import Image
 
 # emails
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
-import imaplib
 import email
 
+# Hash the passwords with few iterations, so registering the users of the tests
+# (and of the servers started by the tests) stays fast. Read by config.py
+os.environ.setdefault('FLOCKR_HASH_ITERATIONS', '1000')
+
 # # ------------------------ pytest fixtures for server url ------------------------ #
 
 
 # pylint: disable=redefined-outer-name
 @pytest.fixture
-def url():
+def mail_dir(tmp_path):
+    """ Directory the mails of the server started by url are written to
+        (the 'file' mail transport), empty when the test starts.
+
+        :Return: (str) path of the directory
+    """
+    return str(tmp_path / 'mail')
+
+
+@pytest.fixture
+def url(mail_dir):
     """ Imported from echo_http_test.py.
         Use this fixture to get the URL of the server.
         It starts the server for you, so you don't need to.
+        The server writes its mails to mail_dir instead of sending them.
 
         :Return: (str) url for the server
     """
     url_re = re.compile(r' \* Running on ([^ ]*)')
-    server = Popen(["python3", "src/server.py"], stderr=PIPE, stdout=PIPE)
+    env = dict(os.environ, FLOCKR_MAIL_TRANSPORT='file', FLOCKR_MAIL_DIR=mail_dir)
+    server = Popen(["python3", "src/server.py"], stderr=PIPE, stdout=PIPE, env=env)
     line = server.stderr.readline()
     local_url = url_re.match(line.decode())
     if local_url:
@@ -340,7 +357,30 @@ def auth_register_setup(urls, data_setup):  # pragma: no cover
 
 
 @pytest.fixture
-def auth_passwordreset_setup(urls, auth_register_setup, data_setup):    # pragma: no cover
+def read_reset_code(mail_dir):
+    """ Returns a function waiting for the mail sent to an email by the server
+        and returning the reset code in it.
+        Only the mails sent since the test started are in mail_dir.
+    """
+    def read(target_email, timeout=10):
+        deadline = time() + timeout
+        while True:
+            names = sorted(os.listdir(mail_dir)) if os.path.isdir(mail_dir) else []
+            for name in reversed(names):
+                with open(os.path.join(mail_dir, name)) as file:
+                    mail = email.message_from_file(file)
+                if mail['To'] == target_email:
+                    body = mail.get_payload(decode=True).decode()
+                    return body.partition("Security code: ")[2].rstrip()
+            if time() > deadline:
+                raise Exception(f"No mail sent to {target_email}")
+            sleep(0.05)
+
+    return read
+
+
+@pytest.fixture
+def auth_passwordreset_setup(urls, auth_register_setup, data_setup, read_reset_code):  # pragma: no cover
     """ pytest fixture that sends a reset_code to a user email.
 
     Parameter:
@@ -363,17 +403,59 @@ def auth_passwordreset_setup(urls, auth_register_setup, data_setup):    # pragma
     }
     requests.post(urls['auth_request'], json=data)
 
-    # Recieve email.
-    mail = imaplib.IMAP4_SSL('imap.gmail.com')
-    mail.login(data_setup[0]['email'], 'Flockr-COMP1531')
-    mail.select(readonly=True)
-    __, message_ids = mail.search(None, 'ALL')
-    # Get the latest email received.
-    msg_ids = message_ids[0].split()
-    latest_msg = msg_ids[-1]
-    __, message_data = mail.fetch(latest_msg, '(RFC822)')
-    # Get the message content needed from the latest email.
-    msg = email.message_from_bytes(message_data[0][1]).get_payload()
-    reset_code = msg.partition("Security code: ")[2].rstrip()
+    # Recieve email, written by the server to mail_dir.
+    reset_code = read_reset_code(data_setup[0]['email'])
 
     return reset_code, u_id
+
+
+@pytest.fixture
+def image_server():
+    """ Local HTTP server standing in for the image host, serving a 300x200
+        JPG at /photo.jpg and /photo.png (and 404 for anything else).
+        The JPG is also served without Content-Length at /stream.jpg, and
+        10 bytes every 0.1 seconds at /slow.jpg.
+
+    Returns:
+        (tuple): (url of the server, list of the paths requested)
+    """
+    photo = io.BytesIO()
+    Image.new('RGB', (300, 200), (255, 0, 0)).save(photo, 'JPEG')
+    content = photo.getvalue()
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        """ Serves the photo """
+        def do_GET(self): # pylint: disable=invalid-name
+            """ Serves the photo at its paths """
+            requested.append(self.path)
+            if self.path not in ('/photo.jpg', '/photo.png', '/stream.jpg', '/slow.jpg'):
+                self.send_error(404)
+                return
+            self.send_response(200)
+            if self.path in ('/photo.jpg', '/photo.png'):
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            # the end of the photo is the end of the connection
+            self.end_headers()
+            chunk_size = 10 if self.path == '/slow.jpg' else 1024
+            try:
+                for start in range(0, len(content), chunk_size):
+                    self.wfile.write(content[start:start + chunk_size])
+                    self.wfile.flush()
+                    if self.path == '/slow.jpg':
+                        sleep(0.1)
+            except OSError:
+                # the client gave up on the photo
+                pass
+
+        def log_message(self, *args): # pylint: disable=arguments-differ
+            """ Keep the test output quiet """
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', requested
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,173 @@
+""" JSON encoding of the responses, caching the encoded records.
+
+    The routes returning lists (/channel/messages, /users/all and
+    /channels/listall) mostly return the same records poll after poll. Each
+    record (a message, a user, a channel) is encoded once and the encoded
+    bytes are cached, and the response is spliced together from them.
+
+    Every entity has a version, bumped by the persistence hooks whenever it
+    changes (see persistence.py). A cached record is only used while the
+    version of its entity is the one it was encoded at. A record is only
+    cached when its entity didn't change since the request started, so a
+    record built just before a change is never cached as the new version.
+    data_version gives the version of a larger part of the data (e.g. every
+    user, the messages of some channels), used by compression.py.
+
+    The records are encoded with orjson when it's installed, json otherwise
+    (see ENCODERS and config.JSON_ENCODER).
+
+@date 18/10/2026
+"""
+
+import itertools
+import json
+import threading
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# most encoded records cached, the cache is emptied once it holds more
+FRAGMENTS_CACHED = 200000
+
+# version of each entity, maps ('user', u_id), ('channel', channel_id) or
+# ('message', message_id) to the version (taken from change_ids), and
+# ('channel_messages', channel_id) to the version of the latest change to
+# a message of the channel
+versions = {}
+# version of the latest change to an entity of each kind, e.g. 'user'
+kind_versions = {}
+change_ids = itertools.count(1)
+# version of the latest change, only ever increases
+last_change = 0
+# version of the latest clear, every data_version is at least this
+cleared = 0
+version_lock = threading.Lock()
+# maps the key of the record to (version of its entity, encoded record)
+cache = {}
+
+
+def json_encode(obj):
+    """ Encode obj with the standard library """
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+ENCODERS = {'json': json_encode}
+if orjson is not None:
+    ENCODERS['orjson'] = orjson.dumps
+
+
+def encode(obj):
+    """ Return obj encoded as JSON (bytes), with config.JSON_ENCODER """
+    return ENCODERS.get(config.JSON_ENCODER, json_encode)(obj)
+
+
+def entity_changed(kind, entity_id, channel_id=None):
+    """ Bump the version of the entity, called after every change to it.
+
+    Args:
+        kind (str): 'user', 'channel' or 'message'
+        entity_id (int): the id of the entity
+        channel_id (int): channel of the message, whose 'channel_messages'
+                          version is bumped too
+    """
+    global last_change
+
+    with version_lock:
+        version = next(change_ids)
+        versions[(kind, entity_id)] = version
+        if channel_id is not None:
+            versions[('channel_messages', channel_id)] = version
+        kind_versions[kind] = version
+        last_change = version
+
+
+def clear():
+    """ Drop every version and cached record, after the data is cleared """
+    global last_change, cleared
+
+    with version_lock:
+        versions.clear()
+        kind_versions.clear()
+        cache.clear()
+        last_change = cleared = next(change_ids)
+
+
+def data_version(entities=(), kinds=()):
+    """ Return the version of the part of the data made of the entities and
+        every entity of the kinds, it changes whenever one of them changes.
+
+    Args:
+        entities (iterable): keys of versions, e.g. ('channel', channel_id)
+        kinds (iterable): kinds of entities, see entity_changed
+
+    Returns:
+        (int): the latest version among them
+    """
+    return max([cleared] + [versions.get(entity, 0) for entity in entities] +
+               [kind_versions.get(kind, 0) for kind in kinds])
+
+
+def encode_record(key, entity, record, since):
+    """ Return the record encoded, from the cache when it's still valid.
+
+    Args:
+        key (tuple): key of the encoded record, (entity + anything else the
+                     encoded record depends on, e.g. the user viewing it)
+        entity (tuple): (kind, entity_id) of the entity the record shows
+        record (dict): the record
+        since (int): last_change when the request started
+
+    Returns:
+        (bytes): the encoded record
+    """
+    version = versions.get(entity, 0)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    encoded = encode(record)
+    if version <= since:
+        if len(cache) >= FRAGMENTS_CACHED:
+            cache.clear()
+        cache[key] = (version, encoded)
+    return encoded
+
+
+def encode_records(records, kind, id_key, since, variant=None):
+    """ Return the JSON list of the records, each encoded with encode_record.
+
+    Args:
+        records (list): the records, each showing one entity
+        kind (str): kind of the entities, see entity_changed
+        id_key (str): key of the entity_id in the records
+        since (int): last_change when the request started
+        variant (function): given a record, returns what else the encoded
+                            record depends on, None if nothing
+    """
+    return encode_list([
+        encode_record((kind, record[id_key], variant(record) if variant else None),
+                      (kind, record[id_key]), record, since)
+        for record in records
+    ])
+
+
+def encode_list(encoded_records):
+    """ Return the JSON list of the encoded records """
+    return b'[' + b','.join(encoded_records) + b']'
+
+
+def encode_object(fields):
+    """ Return the JSON object of the fields.
+
+    Args:
+        fields (dict): the fields, each value either already encoded (bytes)
+                       or encoded with encode
+    """
+    return b'{' + b','.join(
+        encode(name) + b':' + (value if isinstance(value, bytes) else encode(value))
+        for name, value in fields.items()
+    ) + b'}'
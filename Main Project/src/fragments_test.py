@@ -0,0 +1,100 @@
+'''
+Tests for fragments.py
+'''
+
+# Libraries
+import json
+
+import pytest
+
+# src files
+import auth as au
+import channels as chs
+import config
+import fragments
+import message as msg
+import other
+import user as u
+
+
+# pylint: disable=unused-argument
+
+@pytest.fixture(name='reset_dict')
+def reset():
+    """ Clear the data before each test """
+    other.clear()
+
+
+@pytest.mark.parametrize('encoder', sorted(fragments.ENCODERS))
+def test_encode_object(monkeypatch, encoder):
+    """ Spliced responses decode to the same data with every encoder """
+    monkeypatch.setattr(config, 'JSON_ENCODER', encoder)
+    records = [{'u_id': 0, 'name': 'Hayden'}, {'u_id': 1, 'name': 'Jacobs é'}]
+    encoded = fragments.encode_object({
+        'users': fragments.encode_list([fragments.encode(record) for record in records]),
+        'end': -1,
+    })
+    assert json.loads(encoded) == {'users': records, 'end': -1}
+
+
+def test_cached_until_changed(reset_dict):
+    """ The encoded record is reused until its entity changes """
+    user = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    since = fragments.last_change
+
+    first = fragments.encode_record(('user', 0), ('user', 0), {'name': 'first'}, since)
+    # the cached record is returned while the entity is unchanged
+    assert fragments.encode_record(('user', 0), ('user', 0), {'name': 'other'}, since) is first
+
+    u.user_profile_setname(user['token'], 'new_first', 'name_last')
+    changed = fragments.encode_record(('user', 0), ('user', 0), {'name': 'new'}, since)
+    assert json.loads(changed) == {'name': 'new'}
+
+
+def test_not_cached_when_changed_during_request(reset_dict):
+    """ A record built before its entity changed is never cached as the new version """
+    user = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    since = fragments.last_change
+    u.user_profile_setname(user['token'], 'new_first', 'name_last')
+
+    fragments.encode_record(('user', 0), ('user', 0), {'name': 'old'}, since)
+    assert ('user', 0) not in fragments.cache
+
+    since = fragments.last_change
+    fragments.encode_record(('user', 0), ('user', 0), {'name': 'new'}, since)
+    assert json.loads(fragments.cache[('user', 0)][1]) == {'name': 'new'}
+
+
+def test_data_version(reset_dict):
+    """ The version of a part of the data only changes with the entities in it """
+    user = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    channel_1 = chs.channels_create(user['token'], 'channel_1', True)['channel_id']
+    channel_2 = chs.channels_create(user['token'], 'channel_2', True)['channel_id']
+    msg_id = msg.message_send(user['token'], channel_1, 'hello')['message_id']
+
+    users = fragments.data_version(kinds=('user',))
+    messages_1 = fragments.data_version([('channel_messages', channel_1)])
+    messages_2 = fragments.data_version([('channel_messages', channel_2)])
+    assert messages_1 > messages_2
+
+    msg.message_send(user['token'], channel_2, 'hello')
+    assert fragments.data_version(kinds=('user',)) == users
+    assert fragments.data_version([('channel_messages', channel_1)]) == messages_1
+    assert fragments.data_version([('channel_messages', channel_2)]) > messages_2
+
+    msg.message_remove(user['token'], msg_id)
+    assert fragments.data_version([('channel_messages', channel_1)]) > messages_1
+    u.user_profile_setname(user['token'], 'new_first', 'name_last')
+    assert fragments.data_version(kinds=('user',)) > users
+
+    version = fragments.data_version([('channel', channel_1)], ('user',))
+    other.clear()
+    assert fragments.data_version([('channel', channel_1)], ('user',)) > version
+
+
+def test_clear(reset_dict):
+    """ Clearing the data drops the cached records """
+    au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    fragments.encode_record(('user', 0), ('user', 0), {}, fragments.last_change)
+    other.clear()
+    assert not fragments.cache and not fragments.versions and not fragments.kind_versions
@@ -0,0 +1,94 @@
+""" Group commit of the records appended to a storage (see persistence.py)
+
+    The callers only append items into a buffer. A single writer thread passes
+    every buffered item at once to the storage's write_batch function, so
+    concurrent requests share the cost of a write (e.g. one fsync or one
+    transaction). A caller that needs its items to be durable (e.g. before
+    replying to a request) calls wait().
+
+@date 18/10/2026
+"""
+
+import threading
+
+# guards the variables below, notified when items are appended or written
+condition = threading.Condition()
+# items that are not written yet
+buffer = []
+# amount of items appended / written since the writer is started
+appended = 0
+durable = 0
+# amount of items appended by the current thread when it last appended
+last_appended = threading.local()
+
+# function writing a list of items, called by the writer thread
+write_batch = None
+writer_thread = None
+stopping = False
+
+
+def start(write):
+    """ Start the writer thread.
+
+    Args:
+        write (function): writes a list of items, returns once they are durable
+    """
+    global write_batch, writer_thread
+
+    write_batch = write
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+
+
+def append(item):
+    """ Append the item, it's written by the writer thread """
+    global appended
+
+    with condition:
+        buffer.append(item)
+        appended += 1
+        last_appended.seq = appended
+        condition.notify_all()
+
+
+def wait():
+    """ Block until every item appended by the current thread is written """
+    seq = getattr(last_appended, 'seq', 0)
+    with condition:
+        while durable < seq and writer_thread is not None:
+            condition.wait()
+
+
+def writer():
+    """ Write the buffered items in batches until the writer is stopped """
+    global buffer, durable
+
+    while True:
+        with condition:
+            while not buffer and not stopping:
+                condition.wait()
+            if not buffer:
+                return
+            batch, buffer = buffer, []
+            seq = appended
+
+        write_batch(batch)
+
+        with condition:
+            durable = seq
+            condition.notify_all()
+
+
+def stop():
+    """ Write the buffered items and stop the writer thread """
+    global writer_thread, write_batch, stopping
+
+    with condition:
+        stopping = True
+        condition.notify_all()
+    writer_thread.join()
+
+    with condition:
+        writer_thread = write_batch = None
+        stopping = False
+        condition.notify_all()
@@ -0,0 +1,91 @@
+""" Password hashing.
+
+    Passwords are stored as 'pbkdf2_sha256$<iterations>$<salt>$<hash>', the
+    hash being PBKDF2-HMAC-SHA256 of the password with a random salt.
+    PBKDF2 is slow on purpose, so the hashing runs in a pool of at most
+    config.HASH_WORKERS processes: the request thread waiting for its hash
+    doesn't stall the other requests, and at most HASH_WORKERS hashes are
+    computed at once however many requests ask for one.
+
+    Passwords stored before are the plain SHA-256 hex digest. They still
+    match, and check_password reports them as needing a new hash, so the
+    password of each user is upgraded the next time they log in.
+
+@date 18/10/2026
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+ALGORITHM = 'pbkdf2_sha256'
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def pbkdf2(password, salt, iterations):
+    """ Return the hex digest of PBKDF2-HMAC-SHA256, run in the pool """
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations).hex()
+
+
+def run(func, *args):
+    """ Return func(*args) computed by the pool """
+    global pool
+
+    if config.HASH_WORKERS == 0:
+        return func(*args)
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=config.HASH_WORKERS)
+    return pool.submit(func, *args).result()
+
+
+def shutdown():
+    """ Stop the processes of the pool, a new pool is started when needed """
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown()
+            pool = None
+
+
+def hash_password(password):
+    """ Hash the password with a new salt.
+
+    Args:
+        password (str): the password
+
+    Returns:
+        (str): the stored form of the password
+    """
+    salt = secrets.token_hex(16)
+    iterations = config.HASH_ITERATIONS
+    digest = run(pbkdf2, password, salt, iterations)
+    return f'{ALGORITHM}${iterations}${salt}${digest}'
+
+
+def check_password(password, stored):
+    """ Check the password against its stored form.
+
+    Args:
+        password (str): the password given by the user
+        stored (str): the stored form of the password
+
+    Returns:
+        (tuple): (whether the password matches, whether the stored form is a
+                 legacy SHA-256 digest or uses less or more iterations than
+                 config.HASH_ITERATIONS, and so should be hashed again)
+    """
+    if stored.count('$') != 3:
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+
+    __, iterations, salt, expected = stored.split('$')
+    digest = run(pbkdf2, password, salt, int(iterations))
+    return hmac.compare_digest(digest, expected), int(iterations) != config.HASH_ITERATIONS
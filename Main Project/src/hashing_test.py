@@ -0,0 +1,80 @@
+'''
+Tests for hashing.py
+'''
+
+# Libraries
+import hashlib
+
+import pytest
+
+# src files
+import auth as au
+import config
+import error as err
+import hashing
+import other
+import users_channels as uc
+
+
+# pylint: disable=unused-argument
+
+@pytest.fixture(name='reset_dict')
+def reset():
+    """ Clear the data before each test """
+    other.clear()
+
+
+def test_hash_password():
+    """ Every hash has its own salt, and only the right password matches """
+    stored = hashing.hash_password('password')
+    algorithm, iterations, salt, __ = stored.split('$')
+    assert algorithm == 'pbkdf2_sha256'
+    assert int(iterations) == config.HASH_ITERATIONS
+    assert salt not in hashing.hash_password('password')
+
+    assert hashing.check_password('password', stored) == (True, False)
+    assert hashing.check_password('passwore', stored) == (False, False)
+
+
+def test_hash_password_on_request_thread(monkeypatch):
+    """ HASH_WORKERS 0 hashes without the pool, to the same hash """
+    stored = hashing.hash_password('password')
+    monkeypatch.setattr(config, 'HASH_WORKERS', 0)
+    assert hashing.check_password('password', stored) == (True, False)
+
+
+def test_legacy_hash_upgraded_on_login(reset_dict):
+    """ A password stored as a SHA-256 digest is hashed again when the user logs in """
+    registration = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    u_id = registration['u_id']
+    uc.users[u_id]['password'] = hashlib.sha256(b'password').hexdigest()
+
+    with pytest.raises(err.InputError):
+        au.auth_login('test@gmail.com', 'passwore')
+    assert '$' not in uc.users[u_id]['password']
+
+    assert au.auth_login('test@gmail.com', 'password')['u_id'] == u_id
+    assert uc.users[u_id]['password'].startswith('pbkdf2_sha256$')
+    assert au.auth_login('test@gmail.com', 'password')['u_id'] == u_id
+
+
+def test_hash_upgraded_to_new_iterations(reset_dict, monkeypatch):
+    """ Changing HASH_ITERATIONS hashes the password again on the next login """
+    u_id = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')['u_id']
+    monkeypatch.setattr(config, 'HASH_ITERATIONS', config.HASH_ITERATIONS + 1)
+
+    au.auth_login('test@gmail.com', 'password')
+    stored = uc.users[u_id]['password']
+    assert stored.split('$')[1] == str(config.HASH_ITERATIONS)
+    assert hashing.check_password('password', stored) == (True, False)
+
+
+def test_duplicate_email_not_hashed(reset_dict, monkeypatch):
+    """ Registering a used email fails before the password is hashed """
+    au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    hashed = []
+    monkeypatch.setattr(au, 'password_encryption', hashed.append)
+
+    with pytest.raises(err.InputError):
+        au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    assert hashed == []
@@ -0,0 +1,348 @@
+""" Photos uploaded by user_profile_uploadphoto.
+
+    The photo is downloaded in a single streamed request, decoded and cropped
+    in memory and only the cropped photo is written, into IMG_FOLDER.
+
+    The photos are content addressed: each is stored once, as
+    '<ab>/<cd>/<sha256>.jpg' where ab and cd are the first 4 hex digits of
+    the SHA-256 of the photo, however many users upload it. The two levels
+    of directories keep each directory small. uc.img_refs counts the users
+    using each photo, and the photo is deleted once none does. As the
+    content of a path never changes, it's served with IMG_CACHE_CONTROL.
+
+    Each photo is also stored resized to fit VARIANT_SIZES, next to the
+    photo as '<sha256>-<size>.jpg' (see variant_path), so lists of users
+    can show small photos. They are made when the photo is cropped.
+
+    The absolute url of each user's photo is computed once for each base url
+    and size, and cached in the user's 'img_urls' until their photo changes
+    (see profile_img_url).
+
+    user_profile_uploadphoto_start does the same in the background: the
+    request only starts an upload job and returns its job_id. The job
+    downloads the photo on one of the threads of the downloads pool, and
+    crops it in a pool of at most config.IMG_WORKERS processes so the
+    decoding and encoding doesn't hold the GIL of the server.
+    Each job's status is stored in uc.upload_jobs, and dropped JOB_TTL
+    seconds after the job is finished.
+
+@date 18/10/2026
+"""
+
+import hashlib
+import io
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+import urllib3
+from PIL import Image, UnidentifiedImageError
+
+import config
+import error
+import persistence
+import scheduler
+import users_channels as uc
+from locks import users_lock
+
+# Folder of the uploaded photos, served by flask as /static
+IMG_FOLDER = 'src/static'
+# Cache-Control header of the photos in IMG_FOLDER, cached for a year
+IMG_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+IMG_PATH = re.compile(r'[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(-[0-9]+)?\.jpg')
+# largest width and height of each resized variant of the photos
+VARIANT_SIZES = (32, 64, 256)
+# most urls cached for each user, as the base urls can come from the requests
+IMG_URLS_CACHED = 16
+# Downloads share the session, and so reuse its open connections
+http_session = requests.Session()
+
+# seconds the status of a finished job is kept
+JOB_TTL = 3600
+job_ids = itertools.count()
+# threads downloading the photos of the jobs
+downloads = ThreadPoolExecutor(max_workers=8)
+# processes cropping the photos of the jobs, started when first needed
+crop_pool = None
+crop_pool_lock = threading.Lock()
+
+
+def fetch_image(img_url):
+    """ Download the image at img_url into memory, in a single streamed request.
+
+    Args:
+        img_url (str): the url of the image
+
+    Returns:
+        (bytes): content of the image
+
+    Raises:
+        InputError: the url doesn't return HTTP status 200, the image is larger
+                    than config.IMG_MAX_BYTES or takes longer than
+                    config.IMG_TIMEOUT seconds to download
+    """
+    deadline = time.monotonic() + config.IMG_TIMEOUT
+    content = bytearray()
+    try:
+        with http_session.get(img_url, stream=True, timeout=config.IMG_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise error.InputError("Can't access the url")
+            if int(response.headers.get('Content-Length', 0)) > config.IMG_MAX_BYTES:
+                raise error.InputError("Image is too large")
+            # read1 returns whatever arrived, so a photo sent a few bytes at a
+            # time is still stopped at the deadline (read waits for all 64KB)
+            read = getattr(response.raw, 'read1', response.raw.read)
+            while True:
+                chunk = read(64 * 1024, decode_content=True)
+                if not chunk:
+                    break
+                content += chunk
+                if len(content) > config.IMG_MAX_BYTES:
+                    raise error.InputError("Image is too large")
+                if time.monotonic() > deadline:
+                    raise error.InputError("Image took too long to download")
+    except (requests.RequestException, urllib3.exceptions.HTTPError):
+        raise error.InputError("Can't access the url")
+    return bytes(content)
+
+
+def crop_image(content, x_start, y_start, x_end, y_end):
+    """ Decode the image, crop it and encode the cropped image, and its
+        variants resized to VARIANT_SIZES, as JPGs.
+
+    Args:
+        content (bytes): content of the image
+        x_start, y_start, x_end, y_end (int): bounds of the crop
+
+    Returns:
+        (tuple): (content of the cropped image,
+                  dictionary of size to content of the resized variant)
+
+    Raises:
+        InputError: the content isn't an image, or the bounds aren't
+                    within the image
+    """
+    try:
+        photo = Image.open(io.BytesIO(content))
+    except UnidentifiedImageError:
+        raise error.InputError("Invalid file type.")
+    width, height = photo.size
+
+    # Invalid dimensions
+    if any(point < 0 for point in (x_end, x_start, y_end, y_start)) or \
+       any(point > width for point in (x_end, x_start)) or \
+       any(point > height for point in (y_end, y_start)):
+        raise error.InputError("Invalid Image cropping dimension.")
+
+    cropped = photo.crop((x_start, y_start, x_end, y_end))
+    if cropped.mode not in ('RGB', 'L'):
+        cropped = cropped.convert('RGB')
+
+    variants = {}
+    for size in VARIANT_SIZES:
+        resized = cropped.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        variants[size] = encode_jpg(resized)
+    return encode_jpg(cropped), variants
+
+
+def encode_jpg(photo):
+    """ Return the photo encoded as a JPG """
+    encoded = io.BytesIO()
+    photo.save(encoded, 'JPEG')
+    return encoded.getvalue()
+
+
+def image_path(file_name):
+    """ Return the path of the photo named '<sha256>.jpg' relative to IMG_FOLDER """
+    return f'{file_name[:2]}/{file_name[2:4]}/{file_name}'
+
+
+def variant_path(path, size):
+    """ Return the path of the photo resized to size (one of VARIANT_SIZES),
+        or path itself for photos stored before there were variants.
+    """
+    if size is None or not is_image_path(path):
+        return path
+    return f'{path[:-len(".jpg")]}-{size}.jpg'
+
+
+def is_image_path(path):
+    """ Whether the path (relative to IMG_FOLDER) is of a content addressed photo """
+    return IMG_PATH.fullmatch(path) is not None
+
+
+def save_image(path, content):
+    """ Write the photo into IMG_FOLDER. It's written to a temporary file
+        first, so the photo is never served half written.
+    """
+    full_path = os.path.join(IMG_FOLDER, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, full_path)
+
+
+def release_image(path):
+    """ Drop a reference to the photo, deleting it once unused.
+        The caller holds users_lock.
+    """
+    if path not in uc.img_refs:
+        return
+    uc.img_refs[path] -= 1
+    if uc.img_refs[path] == 0:
+        del uc.img_refs[path]
+        for size in (None,) + VARIANT_SIZES:
+            try:
+                os.remove(os.path.join(IMG_FOLDER, variant_path(path, size)))
+            except FileNotFoundError:
+                pass
+
+
+def save_variants(path, content, variants):
+    """ Save the photo and its variants, the photo last so that the variants
+        exist once the photo does
+    """
+    for size, variant in variants.items():
+        save_image(variant_path(path, size), variant)
+    save_image(path, content)
+
+
+def set_profile_img(u_id, content, variants):
+    """ Store the photo (unless it's stored already) and set it as the
+        profile photo of the user, instead of their previous one.
+
+    Args:
+        u_id (int): the user
+        content (bytes): content of the photo
+        variants (dict): content of the photo resized to each of VARIANT_SIZES
+
+    Returns:
+        (str): path of the photo in IMG_FOLDER
+    """
+    path = image_path(hashlib.sha256(content).hexdigest() + '.jpg')
+    if not os.path.exists(os.path.join(IMG_FOLDER, path)):
+        save_variants(path, content, variants)
+
+    with users_lock:
+        if path not in uc.img_refs and not os.path.exists(os.path.join(IMG_FOLDER, path)):
+            # The last user of the photo dropped it in the meantime
+            save_variants(path, content, variants)
+        uc.img_refs[path] = uc.img_refs.get(path, 0) + 1
+        previous = uc.users[u_id]['profile_img_url']
+        uc.users[u_id]['profile_img_url'] = path
+        # set after the path, so that the urls cached are of the new photo
+        uc.users[u_id]['img_urls'] = {}
+        persistence.user_changed(u_id)
+        release_image(previous)
+    return path
+
+
+def photo_url(base_url, path, size=None):
+    """ Return the absolute url of the photo at path ('' without photo).
+
+    Args:
+        base_url (str): url of the server, ending with '/'
+        path (str): path of the photo in IMG_FOLDER
+        size (int): one of VARIANT_SIZES for the resized photo, None for the full photo
+    """
+    if path == '':
+        return ''
+    return base_url + 'static/' + variant_path(path, size)
+
+
+def profile_img_url(u_id, base_url, size=None):
+    """ Return the absolute url of the user's photo, computed once and cached.
+
+    Args:
+        u_id (int): the user
+        base_url, size: see photo_url
+    """
+    urls = uc.users[u_id]['img_urls']
+    url = urls.get((base_url, size))
+    if url is None:
+        if len(urls) >= IMG_URLS_CACHED:
+            urls.clear()
+        url = photo_url(base_url, uc.users[u_id]['profile_img_url'], size)
+        urls[(base_url, size)] = url
+    return url
+
+
+def upload_image(u_id, img_url, box):
+    """ Download and crop the photo, and set it as the user's profile photo.
+
+    Args:
+        u_id (int): the user uploading the photo
+        img_url (str): the url of the photo
+        box (tuple): (x_start, y_start, x_end, y_end) bounds of the crop
+    """
+    set_profile_img(u_id, *crop_image(fetch_image(img_url), *box))
+
+
+# Upload jobs
+
+
+def crop_in_pool(content, box):
+    """ Return crop_image(content, *box) computed by the crop pool """
+    global crop_pool
+
+    if config.IMG_WORKERS == 0:
+        return crop_image(content, *box)
+    with crop_pool_lock:
+        if crop_pool is None:
+            crop_pool = ProcessPoolExecutor(max_workers=config.IMG_WORKERS)
+    return crop_pool.submit(crop_image, content, *box).result()
+
+
+def start_job(u_id, img_url, box):
+    """ Start a job uploading the photo in the background.
+
+    Args:
+        same as upload_image
+
+    Returns:
+        job_id (int): id of the job
+    """
+    job_id = next(job_ids)
+    uc.upload_jobs[job_id] = {'u_id': u_id, 'status': 'pending', 'error': '', 'path': ''}
+    downloads.submit(run_job, job_id, u_id, img_url, box)
+    return job_id
+
+
+def set_job_status(job_id, status, message='', path=''):
+    """ Replace the status of the job, so readers never see half of a change.
+        path is the photo uploaded by the job once it's done.
+    """
+    if job_id in uc.upload_jobs:
+        uc.upload_jobs[job_id] = {
+            'u_id': uc.upload_jobs[job_id]['u_id'],
+            'status': status,
+            'error': message,
+            'path': path,
+        }
+
+
+def run_job(job_id, u_id, img_url, box):
+    """ Upload the photo of the job, on a thread of the downloads pool """
+    set_job_status(job_id, 'running')
+    try:
+        path = set_profile_img(u_id, *crop_in_pool(fetch_image(img_url), box))
+        set_job_status(job_id, 'done', path=path)
+    except error.InputError as err:
+        set_job_status(job_id, 'failed', err.description)
+    except Exception: # pylint: disable=broad-except
+        traceback.print_exc()
+        set_job_status(job_id, 'failed', 'Internal error')
+    scheduler.schedule(time.time() + JOB_TTL, drop_job, job_id)
+
+
+def drop_job(job_id):
+    """ Forget the status of the finished job """
+    uc.upload_jobs.pop(job_id, None)
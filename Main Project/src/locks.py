@@ -0,0 +1,43 @@
+""" Locks guarding the data in users_channels.py
+
+    Flask serves the requests on multiple threads, and the scheduler and the
+    standup timers run on their own threads, so every change to the data is
+    made while holding the lock of what it changes:
+
+        msg_id_lock         allocation of message_ids (uc.TOTAL_MSG)
+        channel_lock(id)    the channel's members, owners, messages, standup
+                            and todos, and the messages in the channel
+        channels_lock       allocation of channel_ids
+        users_lock          the users, and the indexes tokens, emails, handles
+        search_lock         the search index, see search_index.py
+
+    Reading doesn't need a lock: a single read or write of a dictionary or
+    a list is atomic, so readers see the data either before or after a change.
+    Iterating does: a dictionary or set that changes size while it's iterated
+    raises RuntimeError. Readers iterate a copy instead, e.g.
+    list(uc.channel[channel_id]['members']), as copying is a single step.
+    The locks only make sure that each check-then-change (e.g. "is the handle
+    taken?" then "take the handle") happens as one step, and that the
+    persistence records are appended in the same order as the changes.
+
+    channel_lock stripes the channels over CHANNEL_STRIPES reentrant locks,
+    so changes to different channels rarely wait for each other while the
+    amount of locks stays fixed. Never hold the locks of two channels at once.
+
+@date 18/10/2026
+"""
+
+import threading
+
+CHANNEL_STRIPES = 64
+
+msg_id_lock = threading.Lock()
+channel_locks = [threading.RLock() for __ in range(CHANNEL_STRIPES)]
+channels_lock = threading.Lock()
+users_lock = threading.RLock()
+search_lock = threading.Lock()
+
+
+def channel_lock(channel_id):
+    """ Return the lock guarding the channel """
+    return channel_locks[hash(channel_id) % CHANNEL_STRIPES]
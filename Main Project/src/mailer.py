@@ -0,0 +1,203 @@
+""" Outbound mail queue.
+
+    send_mail only puts the mail in a queue, so the request sending it returns
+    right away. A worker thread takes the mails off the queue in batches and
+    sends them with the transport chosen by config.MAIL_TRANSPORT:
+
+        'smtp'      through the SMTP (over SSL) server in config.py. The
+                    connection is kept open and reused for the next mails, and
+                    only closed once no mail is sent for MAIL_IDLE seconds.
+        'file'      written to config.MAIL_DIR, one .eml file per mail
+        'memory'    appended to outbox, e.g. for tests
+
+    A mail that fails to send is retried config.MAIL_RETRIES times, waiting
+    config.MAIL_BACKOFF seconds before the first retry and twice as long before
+    each next one. It's dropped (and the error printed) after the last retry.
+    The worker doesn't wait for a retry: the mail is put in retries, and sent
+    with the next batch once it's due, so one failing mail never holds up
+    the other mails.
+
+@date 18/10/2026
+"""
+
+import heapq
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+import traceback
+from email.mime.text import MIMEText
+
+import config
+
+# maximum amount of mails sent in one batch
+MAIL_BATCH = 50
+# seconds without mail before the SMTP connection is closed
+MAIL_IDLE = 30
+
+# mails waiting to be sent, as (mail, attempt)
+mail_queue = queue.Queue()
+# min-heap of the failed mails waiting to be retried, (when, seq, mail, attempt)
+# where when is a time.monotonic(). Only used by the worker thread
+retries = []
+retry_seqs = itertools.count()
+worker_thread = None
+worker_lock = threading.Lock()
+
+# the open SMTP connection, None when closed. Only used by the worker thread
+smtp_connection = None
+# mails sent by the 'memory' transport
+outbox = []
+file_names = itertools.count()
+
+
+def create_mail(target_email, subject, body):
+    """ Return the mail as a MIMEText """
+    mail = MIMEText(body)
+    mail['From'] = config.SMTP_USER
+    mail['To'] = target_email
+    mail['Subject'] = subject
+    return mail
+
+
+# Transports
+
+
+def smtp_send(mail):
+    """ Send the mail through the SMTP server, reusing the open connection """
+    global smtp_connection
+
+    if smtp_connection is None:
+        smtp_connection = smtplib.SMTP_SSL(config.SMTP_HOST, config.SMTP_PORT, timeout=30)
+        smtp_connection.login(config.SMTP_USER, config.SMTP_PASSWORD)
+    smtp_connection.sendmail(mail['From'], mail['To'], mail.as_string())
+
+
+def smtp_close():
+    """ Close the SMTP connection, if it's open """
+    global smtp_connection
+
+    if smtp_connection is not None:
+        try:
+            smtp_connection.quit()
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+        smtp_connection = None
+
+
+def file_send(mail):
+    """ Write the mail into config.MAIL_DIR """
+    os.makedirs(config.MAIL_DIR, exist_ok=True)
+    file_name = f'{time.time():.6f}-{next(file_names)}.eml'
+    with open(os.path.join(config.MAIL_DIR, file_name), 'w') as file:
+        file.write(mail.as_string())
+
+
+def memory_send(mail):
+    """ Append the mail to outbox """
+    outbox.append(mail)
+
+
+TRANSPORTS = {
+    'smtp': smtp_send,
+    'file': file_send,
+    'memory': memory_send,
+}
+
+
+# Queue
+
+
+def send_mail(target_email, subject, body):
+    """ Queue the mail, it's sent by the worker thread.
+
+    Args:
+        target_email (str): email address of the recipient
+        subject (str): subject of the mail
+        body (str): plain text content of the mail
+    """
+    global worker_thread
+
+    mail_queue.put((create_mail(target_email, subject, body), 0))
+    with worker_lock:
+        if worker_thread is None:
+            worker_thread = threading.Thread(target=worker, daemon=True)
+            worker_thread.start()
+
+
+def flush():
+    """ Block until every queued mail is sent (or dropped), retries included """
+    mail_queue.join()
+
+
+def deliver(mail, attempt):
+    """ Send the mail with the configured transport.
+
+    Args:
+        mail (MIMEText): the mail
+        attempt (int): amount of times the mail failed to send already
+
+    Returns:
+        (bool): True if the mail is sent or dropped, False if it's put in
+                retries
+    """
+    try:
+        TRANSPORTS[config.MAIL_TRANSPORT](mail)
+        return True
+    except Exception: # pylint: disable=broad-except
+        smtp_close()
+        if attempt == config.MAIL_RETRIES:
+            traceback.print_exc()
+            return True
+    when = time.monotonic() + config.MAIL_BACKOFF * 2 ** attempt
+    heapq.heappush(retries, (when, next(retry_seqs), mail, attempt + 1))
+    return False
+
+
+def due_retries():
+    """ Take the retries that are due out of retries """
+    batch = []
+    while retries and retries[0][0] <= time.monotonic() and len(batch) < MAIL_BATCH:
+        __, __, mail, attempt = heapq.heappop(retries)
+        batch.append((mail, attempt))
+    return batch
+
+
+def next_batch():
+    """ Block until a mail is queued or a retry is due, and return up to
+        MAIL_BATCH of them, as (mail, attempt).
+        The SMTP connection is closed while there is nothing to send.
+    """
+    batch = due_retries()
+    while not batch:
+        wait = retries[0][0] - time.monotonic() if retries else MAIL_IDLE
+        try:
+            batch.append(mail_queue.get(timeout=max(wait, 0)))
+        except queue.Empty:
+            if retries:
+                batch = due_retries()
+            else:
+                smtp_close()
+                batch.append(mail_queue.get())
+
+    while len(batch) < MAIL_BATCH:
+        try:
+            batch.append(mail_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def worker():
+    """ Send the queued mails in batches, forever.
+        A queued mail is only done once it's sent or dropped, so flush also
+        waits for its retries.
+    """
+    while True:
+        for mail, attempt in next_batch():
+            if deliver(mail, attempt):
+                mail_queue.task_done()
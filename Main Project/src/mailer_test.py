@@ -0,0 +1,101 @@
+'''
+Tests for mailer.py
+'''
+
+# Libraries
+import time
+
+import pytest
+
+# src files
+import auth as au
+import config
+import mailer
+import other
+
+
+# pylint: disable=redefined-outer-name
+
+@pytest.fixture
+def transport(monkeypatch):
+    """ Clear the data and send the mails with the 'memory' transport """
+    other.clear()
+    monkeypatch.setattr(config, 'MAIL_TRANSPORT', 'memory')
+    mailer.outbox.clear()
+    yield
+    mailer.flush()
+    mailer.outbox.clear()
+
+
+def test_passwordreset_memory_transport(transport):
+    """ The reset code queued by auth_passwordreset_request can be used once the
+        mail is sent
+    """
+    registration = au.auth_register('test@gmail.com', 'password', 'name_first', 'name_last')
+    au.auth_logout(registration['token'])
+
+    au.auth_passwordreset_request('test@gmail.com')
+    mailer.flush()
+
+    assert len(mailer.outbox) == 1
+    mail = mailer.outbox[0]
+    assert mail['To'] == 'test@gmail.com'
+    assert mail['Subject'] == 'Flockr: Reset Password'
+    reset_code = mail.get_payload().partition('Security code: ')[2].rstrip()
+    assert reset_code.startswith('RS' + str(registration['u_id']) + '-')
+    assert len(reset_code.partition('-')[2]) == au.RESET_CODE_LENGTH
+
+    au.auth_passwordreset_reset(reset_code, 'newPassword')
+    login = au.auth_login('test@gmail.com', 'newPassword')
+    assert login['u_id'] == registration['u_id']
+
+
+def test_mail_retried(transport, monkeypatch):
+    """ A mail that fails to send is retried, and dropped after MAIL_RETRIES retries """
+    attempts = []
+
+    def flaky_send(mail):
+        attempts.append(mail['To'])
+        if mail['To'] == 'never@gmail.com' or len(attempts) < 3:
+            raise OSError('Connection refused')
+        mailer.outbox.append(mail)
+
+    monkeypatch.setitem(mailer.TRANSPORTS, 'memory', flaky_send)
+    monkeypatch.setattr(config, 'MAIL_RETRIES', 3)
+    monkeypatch.setattr(config, 'MAIL_BACKOFF', 0.001)
+
+    mailer.send_mail('flaky@gmail.com', 'subject', 'body')
+    mailer.flush()
+    assert attempts == ['flaky@gmail.com'] * 3
+    assert [mail['To'] for mail in mailer.outbox] == ['flaky@gmail.com']
+
+    mailer.send_mail('never@gmail.com', 'subject', 'body')
+    mailer.flush()
+    assert attempts.count('never@gmail.com') == 4
+    assert len(mailer.outbox) == 1
+
+
+def test_retry_doesnt_block_queue(transport, monkeypatch):
+    """ The mails queued after a failing mail are sent while it waits for its retries """
+    attempts = []
+
+    def failing_send(mail):
+        attempts.append(mail['To'])
+        if mail['To'] == 'never@gmail.com':
+            raise OSError('Connection refused')
+        mailer.outbox.append(mail)
+
+    monkeypatch.setitem(mailer.TRANSPORTS, 'memory', failing_send)
+    monkeypatch.setattr(config, 'MAIL_RETRIES', 2)
+    monkeypatch.setattr(config, 'MAIL_BACKOFF', 0.5)
+
+    mailer.send_mail('never@gmail.com', 'subject', 'body')
+    mailer.send_mail('test@gmail.com', 'subject', 'body')
+    deadline = time.monotonic() + 0.4
+    while not mailer.outbox and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [mail['To'] for mail in mailer.outbox] == ['test@gmail.com']
+    assert attempts.count('never@gmail.com') == 1
+
+    mailer.flush()
+    assert attempts.count('never@gmail.com') == 3
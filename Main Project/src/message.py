@@ -17,10 +17,16 @@ Yiyang Huang (z5313425) [message_edit, message_pin, message_unpin]
 # Libraries
 # from datetime import datetime, timezone
 # import time
+from contextlib import contextmanager
 
 # Files
 import users_channels as uc
 import error
+import scheduler
+import persistence
+from locks import msg_id_lock, channel_lock
+from message_log import msg_log_append, msg_log_remove
+from search_index import search_index_add, search_index_remove
 from channel import token_to_uid, is_global_owner, \
                     generate_timestamp, is_channel_id_valid, \
                     is_uid_valid, is_user_owner, is_user_member
@@ -29,20 +35,107 @@ from channel import token_to_uid, is_global_owner, \
 # Helper functions
 
 def search_all_msg(msg_id):
-    """ Search for the specific message with id msg_id in the whole channel database.
+    """ Search for the specific message with id msg_id in the message index.
     :param msg_id: the message_id of the message for searching
     :return:
         (tuple) Consists of 2 elements:
             - (int) channel_id that the msg located.
-            - (int) index of the message in 'messages' list.
+            - (dict) the message's dictionary stored in the channel.
     :exception:
         InputError: msg_id does not exist
     """
-    for channel_id, channel_info in uc.channel.items():
-        for index, msg_list in enumerate(channel_info['messages']):
-            if msg_list['message_id'] == msg_id:
-                return int(channel_id), int(index)
-    raise error.InputError("message ID doesn't exist.")
+    try:
+        channel_id, msg, __ = uc.messages[msg_id]
+    except KeyError:
+        raise error.InputError("message ID doesn't exist.")
+    return channel_id, msg
+
+
+@contextmanager
+def locked_msg(msg_id):
+    """ Hold the lock of the message's channel while the message is changed.
+    :param msg_id: the message_id of the message
+    :return: (tuple) the channel_id and the message's dictionary, found
+             while holding the lock (see search_all_msg)
+    :exception:
+        InputError: msg_id does not exist (or is removed meanwhile)
+    """
+    channel_id, __ = search_all_msg(msg_id)
+    with channel_lock(channel_id):
+        yield search_all_msg(msg_id)
+
+
+def create_msg(uid, message, time_created):
+    """ Allocate a message_id and create the message's dictionary.
+    :param uid: uid of the sender
+    :param message: the message's text
+    :param time_created: (int) unix timestamp of the message
+    :return: (dict) the new message
+    """
+    with msg_id_lock:
+        msg_id = uc.TOTAL_MSG
+        uc.TOTAL_MSG += 1
+    return {
+        'message_id': msg_id,
+        'u_id': uid,
+        'message': message,
+        'time_created': time_created,
+        'reacts': [
+            {
+                'react_id': 1,
+                'u_ids': [],
+            }
+        ],
+        'is_pinned': False,
+    }
+
+
+def publish_msg(channel_id, new_msg):
+    """ Store the message in the channel and the message index.
+        The caller holds the lock of the channel.
+    :param channel_id: channel_id of the channel that the message is sent to
+    :param new_msg: (dict) the message created by create_msg
+    """
+    msg_log_append(channel_id, new_msg)
+    search_index_add(new_msg['message_id'], new_msg['message'])
+    uc.users[new_msg['u_id']]['msg_sent'].add(new_msg['message_id'])
+    persistence.message_changed(new_msg['message_id'])
+
+
+def add_msg(uid, channel_id, message, time_created):
+    """ Create a new message and store it in the channel.
+    :param uid: uid of the sender
+    :param channel_id: channel_id of the channel that the message is sent to
+    :param message: the message's text
+    :param time_created: (int) unix timestamp of the message
+    :return: (int) message_id of the new message
+    """
+    new_msg = create_msg(uid, message, time_created)
+    with channel_lock(channel_id):
+        publish_msg(channel_id, new_msg)
+    return new_msg['message_id']
+
+
+def deliver_pending_msg(msg_id):
+    """ Publish the message scheduled by message_send_later.
+        Called by the scheduler when the message is due.
+    :param msg_id: message_id of the pending message
+    """
+    try:
+        channel_id, new_msg = uc.pending_msgs.pop(msg_id)
+    except KeyError:
+        # the data is cleared before the message is due
+        return
+    with channel_lock(channel_id):
+        publish_msg(channel_id, new_msg)
+
+
+def schedule_pending_msgs():
+    """ Schedule the delivery of every pending message,
+        e.g. the messages recovered by persistence.open_storage
+    """
+    for msg_id, (__, new_msg) in uc.pending_msgs.items():
+        scheduler.schedule(new_msg['time_created'] - 0.5, deliver_pending_msg, msg_id)
 
 
 def search_own_msg(uid, msg_id):
@@ -87,28 +180,13 @@ def message_send(token, channel_id, message):
         raise error.InputError("Message can't be empty.")
     uid = token_to_uid(token)
 
-    if not is_user_member(uid, channel_id) and \
-        not is_user_owner(uid, channel_id):
-        raise error.AccessError("You are not a member of the channel.")
+    with channel_lock(channel_id):
+        if not is_user_member(uid, channel_id) and \
+            not is_user_owner(uid, channel_id):
+            raise error.AccessError("You are not a member of the channel.")
 
-    # Update in database
-    msg_id = uc.TOTAL_MSG
-    new_msg = {
-        'message_id': msg_id,
-        'u_id': uid,
-        'message': message,
-        'time_created': generate_timestamp(),
-        'reacts': [
-            {
-                'react_id': 1,
-                'u_ids': [],
-            }
-        ],
-        'is_pinned': False,
-    }
-    uc.channel[channel_id]['messages'].insert(0, new_msg)
-    uc.users[uid]['msg_sent'].append(msg_id)
-    uc.TOTAL_MSG += 1
+        # Update in database
+        msg_id = add_msg(uid, channel_id, message, generate_timestamp())
 
     return {
         'message_id': msg_id,
@@ -132,17 +210,18 @@ def message_remove(token, message_id):
         raise error.InputError("Invalid message ID")
 
     uid = token_to_uid(token)
-    channel_id, index = search_all_msg(message_id)
+    with locked_msg(message_id) as (channel_id, msg):
+        msg_sender_uid = msg['u_id']
 
-    msg_sender_uid = uc.channel[channel_id]['messages'][index]['u_id']
+        if not search_own_msg(uid, message_id) and \
+            not is_user_owner(uid, channel_id) and \
+                not is_global_owner(uid):
+            raise error.AccessError("Don't have the right to remove this message.")
 
-    if not search_own_msg(uid, message_id) and \
-        not is_user_owner(uid, channel_id) and \
-            not is_global_owner(uid):
-        raise error.AccessError("Don't have the right to remove this message.")
-
-    del uc.channel[channel_id]['messages'][index]
-    uc.users[msg_sender_uid]['msg_sent'].remove(message_id)
+        search_index_remove(message_id, msg['message'])
+        msg_log_remove(message_id)
+        uc.users[msg_sender_uid]['msg_sent'].discard(message_id)
+        persistence.message_removed(channel_id, msg)
 
     return {}
 
@@ -168,21 +247,24 @@ def message_edit(token, message_id, message):
     if new_msg == '': return message_remove(token, msg_id)
 
     uid = token_to_uid(token)
-    channel_id, msg_index = search_all_msg(msg_id)
-
-    if not search_own_msg(uid, message_id) and \
-        not is_user_owner(uid, channel_id) and \
-            not is_global_owner(uid):
-        raise error.AccessError("Don't have the right to edit this message.")
+    with locked_msg(msg_id) as (channel_id, msg):
+        if not search_own_msg(uid, message_id) and \
+            not is_user_owner(uid, channel_id) and \
+                not is_global_owner(uid):
+            raise error.AccessError("Don't have the right to edit this message.")
 
-    uc.channel[channel_id]['messages'][msg_index]['message'] = new_msg
+        search_index_remove(msg_id, msg['message'])
+        msg['message'] = new_msg
+        search_index_add(msg_id, new_msg)
+        persistence.message_changed(msg_id)
 
     return {}
 
 
 def reaction_logics(token, message_id, react_id, action_type):
     """ Helper function that contains the main logic
-        of message_react and message_unreact
+        of message_react and message_unreact.
+        The reaction is checked and changed while holding the channel's lock.
 
     Args:
         token (str): token of the authorized user
@@ -190,10 +272,6 @@ def reaction_logics(token, message_id, react_id, action_type):
         react_id (int): types of reaction
         type (int): 0 is unreact, 1 is react.
 
-    Return:
-        uid_list (list): list of uids in 'react'
-        uid (int): uid of the current user
-
     Raises:
         error.InputError: [Invalid React ID]
         error.InputError: [User already reacted to the message]
@@ -205,17 +283,21 @@ def reaction_logics(token, message_id, react_id, action_type):
     if react_id not in uc.REACTIONS:
         raise error.InputError("Invalid React ID")
 
-    channel_id, msg_index = search_all_msg(message_id)
-    uid_list = uc.channel[channel_id]['messages'][msg_index]['reacts'] \
-                         [react_id - 1]['u_ids']
+    with locked_msg(message_id) as (__, msg):
+        uid_list = msg['reacts'][react_id - 1]['u_ids']
+
+        if uid in uid_list and action_type == 1:
+            raise error.InputError("User already reacted with same React ID.")
 
-    if uid in uid_list and action_type == 1:
-        raise error.InputError("User already reacted with same React ID.")
+        if uid not in uid_list and action_type == 0:
+            raise error.InputError("User not reacted to this message with" \
+                                   "this React ID.")
 
-    if uid not in uid_list and action_type == 0:
-        raise error.InputError("User not reacted to this message with" \
-                               "this React ID.")
-    return uid_list, uid
+        if action_type == 1:
+            uid_list.append(uid)
+        else:
+            uid_list.remove(uid)
+        persistence.message_changed(message_id)
 
 
 def message_react(token, message_id, react_id):
@@ -242,8 +324,7 @@ def message_react(token, message_id, react_id):
                 React with ID react_id from the authorised user.
 
     """
-    uid_list, uid = reaction_logics(token, message_id, react_id, 1)
-    uid_list.append(uid)
+    reaction_logics(token, message_id, react_id, 1)
     return {}
 
 
@@ -268,8 +349,7 @@ def message_unreact(token, message_id, react_id):
             ID react_id.
 
     """
-    uid_list, uid = reaction_logics(token, message_id, react_id, 0)
-    uid_list.remove(uid)
+    reaction_logics(token, message_id, react_id, 0)
     return {}
 
 
@@ -296,18 +376,18 @@ def message_pin(token, message_id):
 
     msg_id = int(message_id)
     uid = token_to_uid(token)
-    channel_id, msg_index = search_all_msg(msg_id)
-
-    if uc.channel[channel_id]['messages'][msg_index]['is_pinned']:
-        raise error.InputError(f"Message with ID {msg_id} is already pinned")
+    with locked_msg(msg_id) as (channel_id, msg):
+        if msg['is_pinned']:
+            raise error.InputError(f"Message with ID {msg_id} is already pinned")
 
-    if not is_user_member(uid, channel_id):
-        raise error.AccessError("The authorised user is not a member of the "\
-                                "channel that the message is within")
-    if not is_user_owner(uid, channel_id):
-        raise error.AccessError("The authorised user is not an owner")
+        if not is_user_member(uid, channel_id):
+            raise error.AccessError("The authorised user is not a member of the "\
+                                    "channel that the message is within")
+        if not is_user_owner(uid, channel_id):
+            raise error.AccessError("The authorised user is not an owner")
 
-    uc.channel[channel_id]['messages'][msg_index]['is_pinned'] = True
+        msg['is_pinned'] = True
+        persistence.message_changed(msg_id)
 
     return {}
 
@@ -333,18 +413,18 @@ def message_unpin(token, message_id):
 
     msg_id = int(message_id)
     uid = token_to_uid(token)
-    channel_id, msg_index = search_all_msg(msg_id)
+    with locked_msg(msg_id) as (channel_id, msg):
+        if msg['is_pinned'] is False:
+            raise error.InputError(f"Message with ID {msg_id} is already unpinned")
 
-    if uc.channel[channel_id]['messages'][msg_index]['is_pinned'] is False:
-        raise error.InputError(f"Message with ID {msg_id} is already unpinned")
+        if not is_user_member(uid, channel_id):
+            raise error.AccessError("The authorised user is not a member of the "\
+                                    "channel that the message is within")
+        if not is_user_owner(uid, channel_id):
+            raise error.AccessError("The authorised user is not an owner")
 
-    if not is_user_member(uid, channel_id):
-        raise error.AccessError("The authorised user is not a member of the "\
-                                "channel that the message is within")
-    if not is_user_owner(uid, channel_id):
-        raise error.AccessError("The authorised user is not an owner")
-
-    uc.channel[channel_id]['messages'][msg_index]['is_pinned'] = False
+        msg['is_pinned'] = False
+        persistence.message_changed(msg_id)
 
     return {}
 
@@ -381,25 +461,14 @@ def message_send_later(token, channel_id, message, time_sent):
         not is_user_owner(u_id, channel_id):
         raise error.AccessError("You are not a member of the channel.")
 
-    # Update in database
-    # taken from message_send --> modified time_created
-    msg_id = uc.TOTAL_MSG
-    new_msg = {
-        'message_id': msg_id,
-        'u_id': u_id,
-        'message': message,
-        'time_created': time_sent,
-        'reacts': [
-            {
-                'react_id': 1,
-                'u_ids': [],
-            }
-        ],
-        'is_pinned': False,
-    }
-    uc.channel[channel_id]['messages'].insert(0, new_msg)
-    uc.users[u_id]['msg_sent'].append(msg_id)
-    uc.TOTAL_MSG += 1
+    # Store the message as pending, it's only published in the channel
+    # when it's due. time_created of messages are rounded to seconds,
+    # hence the message is published at time_sent - 0.5
+    new_msg = create_msg(u_id, message, time_sent)
+    msg_id = new_msg['message_id']
+    uc.pending_msgs[msg_id] = (channel_id, new_msg)
+    persistence.message_pending(msg_id)
+    scheduler.schedule(time_sent - 0.5, deliver_pending_msg, msg_id)
 
     return {
         'message_id': msg_id,
@@ -425,28 +494,12 @@ def message_broadcast(token, message):
         raise error.AccessError("The authorised user is not owner of Flockr")
     if len(message) > 1000 or len(message) < 1:
         raise error.InputError("Message is more than 1000 characters")
-    for channel_id in uc.channel:
+    for channel_id in list(uc.channel):
         # Update in database
-        msg_id = uc.TOTAL_MSG
-        new_msg = {
-            'message_id': msg_id,
-            'u_id': uid,
-            'message': message,
-            'time_created': generate_timestamp(),
-            'reacts': [
-                {
-                    'react_id': 1,
-                    'u_ids': [],
-                }
-            ],
-            'is_pinned': False,
-        }
-        uc.channel[channel_id]['messages'].insert(0, new_msg)
-        uc.users[uid]['msg_sent'].append(msg_id)
+        msg_id = add_msg(uid, channel_id, message, generate_timestamp())
         msg_list.append({
             'message_id': msg_id,
         })
-        uc.TOTAL_MSG += 1
 
     return {
         'messages': msg_list
@@ -22,6 +22,7 @@ Nont Fakungkun (message_pin / message_unpin)
 import json
 import requests
 import time
+import threading
 import pytest
 
 
@@ -687,3 +688,43 @@ def test_message_broadcast_message_too_long_http(msg_setup, urls):
         "message": "l" * 1005,
     }
     assert requests.post(urls['message_broadcast'], json=bc_msg_data).status_code == 400
+
+
+def test_msg_send_concurrent_http(msg_setup, urls):
+    """ message/send from many threads at once.
+        Every message gets a unique message_id and is stored in the channel.
+    """
+    user_1, user_2, channel_public, __ = msg_setup
+    threads, per_thread = 8, 25
+    msg_ids = []
+
+    def send_many(token):
+        session = requests.Session()
+        for i in range(per_thread):
+            response = session.post(urls['message_send'], json={
+                'token': token,
+                'channel_id': channel_public,
+                'message': f"message {i}",
+            })
+            msg_ids.append(response.json()['message_id'])
+
+    workers = [threading.Thread(target=send_many, args=(user['token'],))
+               for user in [user_1, user_2] * (threads // 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(msg_ids) == len(set(msg_ids)) == threads * per_thread
+
+    stored_ids = []
+    start = 0
+    while start != -1:
+        msg_list = requests.get(urls['channel_messages'], params={
+            'token': user_1['token'],
+            'channel_id': channel_public,
+            'start': start,
+        }).json()
+        stored_ids += [msg['message_id'] for msg in msg_list['messages']]
+        start = msg_list['end']
+    assert sorted(stored_ids) == sorted(msg_ids)
@@ -0,0 +1,182 @@
+""" The message log of each channel.
+
+    uc.channel[channel_id]['messages'] is an append-only list, ordered from
+    the oldest to the newest message. New messages are appended at the tail,
+    and removed messages are replaced by a tombstone (None) so that removing
+    never shifts the list. Once more than half of the log are tombstones the
+    log is compacted.
+
+    The position of each message in the log is stored in the message index,
+    uc.messages[message_id] == [channel_id, message's dictionary, position]
+
+    As positions never shift when messages are sent or removed, the pages of
+    channel_messages can start at a message (msg_log_older, msg_log_newer):
+    the message index finds its position without scanning the log.
+    Each message also gets a sequence number ('log_seq', increasing along
+    the log of its channel) kept in the parallel list
+    uc.channel[channel_id]['msg_seqs'], tombstones included. uc.removed_msgs
+    keeps the sequence number of the recently removed messages, so a page can
+    also start at a message removed since the previous page: its position is
+    found by bisecting 'msg_seqs', compacting the log doesn't need to update it.
+
+@date 18/10/2026
+"""
+
+import math
+from bisect import bisect_left
+from itertools import islice
+
+import users_channels as uc
+
+# A log is only compacted when it has at least this amount of tombstones
+COMPACT_MIN_TOMBSTONES = 64
+# Amount of removed messages of each channel that pages can start at
+REMOVED_MSGS_KEPT = 1000
+
+
+def msg_log_append(channel_id, msg):
+    """ Append the message at the tail of the channel's log and
+        store it in the message index.
+
+    Args:
+        channel_id (int): channel_id of the channel that the message is sent to
+        msg (dict): the message's dictionary
+    """
+    channel_info = uc.channel[channel_id]
+    # recovered messages keep their sequence number
+    seq = msg.setdefault('log_seq', channel_info['next_seq'])
+    channel_info['next_seq'] = max(channel_info['next_seq'], seq + 1)
+
+    log = channel_info['messages']
+    uc.messages[msg['message_id']] = [channel_id, msg, len(log)]
+    log.append(msg)
+    channel_info['msg_seqs'].append(seq)
+
+
+def msg_log_remove(msg_id):
+    """ Replace the message with a tombstone and remove it from the message index.
+
+    Args:
+        msg_id (int): message_id of the message to be removed
+
+    Raises:
+        KeyError: When the message doesn't exist
+    """
+    channel_id, msg, position = uc.messages.pop(msg_id)
+    msg_log_keep_removed(channel_id, msg_id, msg['log_seq'])
+    channel_info = uc.channel[channel_id]
+    channel_info['messages'][position] = None
+    channel_info['msg_tombstones'] += 1
+
+    tombstones = channel_info['msg_tombstones']
+    if tombstones >= COMPACT_MIN_TOMBSTONES and \
+       tombstones * 2 > len(channel_info['messages']):
+        msg_log_compact(channel_id)
+
+
+def msg_log_keep_removed(channel_id, msg_id, seq):
+    """ Keep the sequence number of the removed message, so pages can start at it.
+        Only the REMOVED_MSGS_KEPT latest removed messages of the channel are kept.
+
+    Args:
+        channel_id (int): channel_id of the channel of the message
+        msg_id (int): message_id of the removed message
+        seq (int): sequence number of the message
+    """
+    channel_info = uc.channel[channel_id]
+    channel_info['next_seq'] = max(channel_info['next_seq'], seq + 1)
+    removed = uc.removed_msgs.setdefault(channel_id, {})
+    removed[msg_id] = seq
+    if len(removed) > REMOVED_MSGS_KEPT:
+        del removed[next(iter(removed))]
+
+
+def msg_log_compact(channel_id):
+    """ Drop every tombstone from the channel's log and
+        update the positions in the message index.
+
+    Args:
+        channel_id (int): channel_id of the channel to be compacted
+    """
+    channel_info = uc.channel[channel_id]
+    log = [msg for msg in channel_info['messages'] if msg is not None]
+    for position, msg in enumerate(log):
+        uc.messages[msg['message_id']][2] = position
+
+    channel_info['messages'] = log
+    channel_info['msg_seqs'] = [msg['log_seq'] for msg in log]
+    channel_info['msg_tombstones'] = 0
+
+
+def msg_log_count(channel_id):
+    """ Return the amount of messages (tombstones excluded) in the channel """
+    channel_info = uc.channel[channel_id]
+    return len(channel_info['messages']) - channel_info['msg_tombstones']
+
+
+def msg_log_newest(channel_id, start=0, amount=None):
+    """ View the messages of the channel from the newest to the oldest.
+
+    Args:
+        channel_id (int): channel_id of the channel
+        start (int): amount of the newest messages to be skipped
+        amount (int): maximum amount of messages returned, None for all of them
+
+    Returns:
+        (iterator): the message's dictionaries, newest first
+    """
+    msgs = (msg for msg in reversed(uc.channel[channel_id]['messages'])
+            if msg is not None)
+    return islice(msgs, start, None if amount is None else start + amount)
+
+
+def msg_log_position(channel_id, msg_id):
+    """ Return the position of the message in the channel's log, None if it
+        isn't a message of the channel. The position of a removed message whose
+        tombstone is compacted is x.5: it was between positions x and x + 1.
+        The caller holds the lock of the channel.
+    """
+    indexed = uc.messages.get(msg_id)
+    if indexed is None:
+        seq = uc.removed_msgs.get(channel_id, {}).get(msg_id)
+        if seq is None:
+            return None
+        seqs = uc.channel[channel_id]['msg_seqs']
+        position = bisect_left(seqs, seq)
+        if position < len(seqs) and seqs[position] == seq:
+            return position
+        return position - 0.5
+    if indexed[0] != channel_id:
+        return None
+    return indexed[2]
+
+
+def msg_log_older(channel_id, position, amount):
+    """ View the messages older than the message at position, newest first.
+
+    Args:
+        channel_id (int): channel_id of the channel
+        position (float): position of the message in the log, see msg_log_position
+        amount (int): maximum amount of messages returned
+
+    Returns:
+        (list): the message's dictionaries, newest first
+    """
+    log = uc.channel[channel_id]['messages']
+    msgs = (log[i] for i in range(math.ceil(position) - 1, -1, -1) if log[i] is not None)
+    return list(islice(msgs, amount))
+
+
+def msg_log_newer(channel_id, position, amount):
+    """ View the messages newer than the message at position, the closest to it
+        first (i.e. oldest first).
+
+    Args:
+        same as msg_log_older
+
+    Returns:
+        (list): the message's dictionaries, oldest first
+    """
+    log = uc.channel[channel_id]['messages']
+    msgs = (log[i] for i in range(math.floor(position) + 1, len(log)) if log[i] is not None)
+    return list(islice(msgs, amount))
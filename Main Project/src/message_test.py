@@ -18,6 +18,8 @@ message_pin, message_unpin: Reviewed by Yiyang Huang (2020/11/05)
 from datetime import datetime, timezone
 import time
 from random import choice
+import sys
+import threading
 import pytest
 
 # Src files
@@ -344,6 +346,46 @@ def test_msg_remove_input_error_double(pre_test_setup):
         msg.message_remove(token_1, msg_1)
 
 
+def test_msg_remove_then_modify(pre_test_setup):
+    """ A removed message can't be edited, reacted or pinned anymore.
+    :return: InputError
+    """
+    __, user_1, __, channel_public, __ = pre_test_setup
+    token_1 = user_1['token']
+
+    msg_1 = msg.message_send(token_1, channel_public, "Remove this.")['message_id']
+    msg.message_remove(token_1, msg_1)
+
+    with pytest.raises(error.InputError):
+        msg.message_edit(token_1, msg_1, "Edit this.")
+    with pytest.raises(error.InputError):
+        msg.message_react(token_1, msg_1, 1)
+    with pytest.raises(error.InputError):
+        msg.message_pin(token_1, msg_1)
+
+
+def test_msg_remove_many_messages(pre_test_setup):
+    """ Removing most of the messages in a channel compacts the channel's
+        message log, the remaining messages are still in order and modifiable.
+    """
+    __, user_1, __, channel_public, __ = pre_test_setup
+    token_1 = user_1['token']
+
+    msg_ids = [msg.message_send(token_1, channel_public, f"Message {i}")['message_id']
+               for i in range(200)]
+    for msg_id in msg_ids[:150]:
+        msg.message_remove(token_1, msg_id)
+
+    msg_list = ch.channel_messages(token_1, channel_public, 0)['messages']
+    assert [each['message_id'] for each in msg_list] == msg_ids[:149:-1]
+
+    msg.message_edit(token_1, msg_ids[160], "Edited")
+    msg.message_remove(token_1, msg_ids[199])
+    msg_list = ch.channel_messages(token_1, channel_public, 0)['messages']
+    assert len(msg_list) == 49
+    assert msg_list[-11]['message'] == "Edited"
+
+
 def test_msg_remove_access_error(pre_test_setup):
     """ User is trying to remove the message not sent by owner
         and the authorised user is not owner of the channel/flockr.
@@ -1076,6 +1118,91 @@ def test_msg_send_later_complex(pre_test_setup):
             ['message'] == message_1
 
 
+def test_msl_pending_messages(pre_test_setup):
+    """
+    message_send_later - pending messages don't take up the page of
+    channel_messages, and can't be modified before they are sent
+    """
+    token, channel_id = pre_test_setup[1]['token'], pre_test_setup[3]
+
+    time_sent = ch.generate_timestamp() + 60
+    later_ids = [msg.message_send_later(token, channel_id, "later", time_sent)['message_id']
+                 for __ in range(60)]
+    msg_id = msg.message_send(token, channel_id, "now")['message_id']
+
+    msg_list = ch.channel_messages(token, channel_id, 0)
+    assert [each['message_id'] for each in msg_list['messages']] == [msg_id]
+    assert msg_list['end'] == -1
+    assert len(set(later_ids + [msg_id])) == 61
+
+    with pytest.raises(error.InputError):
+        msg.message_edit(token, later_ids[0], "edited")
+
+
+def test_msg_send_react_concurrent(pre_test_setup):
+    """
+    message_send and message_react from many threads at once,
+    message_ids are unique and no reaction is lost
+    """
+    owner, user_1, user_2, channel_id = pre_test_setup[:4]
+    ch.channel_join(owner['token'], channel_id)
+    ch.channel_join(user_2['token'], channel_id)
+    target = msg.message_send(user_1['token'], channel_id, "react to me")['message_id']
+    msg_ids = []
+
+    def send_many(token):
+        for __ in range(200):
+            msg_ids.append(msg.message_send(token, channel_id, "concurrent")['message_id'])
+        msg.message_react(token, target, 1)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        workers = [threading.Thread(target=send_many, args=(user['token'],))
+                   for user in (owner, user_1, user_2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert len(set(msg_ids)) == 600
+    msg_list = ch.channel_messages(user_1['token'], channel_id, 600)['messages']
+    assert msg_list[0]['message_id'] == target
+    assert len(msg_list[0]['reacts'][0]['u_ids']) == 3
+
+
+def test_search_while_removing(pre_test_setup):
+    """
+    search while messages are removed from another thread,
+    the removed messages are skipped
+    """
+    user_1, channel_id = pre_test_setup[1], pre_test_setup[3]
+    msg_ids = [msg.message_send(user_1['token'], channel_id, "removed soon")['message_id']
+               for __ in range(1000)]
+
+    def remove_all():
+        for msg_id in msg_ids:
+            msg.message_remove(user_1['token'], msg_id)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        worker = threading.Thread(target=remove_all)
+        worker.start()
+        while worker.is_alive():
+            # the trigram index and the word index
+            for query_str in ("removed", "so"):
+                for found in o.search(user_1['token'], query_str)['messages']:
+                    assert query_str in found['message']
+        worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert o.search(user_1['token'], "removed")['messages'] == []
+
+
 def test_msl_invalid_channel(pre_test_setup):
     """
     message_send_later - channel id does not exist (invalid)
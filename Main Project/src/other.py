@@ -5,7 +5,13 @@ users_all and admin_userpermission_change coded by Nont Fakungkun z5317972
 '''
 
 import users_channels as uc
+import scheduler
+import persistence
+from locks import users_lock
 from channel import token_to_uid, update_messages_with_react
+from message_log import msg_log_newest
+from search_index import search_candidates, search_index_stats
+from pagination import page, page_limit
 import error
 
 def clear():
@@ -15,24 +21,49 @@ def clear():
     """
     uc.users.clear()
     uc.channel.clear()
+    uc.tokens.clear()
+    uc.emails.clear()
+    uc.handles.clear()
+    uc.handle_counters.clear()
+    uc.messages.clear()
+    uc.removed_msgs.clear()
+    uc.pending_msgs.clear()
+    uc.standup_jobs.clear()
+    uc.upload_jobs.clear()
+    uc.img_refs.clear()
+    uc.search_words.clear()
+    uc.search_trigrams.clear()
+    scheduler.clear()
+    uc.verified_tokens.clear()
     uc.TOTAL_MSG = 0
+    persistence.data_cleared()
 
 
-def users_all(token):
-    """ Returns a list of all users and their associated details
+def users_all(token, limit=None, cursor=None):
+    """ Returns a list of all users and their associated details,
+        or a page of it when limit or cursor is given (see pagination.py)
     :param token: token of a user
+    :param limit: most users in the page
+    :param cursor: cursor of the page, returned as next_cursor with the previous page
     :return:
         user (List of dictionaries, where each dictionary
         contains types u_id, email, name_first, name_last, handle_str)
+        next_cursor (str) only when paginated, '' after the last page
 
         AccessError if token is invalid
+        InputError if limit or cursor is invalid
     """
     # Check token is valid
     __ = token_to_uid(token)
 
+    if limit is None and cursor is None:
+        u_ids, next_cursor = list(uc.users), None
+    else:
+        u_ids, next_cursor = page(uc.users, 'users', limit, cursor)
+
     user_list = []
     # Create a list of all users (extract the list from uc.users)
-    for u_id in uc.users:
+    for u_id in u_ids:
         user_tmp = {
             'u_id': u_id,
             'email': uc.users[u_id]['email'],
@@ -44,8 +75,13 @@ def users_all(token):
         # Add the copy of dictionary instead of adding directly to avoid making reference
         user_list.append(user_tmp.copy())
 
+    if next_cursor is None:
+        return {
+            'users': user_list,
+        }
     return {
         'users': user_list,
+        'next_cursor': next_cursor,
     }
 
 
@@ -79,11 +115,13 @@ def admin_userpermission_change(token, u_id, permission_id):
     if permission_id not in [1, 2]:
         raise error.InputError(f"{permission_id} does not refer to a value permission")
 
-    uc.users[u_id]['permission_id'] = permission_id
+    with users_lock:
+        uc.users[u_id]['permission_id'] = permission_id
+        persistence.user_changed(u_id)
 
     return {}
 
-def search(token, query_str):
+def search(token, query_str, limit=None):
     ''' [Direct reference to specification] Given a query string,
         return a collection of messages in all of the channels that
         the user has joined that match the query
@@ -91,6 +129,8 @@ def search(token, query_str):
     Parameters:
         token (str): token of the user requesting this function
         query_str (str): test whether or not a mssage contains this query_str
+        limit (int): maximum amount of messages returned (1 to
+                     pagination.MAX_PAGE_SIZE), None for no limit
 
     Returns:
         messages:
@@ -98,17 +138,46 @@ def search(token, query_str):
             [Direct reference to specification]:
             List of dictionaries, where each dictionary contains types
             {message_id, u_id, message, time_created}
+            Ranked by the times query_str occurs in the message, ties are
+            ordered by channel (as in 'in_channels'), then from the newest
+            to the oldest message.
 
+        InputError if the limit is invalid
     '''
 
     uid = token_to_uid(token)
-    msg_list = []
-
-    for channel_id in uc.users[uid]['in_channels']:
-        for msg in uc.channel[channel_id]['messages']:
-            if query_str in msg['message']:
-                msg_list.append(msg)
+    if limit is not None:
+        limit = page_limit(limit)
+    channel_rank = {channel_id: rank for rank, channel_id
+                    in enumerate(list(uc.users[uid]['in_channels']))}
+
+    candidates = search_candidates(query_str)
+    if candidates is None:
+        # only the messages of the user's channels, without the search lock
+        candidates = (msg['message_id'] for channel_id in channel_rank
+                      for msg in msg_log_newest(channel_id))
+
+    # entries of the message index: [channel_id, message, position],
+    # None for the candidates removed since they were looked up
+    matches = [entry for entry in map(uc.messages.get, candidates)
+               if entry is not None and entry[0] in channel_rank and
+               query_str in entry[1]['message']]
+    matches.sort(key=lambda entry: (-entry[1]['message'].count(query_str),
+                                    channel_rank[entry[0]], -entry[2]))
+    msg_list = [msg for __, msg, __ in matches[:limit]]
 
     return {
         'messages': update_messages_with_react(uid, msg_list)
     }
+
+
+def search_stats(token):
+    """ Return the size of the indexes used by search
+    :param token: token of a user
+    :return:
+        (dict) {words, trigrams, postings, memory_bytes}
+
+        AccessError if token is invalid
+    """
+    __ = token_to_uid(token)
+    return search_index_stats()
@@ -267,6 +267,25 @@ def test_users_all_success(url, generate_url, pre_test_setup):
         assert users_list['users'][i]['handle_str'] == u_detail['handle_str']
 
 
+def test_users_all_pages(generate_url, pre_test_setup):
+    """
+    The users are returned a page at a time, following next_cursor
+    """
+    owner = pre_test_setup[0]
+    url_usersall = generate_url[0]
+
+    first = requests.get(url_usersall, params={'token': owner['token'], 'limit': 2}).json()
+    assert [user['u_id'] for user in first['users']] == [0, 1]
+
+    last = requests.get(url_usersall, params={'token': owner['token'], 'limit': 2,
+                                              'cursor': first['next_cursor']}).json()
+    assert [user['u_id'] for user in last['users']] == [2]
+    assert last['next_cursor'] == ''
+
+    assert requests.get(url_usersall, params={'token': owner['token'], 'cursor': 'invalid'}) \
+                        .status_code == 400
+
+
 def test_users_all_invalid_token(generate_url):
     """
     The token input in this function does not exist -> AccessError is raised
@@ -435,3 +454,66 @@ def test_admin_upermchange_invalid_perm_value(generate_url, pre_test_setup):
     }
     # Check InputError when permission_id is invalid
     assert requests.post(url_permissionchange, json=data).status_code == 400
+
+
+def test_users_all_compressed(url, urls, data_setup):
+    """ Large responses are compressed with the encoding the client accepts,
+        and the same after a change
+    """
+    requests.get(urls['other_clear'])
+    user = requests.post(urls['auth_register'], json=data_setup[0]).json()
+    for i in range(30):
+        requests.post(urls['auth_register'], json={
+            'email': f'user{i}@gmail.com', 'password': 'password',
+            'name_first': 'first', 'name_last': 'last'})
+    params = {'token': user['token']}
+
+    resp = requests.get(urls['users_all'], params=params, headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in resp.headers['Vary']
+    assert len(resp.json()['users']) == 31
+    cached = requests.get(urls['users_all'], params=params, headers={'Accept-Encoding': 'gzip'})
+    assert cached.json() == resp.json()
+
+    resp = requests.get(urls['users_all'], params=params, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in resp.headers
+    assert len(resp.json()['users']) == 31
+
+    requests.put(url + 'user/profile/setname', json={
+        'token': user['token'], 'name_first': 'new', 'name_last': 'name'})
+    resp = requests.get(urls['users_all'], params=params, headers={'Accept-Encoding': 'deflate'})
+    assert resp.headers['Content-Encoding'] == 'deflate'
+    assert resp.json()['users'][0]['name_first'] == 'new'
+
+
+def test_search_compressed_until_changed(url, urls, data_setup):
+    """ A cached compressed search is replaced once a message of the user's
+        channels or their channels change, and the token stops working on logout
+    """
+    requests.get(urls['other_clear'])
+    user = requests.post(urls['auth_register'], json=data_setup[0]).json()
+    other_user = requests.post(urls['auth_register'], json=data_setup[1]).json()
+    channel_id = requests.post(urls['channels_create'], json={
+        'token': user['token'], 'name': 'channel', 'is_public': True}).json()['channel_id']
+    other_id = requests.post(urls['channels_create'], json={
+        'token': other_user['token'], 'name': 'other', 'is_public': True}).json()['channel_id']
+    for i in range(60):
+        requests.post(urls['message_send'], json={
+            'token': user['token'], 'channel_id': channel_id, 'message': f"hello {i}"})
+    params = {'token': user['token'], 'query_str': 'hello'}
+    headers = {'Accept-Encoding': 'gzip'}
+
+    resp = requests.get(urls['other_search'], params=params, headers=headers)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert len(resp.json()['messages']) == 60
+
+    requests.post(urls['message_send'], json={
+        'token': other_user['token'], 'channel_id': other_id, 'message': "hello other"})
+    assert len(requests.get(urls['other_search'], params=params,
+                            headers=headers).json()['messages']) == 60
+    requests.post(urls['channel_join'], json={'token': user['token'], 'channel_id': other_id})
+    assert len(requests.get(urls['other_search'], params=params,
+                            headers=headers).json()['messages']) == 61
+
+    requests.post(urls['auth_logout'], json={'token': user['token']})
+    assert requests.get(urls['other_search'], params=params, headers=headers).status_code == 400
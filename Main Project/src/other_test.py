@@ -153,6 +153,47 @@ def test_users_all_invalid_token():
         o.users_all(invalid_token)
 
 
+def test_users_all_pages():
+    """
+    Paging through users_all with a limit returns every user once, in order,
+    and users registered meanwhile show up on the later pages
+    """
+    o.clear()
+    token = au.auth_register("z0@ad.unsw.edu.au", "Password123", "Page", "User")['token']
+    for i in range(1, 25):
+        au.auth_register(f"z{i}@ad.unsw.edu.au", "Password123", "Page", "User")
+
+    first = o.users_all(token, limit=10)
+    assert [user['u_id'] for user in first['users']] == list(range(10))
+    au.auth_register("z25@ad.unsw.edu.au", "Password123", "Page", "User")
+
+    u_ids, cursor = [], first['next_cursor']
+    while cursor != '':
+        page = o.users_all(token, limit=10, cursor=cursor)
+        u_ids += [user['u_id'] for user in page['users']]
+        cursor = page['next_cursor']
+    assert u_ids == list(range(10, 26))
+
+    everyone = o.users_all(token)
+    assert 'next_cursor' not in everyone
+    assert first['users'] == everyone['users'][:10]
+
+
+def test_users_all_invalid_page():
+    """
+    Invalid limits and cursors (e.g. of channels_listall) -> InputError is raised
+    """
+    o.clear()
+    token = au.auth_register("z0@ad.unsw.edu.au", "Password123", "Page", "User")['token']
+    chs.channels_create(token, 'Channel_1', True)
+    chs.channels_create(token, 'Channel_2', True)
+    channels_cursor = chs.channels_listall(token, limit=1)['next_cursor']
+
+    for limit, cursor in ((0, None), (1001, None), (10, 'notacursor'), (10, channels_cursor)):
+        with pytest.raises(error.InputError):
+            o.users_all(token, limit, cursor)
+
+
 #----------------------------------------------------------------------------------#
 #------------------ Tests for admin_userpermission_change -------------------------#
 #----------------------------------------------------------------------------------#
@@ -634,3 +675,73 @@ def test_search_empty_string(search_pre_test_setup):
     assert msg_list[5]['message'] == "user_3 msg_3 in channel_5: Hi!"
     assert msg_list[6]['message'] == "TEST CAPITALIZATION"
     assert msg_list[7]['message'] == "test capitalization"
+
+
+def test_search_edited_removed_msg(search_pre_test_setup):
+    ''' Search reflects the edited and removed messages.
+    '''
+
+    __, user_1, __, __ = search_pre_test_setup
+    token_1 = user_1['token']
+
+    msg_id = o.search(token_1, 'msg_5')['messages'][0]['message_id']
+    msg.message_edit(token_1, msg_id, "edited message")
+
+    assert not o.search(token_1, 'msg_5')['messages']
+    assert [each['message_id'] for each in o.search(token_1, 'edited')['messages']] == [msg_id]
+
+    msg.message_remove(token_1, msg_id)
+    assert not o.search(token_1, 'edited')['messages']
+
+
+def test_search_ranked_limit(search_pre_test_setup):
+    ''' Messages with more occurrences of the query are ranked first,
+        and at most limit messages are returned.
+    '''
+
+    __, user_1, __, __ = search_pre_test_setup
+    token_1 = user_1['token']
+    channel_id = chs.channels_list(token_1)['channels'][0]['channel_id']
+    msg_id = msg.message_send(token_1, channel_id, "Hi Hi Hi")['message_id']
+
+    msg_list = o.search(token_1, 'Hi', 3)['messages']
+    assert len(msg_list) == 3
+    assert msg_list[0]['message_id'] == msg_id
+
+    for limit in (0, -1, 1001):
+        with pytest.raises(error.InputError):
+            o.search(token_1, 'Hi', limit)
+
+
+def test_search_short_query(search_pre_test_setup):
+    ''' Queries shorter than 3 characters find the substrings of words,
+        only in the channels of the user.
+    '''
+
+    __, user_1, user_2, __ = search_pre_test_setup
+    token_1, token_2 = user_1['token'], user_2['token']
+    channel_1 = chs.channels_list(token_1)['channels'][0]['channel_id']
+    channel_2 = chs.channels_create(token_2, "Private", False)['channel_id']
+    msg_id = msg.message_send(token_1, channel_1, "xyzzy")['message_id']
+    msg.message_send(token_2, channel_2, "xyzzy")
+
+    assert [each['message_id'] for each in o.search(token_1, 'yz')['messages']] == [msg_id]
+    assert [each['message_id'] for each in o.search(token_1, 'zy')['messages']] == [msg_id]
+
+
+def test_search_stats(search_pre_test_setup):
+    ''' The indexes used by search grow with the messages.
+    '''
+
+    __, user_1, __, __ = search_pre_test_setup
+    token_1 = user_1['token']
+    channel_id = chs.channels_list(token_1)['channels'][0]['channel_id']
+
+    stats = o.search_stats(token_1)
+    msg.message_send(token_1, channel_id, "a brand new sentence")
+    new_stats = o.search_stats(token_1)
+
+    assert new_stats['words'] == stats['words'] + 4
+    assert new_stats['trigrams'] > stats['trigrams']
+    assert new_stats['memory_bytes'] > stats['memory_bytes']
+    assert len(o.search(token_1, 'brand new sent')['messages']) == 1
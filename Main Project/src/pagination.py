@@ -0,0 +1,79 @@
+""" Cursor pagination of users_all and channels_listall.
+
+    A page is requested with a limit and the cursor returned with the
+    previous page (none for the first page). The cursor is opaque to the
+    client: the base64 of the kind of the list and the id the next page
+    starts at.
+
+    The u_ids and channel_ids are given in order from 0 and never deleted,
+    so a page is the range of ids from the cursor: building it costs the
+    size of the page, not the size of the table, and pages don't shift
+    when users or channels are added meanwhile.
+
+@date 18/10/2026
+"""
+
+import base64
+import binascii
+
+import error
+
+# limit of the pages when only the cursor is given
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(kind, next_id):
+    """ Return the cursor of the page of kind starting at next_id """
+    return base64.urlsafe_b64encode(f'{kind}:{next_id}'.encode()).decode()
+
+
+def decode_cursor(kind, cursor):
+    """ Return the id the page of the cursor starts at.
+
+    Raises:
+        InputError: the cursor isn't one returned for kind
+    """
+    try:
+        cursor_kind, next_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        if cursor_kind == kind and next_id.isdigit():
+            return int(next_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        pass
+    raise error.InputError("Invalid cursor")
+
+
+def page_limit(limit, default=PAGE_SIZE):
+    """ Return the limit of the page, default if None.
+
+    Raises:
+        InputError: the limit isn't between 1 and MAX_PAGE_SIZE
+    """
+    limit = default if limit is None else limit
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise error.InputError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def page(table, kind, limit=None, cursor=None):
+    """ Return the ids in the page of the table.
+
+    Args:
+        table (dict): uc.users or uc.channel, keyed by ids given in order from 0
+        kind (str): kind of the list, e.g. 'users'
+        limit (int): most ids in the page, PAGE_SIZE if None
+        cursor (str): cursor of the page, None (or '') for the first page
+
+    Returns:
+        (tuple): (list of the ids, cursor of the next page, '' if it's the last page)
+
+    Raises:
+        InputError: the limit isn't between 1 and MAX_PAGE_SIZE, or the
+                    cursor is invalid
+    """
+    limit = page_limit(limit)
+    first = decode_cursor(kind, cursor) if cursor else 0
+    size = len(table)
+    end = min(first + limit, size)
+    ids = [table_id for table_id in range(first, end) if table_id in table]
+    return ids, encode_cursor(kind, end) if end < size else ''
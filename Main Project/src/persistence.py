@@ -0,0 +1,296 @@
+""" Persistence of the data in users_channels.py
+
+    Every function that changes the data calls one of the hooks below
+    (user_changed, channel_changed, ...) right after the change. Once a storage
+    is opened, each hook turns the change into a record and appends it to the
+    storage, e.g.
+
+        {'op': 'user', 'u_id': 0, 'user': {...}}
+        {'op': 'channel', 'channel_id': 0, 'channel': {...}}
+        {'op': 'message', 'channel_id': 0, 'message': {...}}
+        {'op': 'pending', 'channel_id': 0, 'message': {...}}
+        {'op': 'remove', 'message_id': 1, 'channel_id': 0, 'log_seq': 1}
+        {'op': 'counters', 'total_msg': 2, 'handle_counters': {'firstlast': 1}}
+        {'op': 'clear'}
+
+    Records store the whole entity (they are upserts), so replaying a record
+    whose change is already in the data is harmless. The indexes (tokens,
+    emails, handles, messages, the search index, 'in_channels' and 'msg_sent')
+    are not stored, they are rebuilt when the data is recovered. The members
+    of a channel are stored with their join numbers, which give the order of
+    'in_channels'. The removed messages that pages can still start at
+    (uc.removed_msgs) are stored as their 'remove' records.
+
+    The data in users_channels.py stays the copy every request is served from,
+    the storage is only read when the data is recovered.
+    When no storage is opened (the default) the hooks only bump the versions
+    of the changed entities, see fragments.py.
+
+@date 18/10/2026
+"""
+
+import itertools
+
+import users_channels as uc
+import fragments
+from message_log import msg_log_append, msg_log_keep_removed, msg_log_remove
+from search_index import search_index_add
+import sqlite_store
+import wal_store
+
+# Storages that can be opened, see config.STORAGE
+STORAGES = {
+    'wal': wal_store,
+    'sqlite': sqlite_store,
+}
+
+# the opened storage, None when the data is only kept in memory
+storage = None
+
+# keys of the dictionaries that are rebuilt on recovery instead of stored
+DERIVED_USER_KEYS = ('in_channels', 'msg_sent', 'img_urls')
+DERIVED_CHANNEL_KEYS = ('messages', 'msg_seqs', 'next_seq', 'msg_tombstones')
+
+
+# Records
+
+
+def user_record(u_id):
+    """ Return the record storing the user """
+    user = {key: value for key, value in uc.users[u_id].items()
+            if key not in DERIVED_USER_KEYS}
+    return {'op': 'user', 'u_id': u_id, 'user': user}
+
+
+def channel_record(channel_id):
+    """ Return the record storing the channel, without its messages """
+    channel_info = {key: value for key, value in uc.channel[channel_id].items()
+                    if key not in DERIVED_CHANNEL_KEYS}
+    # [[uid, join number], ...]
+    channel_info['members'] = [list(member) for member in list(channel_info['members'].items())]
+    channel_info['owners'] = list(channel_info['owners'])
+    return {'op': 'channel', 'channel_id': channel_id, 'channel': channel_info}
+
+
+def remove_record(channel_id, msg_id, seq):
+    """ Return the record storing the removal of the message """
+    return {'op': 'remove', 'message_id': msg_id, 'channel_id': channel_id, 'log_seq': seq}
+
+
+def state_records():
+    """ Yield the records of the whole data, used by the storages for snapshots """
+    yield {
+        'op': 'counters',
+        'total_msg': uc.TOTAL_MSG,
+        'handle_counters': dict(uc.handle_counters),
+    }
+    for u_id in list(uc.users):
+        yield user_record(u_id)
+    for channel_id in list(uc.channel):
+        yield channel_record(channel_id)
+        for msg in list(uc.channel[channel_id]['messages']):
+            if msg is not None:
+                yield {'op': 'message', 'channel_id': channel_id, 'message': msg}
+        for msg_id, seq in list(uc.removed_msgs.get(channel_id, {}).items()):
+            yield remove_record(channel_id, msg_id, seq)
+    for channel_id, msg in list(uc.pending_msgs.values()):
+        yield {'op': 'pending', 'channel_id': channel_id, 'message': msg}
+
+
+# Hooks
+
+
+def user_changed(u_id):
+    """ Store the user after it's registered or changed """
+    fragments.entity_changed('user', u_id)
+    if storage is not None:
+        storage.append(user_record(u_id))
+
+
+def channel_changed(channel_id):
+    """ Store the channel after it's created or changed (except its messages) """
+    fragments.entity_changed('channel', channel_id)
+    if storage is not None:
+        storage.append(channel_record(channel_id))
+
+
+def handle_counter_changed(base):
+    """ Store the next suffix of the base handle after a handle is generated """
+    if storage is not None:
+        storage.append({'op': 'counters', 'total_msg': uc.TOTAL_MSG,
+                        'handle_counters': {base: uc.handle_counters[base]}})
+
+
+def message_changed(msg_id):
+    """ Store the message after it's published or changed """
+    channel_id, msg, __ = uc.messages[msg_id]
+    fragments.entity_changed('message', msg_id, channel_id)
+    if storage is not None:
+        storage.append({'op': 'message', 'channel_id': channel_id, 'message': msg})
+
+
+def message_pending(msg_id):
+    """ Store the message after it's scheduled by message_send_later """
+    if storage is not None:
+        channel_id, msg = uc.pending_msgs[msg_id]
+        storage.append({'op': 'pending', 'channel_id': channel_id, 'message': msg})
+
+
+def message_removed(channel_id, msg):
+    """ Store the removal of the message """
+    fragments.entity_changed('message', msg['message_id'], channel_id)
+    if storage is not None:
+        storage.append(remove_record(channel_id, msg['message_id'], msg['log_seq']))
+
+
+def data_cleared():
+    """ Store the removal of the whole data (other.clear) """
+    fragments.clear()
+    if storage is not None:
+        storage.append({'op': 'clear'})
+
+
+def wait_durable():
+    """ Block until every change made by the current thread is stored """
+    if storage is not None:
+        storage.wait()
+
+
+# Recovery
+
+
+def clear_data():
+    """ Remove the whole data, before the records are replayed """
+    uc.users.clear()
+    uc.channel.clear()
+    uc.messages.clear()
+    uc.removed_msgs.clear()
+    uc.pending_msgs.clear()
+    uc.handle_counters.clear()
+    uc.TOTAL_MSG = 0
+
+
+def replay(record):
+    """ Apply the record to the data """
+    op = record['op']
+    if op == 'user':
+        uc.users[record['u_id']] = dict(record['user'], in_channels={}, msg_sent=set())
+    elif op == 'channel':
+        channel_info = record['channel']
+        # records stored before the join numbers list the uids only
+        channel_info['members'] = dict(member if isinstance(member, list) else (member, None)
+                                       for member in channel_info['members'])
+        channel_info['owners'] = dict.fromkeys(channel_info['owners'])
+        old = uc.channel.get(record['channel_id'], {'messages': [], 'msg_seqs': [],
+                                                    'next_seq': 0, 'msg_tombstones': 0})
+        for key in DERIVED_CHANNEL_KEYS:
+            channel_info[key] = old[key]
+        uc.channel[record['channel_id']] = channel_info
+    elif op == 'message':
+        replay_message(record['channel_id'], record['message'])
+    elif op == 'pending':
+        msg = record['message']
+        uc.pending_msgs[msg['message_id']] = (record['channel_id'], msg)
+        uc.TOTAL_MSG = max(uc.TOTAL_MSG, msg['message_id'] + 1)
+    elif op == 'remove':
+        msg_id = record['message_id']
+        uc.pending_msgs.pop(msg_id, None)
+        if msg_id in uc.messages:
+            msg_log_remove(msg_id)
+        elif 'log_seq' in record and record['channel_id'] in uc.channel:
+            # the message was compacted away by the storage
+            msg_log_keep_removed(record['channel_id'], msg_id, record['log_seq'])
+        uc.TOTAL_MSG = max(uc.TOTAL_MSG, msg_id + 1)
+    elif op == 'counters':
+        uc.TOTAL_MSG = max(uc.TOTAL_MSG, record['total_msg'])
+        uc.handle_counters.update(record['handle_counters'])
+    elif op == 'clear':
+        clear_data()
+
+
+def replay_message(channel_id, msg):
+    """ Store the message in the channel, or replace it if it's already there """
+    msg_id = msg['message_id']
+    uc.pending_msgs.pop(msg_id, None)
+    uc.TOTAL_MSG = max(uc.TOTAL_MSG, msg_id + 1)
+
+    entry = uc.messages.get(msg_id)
+    if entry is None:
+        msg_log_append(channel_id, msg)
+    else:
+        uc.channel[channel_id]['messages'][entry[2]] = msg
+        entry[1] = msg
+
+
+def rebuild_indexes():
+    """ Rebuild the indexes of the data from the replayed records """
+    uc.tokens.clear()
+    uc.emails.clear()
+    uc.handles.clear()
+    uc.verified_tokens.clear()
+    uc.search_words.clear()
+    uc.search_trigrams.clear()
+    uc.img_refs.clear()
+
+    for u_id, user in uc.users.items():
+        user['in_channels'] = {}
+        user['msg_sent'] = set()
+        user['img_urls'] = {}
+        # same as auth.normalise_email
+        uc.emails[user['email'].lower()] = u_id
+        uc.handles[user['username']] = u_id
+        if user['token'] != '':
+            uc.tokens[user['token']] = u_id
+        if user['profile_img_url'] != '':
+            uc.img_refs[user['profile_img_url']] = uc.img_refs.get(user['profile_img_url'], 0) + 1
+
+    # (join number, channel_id) of each membership, without a join number
+    # the channels are ordered by channel_id before the numbered ones
+    joined = []
+    for channel_id in sorted(uc.channel):
+        channel_info = uc.channel[channel_id]
+        for u_id, join_id in channel_info['members'].items():
+            joined.append((-1 if join_id is None else join_id, channel_id, u_id))
+        for msg in channel_info['messages']:
+            if msg is not None:
+                uc.users[msg['u_id']]['msg_sent'].add(msg['message_id'])
+                search_index_add(msg['message_id'], msg['message'])
+
+    joined.sort()
+    for __, channel_id, u_id in joined:
+        uc.users[u_id]['in_channels'][channel_id] = None
+    uc.join_ids = itertools.count(joined[-1][0] + 1 if joined else 0)
+
+
+def open_storage(kind, path):
+    """ Recover the data from the storage and store every later change in it.
+        The data in memory is replaced by the recovered data.
+        The caller has to schedule the recovered pending messages and standups.
+
+    Args:
+        kind (str): the storage, a key of STORAGES
+        path (str): where the storage keeps the data
+    """
+    global storage
+
+    store = STORAGES[kind]
+    store.open_store(path, state_records)
+
+    clear_data()
+    for record in store.load():
+        replay(record)
+    rebuild_indexes()
+
+    store.start()
+    storage = store
+
+
+def close_storage():
+    """ Write every stored change and close the storage,
+        later changes are only kept in memory.
+    """
+    global storage
+
+    if storage is not None:
+        store, storage = storage, None
+        store.close()
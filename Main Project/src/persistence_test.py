@@ -0,0 +1,349 @@
+'''
+Tests for persistence.py, wal_store.py and sqlite_store.py
+
+The data is stored in a temporary directory, the storage is then closed, the
+data in memory cleared and recovered from the storage.
+'''
+
+# Libraries
+import os
+import sqlite3
+from copy import deepcopy
+
+import pytest
+
+# src files
+import auth as au
+import channel as ch
+import channels as chs
+import config
+import message as msg
+import message_log
+import other as o
+import persistence
+import sqlite_store
+import user as u
+import users_channels as uc
+
+
+# pylint: disable=redefined-outer-name
+
+@pytest.fixture(params=list(persistence.STORAGES))
+def store(request, tmp_path, monkeypatch):
+    """ Open each kind of storage in a temporary directory
+
+    Returns:
+        (tuple): the kind of storage, the data directory
+    """
+    monkeypatch.setattr(config, 'WAL_FSYNC', False)
+    o.clear()
+    persistence.open_storage(request.param, str(tmp_path))
+    yield request.param, str(tmp_path)
+    persistence.close_storage()
+    o.clear()
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """ Open the WAL storage in a temporary directory
+
+    Returns:
+        (str): the data directory
+    """
+    monkeypatch.setattr(config, 'WAL_FSYNC', False)
+    o.clear()
+    persistence.open_storage('wal', str(tmp_path))
+    yield str(tmp_path)
+    persistence.close_storage()
+    o.clear()
+
+
+def data_state():
+    """ Return a copy of the data and its indexes.
+        Removed messages may be compacted by the storage,
+        so the tombstones and positions of the messages are left out.
+    """
+    channels = {channel_id: dict(channel_info,
+                                 messages=[msg for msg in channel_info['messages'] if msg],
+                                 msg_seqs=None, msg_tombstones=None)
+                for channel_id, channel_info in uc.channel.items()}
+    return deepcopy({
+        'users': uc.users,
+        'channel': channels,
+        'messages': {msg_id: entry[:2] for msg_id, entry in uc.messages.items()},
+        'removed_msgs': uc.removed_msgs,
+        'pending_msgs': uc.pending_msgs,
+        'tokens': uc.tokens,
+        'emails': uc.emails,
+        'handles': uc.handles,
+        'search_words': uc.search_words,
+        'TOTAL_MSG': uc.TOTAL_MSG,
+    })
+
+
+def recover(store):
+    """ Close the storage, clear the data in memory and recover it
+
+    Args:
+        store (tuple): the kind of storage, the data directory
+    """
+    persistence.close_storage()
+    o.clear()
+    assert uc.users == {}
+    persistence.open_storage(*store)
+
+
+def activities():
+    """ Register 2 users in a channel, send, edit, react to,
+        pin and remove messages, schedule a message and change a handle
+        (the newest message is removed)
+
+    Returns:
+        (dict): u_id and token of user_1
+        (dict): u_id and token of user_2
+        (int): channel_id of the channel
+    """
+    user_1 = au.auth_register("z1111111@ad.unsw.edu.au", "passWord", "First", "Last")
+    user_2 = au.auth_register("z2222222@ad.unsw.edu.au", "passWord", "First", "Last")
+    channel_id = chs.channels_create(user_1['token'], "channel", True)['channel_id']
+    ch.channel_join(user_2['token'], channel_id)
+
+    msg_ids = [msg.message_send(user_2['token'], channel_id, f"message {i}")['message_id']
+               for i in range(10)]
+    msg.message_edit(user_2['token'], msg_ids[0], "edited message")
+    msg.message_react(user_1['token'], msg_ids[1], 1)
+    msg.message_pin(user_1['token'], msg_ids[2])
+    msg.message_remove(user_1['token'], msg_ids[3])
+    msg.message_remove(user_1['token'], msg_ids[9])
+    msg.message_send_later(user_1['token'], channel_id, "later",
+                           ch.generate_timestamp() + 600)
+    u.user_profile_sethandle(user_2['token'], "newhandle")
+    return user_1, user_2, channel_id
+
+
+def test_recover_data(store):
+    """ The recovered data is the same as the data before the storage is closed """
+    user_1, user_2, channel_id = activities()
+    state = data_state()
+
+    recover(store)
+    assert data_state() == state
+
+    # the sessions, indexes and counters still work
+    assert ch.channel_messages(user_2['token'], channel_id, 0)['messages'][0]['message'] \
+        == "message 8"
+    assert len(o.search(user_1['token'], "message")['messages']) == 8
+    new_id = msg.message_send(user_1['token'], channel_id, "new")['message_id']
+    assert new_id == state['TOTAL_MSG']
+    au.auth_register("z3333333@ad.unsw.edu.au", "passWord", "First", "Last")
+    assert len(uc.handles) == 3
+
+
+def test_recover_twice(store):
+    """ Changes made after a recovery are stored as well """
+    user_1, __, channel_id = activities()
+    recover(store)
+    ch.channel_leave(user_1['token'], channel_id)
+    state = data_state()
+
+    recover(store)
+    assert data_state() == state
+
+
+def test_recover_from_snapshot(data_dir, monkeypatch):
+    """ Once enough records are written, a snapshot replaces the older segments """
+    monkeypatch.setattr(config, 'SNAPSHOT_EVERY', 10)
+    user_1 = au.auth_register("z1111111@ad.unsw.edu.au", "passWord", "First", "Last")
+    channel_id = chs.channels_create(user_1['token'], "channel", True)['channel_id']
+    for i in range(100):
+        msg.message_send(user_1['token'], channel_id, f"message {i}")
+        persistence.wait_durable()
+    state = data_state()
+
+    recover(('wal', data_dir))
+    assert os.path.exists(os.path.join(data_dir, 'snapshot.jsonl'))
+    assert len([name for name in os.listdir(data_dir) if name.startswith('wal-')]) <= 3
+    assert data_state() == state
+
+
+def join_in_reverse():
+    """ user_2 joins 3 channels in the reverse order of their channel_ids
+
+    Returns:
+        (dict): u_id and token of user_2
+        (list): channel_ids in the order user_2 joined them
+    """
+    user_1 = au.auth_register("z1111111@ad.unsw.edu.au", "passWord", "First", "Last")
+    user_2 = au.auth_register("z2222222@ad.unsw.edu.au", "passWord", "First", "Last")
+    channel_ids = [chs.channels_create(user_1['token'], f"channel {i}", True)['channel_id']
+                   for i in range(3)]
+    for channel_id in reversed(channel_ids):
+        ch.channel_join(user_2['token'], channel_id)
+    return user_2, channel_ids[::-1]
+
+
+def test_recover_join_order(store):
+    """ The channels of a user are recovered in the order they joined them """
+    user_2, joined = join_in_reverse()
+    ch.channel_leave(user_2['token'], joined[1])
+    ch.channel_join(user_2['token'], joined[1])
+    joined.append(joined.pop(1))
+
+    recover(store)
+    assert list(uc.users[user_2['u_id']]['in_channels']) == joined
+    assert [channel['channel_id'] for channel in chs.channels_list(user_2['token'])['channels']] \
+        == joined
+
+
+def test_recover_join_order_from_snapshot(data_dir, monkeypatch):
+    """ The join order is kept when the records are replaced by a snapshot """
+    monkeypatch.setattr(config, 'SNAPSHOT_EVERY', 5)
+    user_2, joined = join_in_reverse()
+    for i in range(20):
+        chs.channels_create(user_2['token'], f"more {i}", True)
+        persistence.wait_durable()
+    joined = list(uc.users[user_2['u_id']]['in_channels'])
+
+    recover(('wal', data_dir))
+    assert os.path.exists(os.path.join(data_dir, 'snapshot.jsonl'))
+    assert list(uc.users[user_2['u_id']]['in_channels']) == joined
+
+
+def remove_cursors(monkeypatch):
+    """ Send 10 messages and remove the 6 newest, compacting the log
+
+    Returns:
+        (str): token of the sender
+        (int): channel_id of the channel
+        (list): message_ids of the messages, oldest first
+    """
+    monkeypatch.setattr(message_log, 'COMPACT_MIN_TOMBSTONES', 1)
+    user_1 = au.auth_register("z1111111@ad.unsw.edu.au", "passWord", "First", "Last")
+    channel_id = chs.channels_create(user_1['token'], "channel", True)['channel_id']
+    msg_ids = [msg.message_send(user_1['token'], channel_id, f"message {i}")['message_id']
+               for i in range(10)]
+    for i in range(4, 10):
+        msg.message_remove(user_1['token'], msg_ids[i])
+        persistence.wait_durable()
+    return user_1['token'], channel_id, msg_ids
+
+
+def assert_remove_cursors(token, channel_id, msg_ids):
+    """ Pages start at the messages removed by remove_cursors """
+    page = ch.channel_messages(token, channel_id, before_message_id=msg_ids[7])
+    assert [m['message_id'] for m in page['messages']] == msg_ids[3::-1]
+    page = ch.channel_messages(token, channel_id, after_message_id=msg_ids[6])
+    assert page['messages'] == []
+
+
+def test_recover_removed_cursor(store, monkeypatch):
+    """ Pages can start at a removed message after a recovery """
+    token, channel_id, msg_ids = remove_cursors(monkeypatch)
+    assert uc.channel[channel_id]['msg_tombstones'] == 0
+
+    recover(store)
+    assert_remove_cursors(token, channel_id, msg_ids)
+    # the sequence numbers of the removed messages are not reused
+    new_id = msg.message_send(token, channel_id, "new")['message_id']
+    page = ch.channel_messages(token, channel_id, after_message_id=msg_ids[9])
+    assert [m['message_id'] for m in page['messages']] == [new_id]
+
+
+def test_recover_removed_cursor_from_snapshot(data_dir, monkeypatch):
+    """ The removed messages pages can start at are kept by the snapshots """
+    monkeypatch.setattr(config, 'SNAPSHOT_EVERY', 5)
+    token, channel_id, msg_ids = remove_cursors(monkeypatch)
+
+    recover(('wal', data_dir))
+    assert os.path.exists(os.path.join(data_dir, 'snapshot.jsonl'))
+    assert_remove_cursors(token, channel_id, msg_ids)
+
+
+def test_recover_partial_record(data_dir):
+    """ A record partially written by a crash is ignored """
+    activities()
+    state = data_state()
+    persistence.close_storage()
+
+    last_segment = max(name for name in os.listdir(data_dir) if name.startswith('wal-'))
+    with open(os.path.join(data_dir, last_segment), 'a') as file:
+        file.write('{"op": "remove", "mess')
+
+    recover(('wal', data_dir))
+    assert data_state() == state
+
+
+def test_recover_cleared_data(store):
+    """ Data removed by other.clear isn't recovered """
+    activities()
+    o.clear()
+    au.auth_register("z4444444@ad.unsw.edu.au", "passWord", "Other", "User")
+    state = data_state()
+
+    recover(store)
+    assert data_state() == state
+    assert list(uc.emails) == ["z4444444@ad.unsw.edu.au"]
+
+
+def test_sqlite_indexed_columns(store):
+    """ The database can be queried by the indexed columns """
+    kind, path = store
+    if kind != 'sqlite':
+        pytest.skip("only the sqlite storage has tables")
+    user_1, __, channel_id = activities()
+    persistence.wait_durable()
+
+    conn = sqlite3.connect(os.path.join(path, sqlite_store.DATABASE_FILE))
+    assert conn.execute("SELECT u_id FROM users WHERE handle = 'newhandle'").fetchall() \
+        == [(1,)]
+    assert conn.execute("SELECT u_id FROM users WHERE email = 'z1111111@ad.unsw.edu.au'") \
+        .fetchall() == [(user_1['u_id'],)]
+    assert conn.execute("SELECT count(*) FROM messages WHERE channel_id = ? "
+                        "AND NOT is_pending", (channel_id,)).fetchone() == (8,)
+    conn.close()
+
+
+def test_recover_handle_counters(store):
+    """ The next suffix of each base handle is recovered """
+    for i in range(3):
+        au.auth_register(f"z{i}@ad.unsw.edu.au", "passWord", "First", "Last")
+    persistence.wait_durable()
+    assert uc.handle_counters == {'firstlast': 3}
+
+    recover(store)
+    assert uc.handle_counters == {'firstlast': 3}
+    au.auth_register("z3@ad.unsw.edu.au", "passWord", "First", "Last")
+    assert 'firstlast3' in uc.handles
+
+
+def test_sqlite_opened_once(store):
+    """ A database can't be opened again while it's open """
+    kind, path = store
+    if kind != 'sqlite':
+        pytest.skip("only the sqlite storage is locked")
+    database = sqlite_store.database
+    with pytest.raises(RuntimeError):
+        sqlite_store.open_store(path, None)
+    assert sqlite_store.database == database
+
+    recover(store)
+    assert sqlite_store.database == database
+
+
+def test_replay_members_without_join_numbers():
+    """ Channel records stored before the join numbers recover the members
+        in channel_id order, before the numbered memberships
+    """
+    o.clear()
+    user_2, joined = join_in_reverse()
+    records = list(persistence.state_records())
+    for record in records:
+        if record['op'] == 'channel' and record['channel_id'] != joined[0]:
+            record['channel']['members'] = [u_id for u_id, __ in record['channel']['members']]
+
+    persistence.clear_data()
+    for record in records:
+        persistence.replay(record)
+    persistence.rebuild_indexes()
+    assert list(uc.users[user_2['u_id']]['in_channels']) == sorted(joined[1:]) + joined[:1]
+    o.clear()
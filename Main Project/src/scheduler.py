@@ -0,0 +1,136 @@
+""" Scheduler that runs jobs at a given time.
+
+    Every job is stored in a min-heap keyed by the time it is due, and a
+    single dispatcher thread sleeps until the earliest job is due, so
+    pending jobs cost nothing until they run.
+
+    Cancelled jobs are only marked as cancelled (their func is set to None)
+    and skipped once they are due. The heap is rebuilt without them when
+    more than half of it are cancelled jobs.
+
+@date 18/10/2026
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+# min-heap of [when, job_id, func, args]
+jobs = []
+# pending jobs, maps the job_id to its entry in jobs
+pending = {}
+# amount of cancelled jobs still in jobs
+cancelled = 0
+# guards the variables above, notified whenever an earlier job is scheduled
+condition = threading.Condition()
+job_ids = itertools.count()
+dispatcher_thread = None
+
+
+def schedule(when, func, *args):
+    """ Run func(*args) on the dispatcher thread at the unix time when.
+
+    Args:
+        when (float): unix timestamp of when the job is due
+        func (function): the job
+        args: arguments passed to func
+
+    Returns:
+        job_id (int): id of the job
+    """
+    global dispatcher_thread
+
+    job_id = next(job_ids)
+    entry = [when, job_id, func, args]
+    with condition:
+        heapq.heappush(jobs, entry)
+        pending[job_id] = entry
+        if jobs[0][1] == job_id:
+            condition.notify()
+        if dispatcher_thread is None:
+            dispatcher_thread = threading.Thread(target=dispatcher, daemon=True)
+            dispatcher_thread.start()
+    return job_id
+
+
+def cancel(job_id):
+    """ Cancel the job if it's still pending.
+
+    Args:
+        job_id (int): id returned by schedule
+
+    Returns:
+        (bool): True if the job was pending, False if it already ran
+                (or is running) or was cancelled
+    """
+    global jobs, cancelled
+
+    with condition:
+        entry = pending.pop(job_id, None)
+        if entry is None:
+            return False
+        entry[2] = entry[3] = None
+        cancelled += 1
+        if cancelled * 2 > len(jobs):
+            jobs = [entry for entry in jobs if entry[2] is not None]
+            heapq.heapify(jobs)
+            cancelled = 0
+    return True
+
+
+def pending_jobs():
+    """ Report the pending jobs, from the earliest to the latest.
+
+    Returns:
+        (list): a dictionary for each job {
+            'job_id': id of the job,
+            'when': unix timestamp of when the job is due,
+            'name': name of the function run by the job,
+            'args': arguments passed to the function,
+        }
+    """
+    # cancel() empties the entries in place, so they are only read under the lock
+    with condition:
+        return [{'job_id': job_id, 'when': when, 'name': func.__name__, 'args': args}
+                for when, job_id, func, args in sorted(pending.values())]
+
+
+def clear():
+    """ Drop every pending job """
+    global cancelled
+
+    with condition:
+        jobs.clear()
+        pending.clear()
+        cancelled = 0
+
+
+def next_due_job():
+    """ Block until the earliest job is due and pop it from the heap.
+
+    Returns:
+        (tuple): (func, args) of the job
+    """
+    global cancelled
+
+    with condition:
+        while True:
+            while not jobs or jobs[0][0] > time.time():
+                condition.wait(jobs[0][0] - time.time() if jobs else None)
+            __, job_id, func, args = heapq.heappop(jobs)
+            if func is not None:
+                del pending[job_id]
+                return func, args
+            cancelled -= 1
+
+
+def dispatcher():
+    """ Run the jobs one by one when they are due, forever """
+    while True:
+        func, args = next_due_job()
+        try:
+            func(*args)
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
@@ -0,0 +1,98 @@
+'''
+Tests for scheduler.py
+'''
+
+# Libraries
+import sys
+import threading
+import time
+
+import pytest
+
+# src files
+import scheduler
+
+
+# pylint: disable=redefined-outer-name
+
+@pytest.fixture
+def ran():
+    """ Clear the scheduler, and return a list the jobs append their argument to
+        with an event set by the job 'done'
+    """
+    scheduler.clear()
+    results = []
+    done = threading.Event()
+
+    def job(value):
+        results.append(value)
+        if value == 'done':
+            done.set()
+
+    yield results, job, done
+    scheduler.clear()
+
+
+def test_jobs_run_in_order(ran):
+    """ Jobs run in the order they are due, not the order they are scheduled """
+    results, job, done = ran
+    now = time.time()
+    scheduler.schedule(now + 0.2, job, 'done')
+    scheduler.schedule(now + 0.1, job, 'second')
+    scheduler.schedule(now, job, 'first')
+
+    assert done.wait(5)
+    assert results == ['first', 'second', 'done']
+
+
+def test_cancel(ran):
+    """ Cancelled jobs don't run, and can only be cancelled once """
+    results, job, done = ran
+    now = time.time()
+    job_ids = [scheduler.schedule(now + 0.05, job, i) for i in range(100)]
+    scheduler.schedule(now + 0.1, job, 'done')
+
+    assert all(scheduler.cancel(job_id) for job_id in job_ids[1:])
+    assert not scheduler.cancel(job_ids[1])
+
+    assert done.wait(5)
+    assert results == [0, 'done']
+    assert not scheduler.cancel(job_ids[0])
+
+
+def test_pending_jobs(ran):
+    """ pending_jobs reports the jobs that are not run or cancelled yet """
+    __, job, __ = ran
+    now = time.time()
+    later = scheduler.schedule(now + 60, job, 'later')
+    sooner = scheduler.schedule(now + 30, job, 'sooner')
+    cancelled = scheduler.schedule(now + 10, job, 'cancelled')
+    scheduler.cancel(cancelled)
+
+    assert scheduler.pending_jobs() == [
+        {'job_id': sooner, 'when': now + 30, 'name': 'job', 'args': ('sooner',)},
+        {'job_id': later, 'when': now + 60, 'name': 'job', 'args': ('later',)},
+    ]
+
+
+def test_pending_jobs_while_cancelling(ran):
+    """ pending_jobs reports whole jobs while another thread cancels them """
+    __, job, __ = ran
+    now = time.time()
+    job_ids = [scheduler.schedule(now + 60, job, i) for i in range(2000)]
+
+    def cancel_all():
+        for job_id in job_ids:
+            scheduler.cancel(job_id)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        worker = threading.Thread(target=cancel_all)
+        worker.start()
+        while worker.is_alive():
+            assert all(report['name'] == 'job' for report in scheduler.pending_jobs())
+        worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert scheduler.pending_jobs() == []
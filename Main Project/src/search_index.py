@@ -0,0 +1,122 @@
+""" Inverted indexes of the messages for other.search
+
+    uc.search_words maps every word (whitespace separated, case sensitive)
+    to the set of message_ids of the messages that contain the word.
+    uc.search_trigrams maps every 3 characters long substring (trigram)
+    to the set of message_ids of the messages that contain the trigram.
+    Both are updated whenever a message is published, edited or removed,
+    while holding locks.search_lock.
+
+@date 18/10/2026
+"""
+
+import sys
+
+import users_channels as uc
+from locks import search_lock
+
+
+def msg_words(text):
+    """ Return the set of words in the text """
+    return set(text.split())
+
+
+def msg_trigrams(text):
+    """ Return the set of trigrams (substrings of length 3) in the text """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def postings_add(index, keys, msg_id):
+    """ Add msg_id to the posting list of each key in the index """
+    for key in keys:
+        index.setdefault(key, set()).add(msg_id)
+
+
+def postings_remove(index, keys, msg_id):
+    """ Remove msg_id from the posting list of each key in the index """
+    for key in keys:
+        msg_ids = index[key]
+        msg_ids.discard(msg_id)
+        if not msg_ids:
+            del index[key]
+
+
+def search_index_add(msg_id, text):
+    """ Index the message.
+
+    Args:
+        msg_id (int): message_id of the message
+        text (str): the message's text
+    """
+    words, trigrams = msg_words(text), msg_trigrams(text)
+    with search_lock:
+        postings_add(uc.search_words, words, msg_id)
+        postings_add(uc.search_trigrams, trigrams, msg_id)
+
+
+def search_index_remove(msg_id, text):
+    """ Remove the message from the index.
+
+    Args:
+        msg_id (int): message_id of the message
+        text (str): the message's text when it was indexed
+    """
+    words, trigrams = msg_words(text), msg_trigrams(text)
+    with search_lock:
+        postings_remove(uc.search_words, words, msg_id)
+        postings_remove(uc.search_trigrams, trigrams, msg_id)
+
+
+def search_candidates(query_str):
+    """ Return the message_ids of the messages that may contain the query_str.
+
+        A message containing query_str contains every trigram of query_str,
+        so the candidates are the intersection of their posting lists.
+        Queries shorter than 3 characters have no trigram, finding the words
+        containing them would scan the whole word index, so every message
+        is a candidate and the caller scans the messages of its channels.
+        The caller still has to check if query_str is in the message.
+
+    Args:
+        query_str (str): the query
+
+    Returns:
+        (set): message_ids of the candidates,
+               None if the query_str is shorter than 3 characters
+               (every message is a candidate)
+    """
+    if len(query_str) < 3:
+        return None
+
+    with search_lock:
+        postings = sorted((uc.search_trigrams.get(trigram, set())
+                           for trigram in msg_trigrams(query_str)), key=len)
+        return postings[0].intersection(*postings[1:])
+
+
+def search_index_stats():
+    """ Return the size of the indexes.
+
+    Returns:
+        (dict): {
+            'words': amount of words indexed,
+            'trigrams': amount of trigrams indexed,
+            'postings': total amount of message_ids in the posting lists,
+            'memory_bytes': approximate memory used by the indexes,
+        }
+    """
+    postings = 0
+    memory = 0
+    with search_lock:
+        for index in (uc.search_words, uc.search_trigrams):
+            memory += sys.getsizeof(index)
+            for key, msg_ids in index.items():
+                postings += len(msg_ids)
+                memory += sys.getsizeof(key) + sys.getsizeof(msg_ids)
+
+    return {
+        'words': len(uc.search_words),
+        'trigrams': len(uc.search_trigrams),
+        'postings': postings,
+        'memory_bytes': memory,
+    }
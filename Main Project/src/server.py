@@ -11,7 +11,7 @@
 # import sys
 import os
 from json import dumps
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, g
 from flask_cors import CORS
 
 
@@ -25,6 +25,12 @@ import other
 from error import InputError
 import standup as st
 import bonus as bn
+import config
+import persistence
+import images
+import fragments
+import compression
+import users_channels as uc
 
 def default_handler(err):
     """ Handling default error """
@@ -42,39 +48,50 @@ def default_handler(err):
 # Helper functions for user_profile_uploadphoto
 
 
-def img_server_path(profile):
-    """ Combine the current server url with the image url
-
-    Args:
-        url (str): name of the image
+def public_url():
+    """ Base url of the server in the urls of the photos, config.PUBLIC_URL
+        or else the url the request was sent to
 
     Returns:
-        (str): the url to access image on current flockr server port
+        (str): the url, ending with '/'
     """
-    url = profile['profile_img_url']
-    profile['profile_img_url'] = request.host_url + 'static/' + url
-    return profile
+    if config.PUBLIC_URL:
+        return config.PUBLIC_URL.rstrip('/') + '/'
+    return request.host_url
 
 
-def update_img_url(profile_list=None):
-    """ Helper function that update img's url with current flask
-        host url.
+def update_img_url(profile_list, size=None):
+    """ Helper function that replaces the path of the photo of each profile
+        by its url on the flockr server. The url is computed once per user
+        and cached, see images.profile_img_url.
 
     Args:
-        profile_list (list): list of profiles to be changed
+        profile_list (list): list of profiles to be changed, each with its 'u_id'
+        size (int): one of images.VARIANT_SIZES for the resized photos,
+                    None for the full photos
 
     Returns:
         profile_list (list): list of profiles with 'profile_img_url' changed
     """
-    try:
-        if profile_list['profile_img_url'] != '':
-            profile_list = img_server_path(profile_list)
-    except:
-        for index, profile in enumerate(profile_list):
-            if profile['profile_img_url'] == '': continue
-            profile_list[index] = img_server_path(profile)
-    finally:
-        return profile_list
+    base_url = public_url()
+    for profile in profile_list:
+        profile['profile_img_url'] = images.profile_img_url(profile['u_id'], base_url, size)
+    return profile_list
+
+
+def img_size_arg():
+    """ Read the optional 'img_size' argument of the request, the size of
+        the profile photos returned (one of images.VARIANT_SIZES)
+
+    Returns:
+        (int): the size, None when not given (the full photos)
+    """
+    size = request.args.get('img_size')
+    if size is None:
+        return None
+    if not size.isdigit() or int(size) not in images.VARIANT_SIZES:
+        raise InputError(f"img_size must be one of {images.VARIANT_SIZES}")
+    return int(size)
 
 
 APP = Flask(__name__)
@@ -83,6 +100,87 @@ APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, default_handler)
 
 
+@APP.after_request
+def wait_durable(response):
+    """ Only reply once the changes made by the request are persisted """
+    persistence.wait_durable()
+    return response
+
+
+# Routes whose responses are compressed (and cached), see compression.py
+COMPRESSED_ENDPOINTS = ('users_all_http', 'channels_listall_http',
+                        'channel_details_http', 'search_http')
+
+
+def compressed_version():
+    """ Return the version of the data the response of the request is built
+        from (see fragments.data_version), None if the token isn't valid
+    """
+    u_id = uc.tokens.get(request.args.get('token'))
+    if u_id is None:
+        return None
+    # the user of the token, so the response isn't reused once they log out
+    user = ('user', u_id)
+    if request.endpoint == 'users_all_http':
+        return fragments.data_version(kinds=('user',))
+    if request.endpoint == 'channels_listall_http':
+        return fragments.data_version([user], ('channel',))
+    if request.endpoint == 'channel_details_http':
+        channel_id = request.args.get('channel_id', type=int)
+        return fragments.data_version([('channel', channel_id)], ('user',))
+    # search_http: the messages of the user's channels, and their memberships
+    in_channels = list(uc.users.get(u_id, {}).get('in_channels', ()))
+    return fragments.data_version(
+        [user] + [('channel_messages', channel_id) for channel_id in in_channels], ('channel',))
+
+
+@APP.before_request
+def cached_compressed_response():
+    """ Reply with the cached compressed response, if nothing it's built
+        from changed since it was cached
+    """
+    if request.endpoint not in COMPRESSED_ENDPOINTS:
+        return None
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None:
+        return None
+
+    key = (request.full_path, request.host_url, encoding)
+    version = compressed_version()
+    body = None if version is None else compression.cached(key, version)
+    if body is None:
+        g.compress = key, version
+        return None
+    response = APP.response_class(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@APP.after_request
+def compress_response(response):
+    """ Compress the response of the routes in COMPRESSED_ENDPOINTS """
+    if 'compress' not in g or response.status_code != 200:
+        return response
+    key, version = g.compress
+    body = compression.compress(key, version, response.get_data(),
+                                version is not None and compressed_version() == version)
+    if body is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = key[-1]
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@APP.after_request
+def cache_images(response):
+    """ The content of a stored photo never changes, so let clients cache it """
+    if request.endpoint == 'static' and response.status_code in (200, 304) and \
+       images.is_image_path(request.view_args.get('filename', '')):
+        response.headers['Cache-Control'] = images.IMG_CACHE_CONTROL
+    return response
+
+
 # Main routes
 
 
@@ -174,8 +272,9 @@ def channel_details_http():
     channel_id = int(request.args.get('channel_id'))
 
     all_users = ch.channel_details(token, channel_id)
-    all_users['owner_members'] = update_img_url(all_users['owner_members'])
-    all_users['all_members'] = update_img_url(all_users['all_members'])
+    size = img_size_arg()
+    all_users['owner_members'] = update_img_url(all_users['owner_members'], size)
+    all_users['all_members'] = update_img_url(all_users['all_members'], size)
 
     return dumps(all_users)
 
@@ -186,9 +285,19 @@ def channel_messages_http():
 
     token = request.args.get('token')
     channel_id = int(request.args.get('channel_id'))
-    start = int(request.args.get('start'))
+    start = request.args.get('start', 0, type=int)
+    before_message_id = request.args.get('before_message_id', type=int)
+    after_message_id = request.args.get('after_message_id', type=int)
+    limit = request.args.get('limit', type=int)
 
-    return dumps(ch.channel_messages(token, channel_id, start))
+    since = fragments.last_change
+    page = ch.channel_messages(token, channel_id, start, before_message_id,
+                               after_message_id, limit)
+    # the encoded message depends on which reacts are the user's
+    page['messages'] = fragments.encode_records(
+        page['messages'], 'message', 'message_id', since,
+        lambda message: tuple(react['is_this_user_reacted'] for react in message['reacts']))
+    return fragments.encode_object(page)
 
 
 @APP.route("/channel/leave", methods=["POST"])
@@ -248,7 +357,14 @@ def channels_listall_http():
             (json) returns of channels_listall
     """
     token = request.args.get('token')
-    return dumps(chs.channels_listall(token))
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+
+    since = fragments.last_change
+    channels = chs.channels_listall(token, limit, cursor)
+    channels['channels'] = fragments.encode_records(
+        channels['channels'], 'channel', 'channel_id', since)
+    return fragments.encode_object(channels)
 
 
 @APP.route("/channels/create", methods=["POST"])
@@ -373,7 +489,7 @@ def user_profile_http():
     u_id = int(request.args.get('u_id'))
 
     profile_all = u.user_profile(token, u_id)
-    profile_all['user'] = update_img_url(profile_all['user'])
+    update_img_url([profile_all['user']], img_size_arg())
 
     return dumps(profile_all)
 
@@ -410,11 +526,19 @@ def users_all_http():
             (json) returns of users_all
     """
     token = request.args.get('token')
+    size = img_size_arg()
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
 
-    users_all = other.users_all(token)
-    users_all['users'] = update_img_url(users_all['users'])
+    since = fragments.last_change
+    users_all = other.users_all(token, limit, cursor)
+    users_all['users'] = update_img_url(users_all['users'], size)
 
-    return dumps(users_all)
+    # the encoded user depends on the url of their photo
+    base_url = public_url()
+    users_all['users'] = fragments.encode_records(
+        users_all['users'], 'user', 'u_id', since, lambda user: (base_url, size))
+    return fragments.encode_object(users_all)
 
 
 @APP.route("/admin/userpermission/change", methods=["POST"])
@@ -438,8 +562,16 @@ def search_http():
 
     token = request.args.get('token')
     query_str = request.args.get('query_str')
+    limit = request.args.get('limit', type=int)
+
+    return dumps(other.search(token, query_str, limit))
+
+
+@APP.route("/search/stats", methods=["GET"])
+def search_stats_http():
+    """ http route for other.search_stats() """
 
-    return dumps(other.search(token, query_str))
+    return dumps(other.search_stats(request.args.get('token')))
 
 
 @APP.route("/other/clear", methods=['GET'])
@@ -490,17 +622,30 @@ def standup_send_http():
 @APP.route('/user/profile/uploadphoto', methods=['POST'])
 def user_profile_uploadphoto_http():
     """ Cropping and accessing photo of the given url.
+        With "async": true, the photo is uploaded in the background and
+        the id of the upload job is returned.
 
     Returns:
         (str): name of the image
     """
     data = request.get_json()
-    resp = u.user_profile_uploadphoto(data['token'], data['img_url'],
-                            int(data['x_start']), int(data['y_start']),
-                            int(data['x_end']), int(data['y_end']))
+    upload = u.user_profile_uploadphoto_start if data.get('async') else u.user_profile_uploadphoto
+    resp = upload(data['token'], data['img_url'],
+                  int(data['x_start']), int(data['y_start']),
+                  int(data['x_end']), int(data['y_end']))
     return dumps(resp)
 
 
+@APP.route('/user/profile/uploadphoto/status', methods=['GET'])
+def user_profile_uploadphoto_status_http():
+    """ Status of a background upload job """
+    token = request.args.get('token')
+    job_id = int(request.args.get('job_id'))
+    status = u.user_profile_uploadphoto_status(token, job_id)
+    status['profile_img_url'] = images.photo_url(public_url(), status['profile_img_url'])
+    return dumps(status)
+
+
 @APP.route('/imgurl/<filename>', methods=['GET'])
 def user_photo(filename):
     """ When images are uploaded for a user profile,
@@ -517,8 +662,15 @@ def user_photo(filename):
         photo (html): render a html page with image on the top left corner.
     """
 
-    return render_template('imgurl.html', name=filename)
+    # Content addressed photos are stored in sharded folders
+    path = images.image_path(filename)
+    return render_template('imgurl.html',
+                           name=path if images.is_image_path(path) else filename)
 
 
 if __name__ == "__main__":
+    if config.STORAGE != 'memory':
+        persistence.open_storage(config.STORAGE, config.DATA_DIR)
+        msg.schedule_pending_msgs()
+        st.schedule_active_standups()
     APP.run(port=0) # Do not edit this port
@@ -0,0 +1,287 @@
+""" SQLite storage used by persistence.py
+
+    The records are applied to the tables of an SQLite database
+    (<data directory>/flockr.db, in WAL journal mode) instead of being logged,
+    so the database always holds the latest version of each entity and
+    there is nothing to compact. Every batch of records of group_commit.py is
+    applied in one transaction.
+
+    Each entity is stored as JSON in the column 'data', the columns that are
+    looked up (email, handle, token, message_id, channel_id, time_created)
+    are also stored in indexed columns so the database can be queried directly.
+    'log_order' keeps the order the messages are published in, which is
+    the order of uc.channel[channel_id]['messages']. The table 'removed' keeps
+    the latest removed messages of each channel (see uc.removed_msgs).
+
+    The database is only a copy of the data, written behind the requests: the
+    requests are served from users_channels.py, and the ids are handed out
+    there. Several processes sharing the database would hand out the same ids
+    and overwrite each other's rows, so a database can only be opened by one
+    process at a time (the lock file flockr.db.lock is locked while it's open),
+    open_store raises RuntimeError when it's already opened.
+
+@date 18/10/2026
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+
+import config
+import group_commit
+import message_log
+
+DATABASE_FILE = 'flockr.db'
+LOCK_FILE = 'flockr.db.lock'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    token TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_handle ON users (handle);
+CREATE INDEX IF NOT EXISTS users_token ON users (token);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    time_created INTEGER NOT NULL,
+    is_pending INTEGER NOT NULL,
+    log_order INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, log_order);
+CREATE INDEX IF NOT EXISTS messages_time_created ON messages (time_created);
+
+-- the rowid gives the order of the removals
+CREATE TABLE IF NOT EXISTS removed (
+    message_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    log_seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS removed_channel ON removed (channel_id);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS handle_counters (
+    base TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+UPSERT_USER = """
+INSERT INTO users (u_id, email, handle, token, data) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (u_id) DO UPDATE SET email = excluded.email, handle = excluded.handle,
+                                 token = excluded.token, data = excluded.data
+"""
+
+UPSERT_CHANNEL = """
+INSERT INTO channels (channel_id, data) VALUES (?, ?)
+ON CONFLICT (channel_id) DO UPDATE SET data = excluded.data
+"""
+
+# a published message keeps its log_order when it's changed
+UPSERT_MESSAGE = """
+INSERT INTO messages (message_id, channel_id, u_id, time_created, is_pending, log_order, data)
+VALUES (?, ?, ?, ?, 0, ?, ?)
+ON CONFLICT (message_id) DO UPDATE SET
+    data = excluded.data,
+    log_order = CASE WHEN is_pending THEN excluded.log_order ELSE log_order END,
+    is_pending = 0
+"""
+
+UPSERT_PENDING = """
+INSERT INTO messages (message_id, channel_id, u_id, time_created, is_pending, log_order, data)
+VALUES (?, ?, ?, ?, 1, NULL, ?)
+ON CONFLICT (message_id) DO UPDATE SET data = excluded.data
+"""
+
+# only the message_log.REMOVED_MSGS_KEPT latest removals of the channel are kept
+PRUNE_REMOVED = """
+DELETE FROM removed WHERE channel_id = ? AND rowid <= (
+    SELECT rowid FROM removed WHERE channel_id = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)
+"""
+
+# message_ids are never reused, even after the newest message is removed
+UPDATE_TOTAL_MSG = """
+INSERT INTO counters (name, value) VALUES ('total_msg', ?)
+ON CONFLICT (name) DO UPDATE SET value = max(value, excluded.value)
+"""
+
+UPSERT_HANDLE_COUNTER = """
+INSERT INTO handle_counters (base, value) VALUES (?, ?)
+ON CONFLICT (base) DO UPDATE SET value = excluded.value
+"""
+
+# path of the database, None when the storage is not opened
+database = None
+# the locked lock file, while the storage is opened
+lock_file = None
+# connection used by the writer thread
+connection = None
+# log_order of the next published message, only used by the writer thread
+next_log_order = 0
+
+
+def connect():
+    """ Return a new connection to the database """
+    conn = sqlite3.connect(database, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f"PRAGMA synchronous = {'FULL' if config.WAL_FSYNC else 'NORMAL'}")
+    return conn
+
+
+def open_store(path, records): # pylint: disable=unused-argument
+    """ Open the database in the directory, creating it if needed.
+
+    Args:
+        path (str): the data directory
+        records (function): unused, the database doesn't need snapshots
+
+    Raises:
+        RuntimeError: When another process has the database opened
+    """
+    global database, lock_file
+
+    os.makedirs(path, exist_ok=True)
+    file = open(os.path.join(path, LOCK_FILE), 'a')
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        raise RuntimeError(f"{os.path.join(path, DATABASE_FILE)} is opened by another process")
+    lock_file = file
+
+    database = os.path.join(path, DATABASE_FILE)
+    with connect() as conn:
+        conn.executescript(SCHEMA)
+    conn.close()
+
+
+def load():
+    """ Yield the records of every stored entity """
+    global next_log_order
+
+    conn = connect()
+    for u_id, data in conn.execute('SELECT u_id, data FROM users ORDER BY u_id'):
+        yield {'op': 'user', 'u_id': u_id, 'user': json.loads(data)}
+    for channel_id, data in conn.execute('SELECT channel_id, data FROM channels '
+                                         'ORDER BY channel_id'):
+        yield {'op': 'channel', 'channel_id': channel_id, 'channel': json.loads(data)}
+    for channel_id, data in conn.execute('SELECT channel_id, data FROM messages '
+                                         'WHERE NOT is_pending ORDER BY log_order'):
+        yield {'op': 'message', 'channel_id': channel_id, 'message': json.loads(data)}
+    for channel_id, data in conn.execute('SELECT channel_id, data FROM messages '
+                                         'WHERE is_pending ORDER BY message_id'):
+        yield {'op': 'pending', 'channel_id': channel_id, 'message': json.loads(data)}
+    for msg_id, channel_id, seq in conn.execute('SELECT message_id, channel_id, log_seq '
+                                                'FROM removed ORDER BY rowid'):
+        yield {'op': 'remove', 'message_id': msg_id, 'channel_id': channel_id, 'log_seq': seq}
+
+    total_msg = conn.execute("SELECT value FROM counters WHERE name = 'total_msg'").fetchone()
+    yield {'op': 'counters', 'total_msg': total_msg[0] if total_msg else 0,
+           'handle_counters': dict(conn.execute('SELECT base, value FROM handle_counters'))}
+
+    next_log_order = conn.execute('SELECT coalesce(max(log_order), 0) + 1 '
+                                  'FROM messages').fetchone()[0]
+    conn.close()
+
+
+def start():
+    """ Start applying the appended records to the database.
+        Called once the stored records are loaded.
+    """
+    global connection
+
+    connection = connect()
+    group_commit.start(write_batch)
+
+
+def statements(record):
+    """ Return the list of (SQL statement, parameters) applying the record.
+        The entity is serialized right away, as it may change before
+        the statements are executed.
+    """
+    op = record['op']
+    if op == 'user':
+        user = record['user']
+        return [(UPSERT_USER, (record['u_id'], user['email'].lower(), user['username'],
+                               user['token'], json.dumps(user)))]
+    if op == 'channel':
+        return [(UPSERT_CHANNEL, (record['channel_id'], json.dumps(record['channel'])))]
+    if op in ('message', 'pending'):
+        msg = record['message']
+        params = (msg['message_id'], record['channel_id'], msg['u_id'],
+                  msg['time_created'], json.dumps(msg))
+        if op == 'pending':
+            return [(UPSERT_PENDING, params),
+                    (UPDATE_TOTAL_MSG, (msg['message_id'] + 1,))]
+        # the log_order is filled in by write_batch
+        return [(UPSERT_MESSAGE, params[:4] + (None,) + params[4:]),
+                (UPDATE_TOTAL_MSG, (msg['message_id'] + 1,))]
+    if op == 'remove':
+        channel_id = record['channel_id']
+        return [('DELETE FROM messages WHERE message_id = ?', (record['message_id'],)),
+                ('INSERT INTO removed (message_id, channel_id, log_seq) VALUES (?, ?, ?)',
+                 (record['message_id'], channel_id, record['log_seq'])),
+                (PRUNE_REMOVED, (channel_id, channel_id, message_log.REMOVED_MSGS_KEPT)),
+                (UPDATE_TOTAL_MSG, (record['message_id'] + 1,))]
+    if op == 'counters':
+        return [(UPDATE_TOTAL_MSG, (record['total_msg'],))] + \
+               [(UPSERT_HANDLE_COUNTER, item) for item in record['handle_counters'].items()]
+    # op == 'clear'
+    return [('DELETE FROM users', ()), ('DELETE FROM channels', ()),
+            ('DELETE FROM messages', ()), ('DELETE FROM removed', ()),
+            ('DELETE FROM counters', ()), ('DELETE FROM handle_counters', ())]
+
+
+def append(record):
+    """ Append the record, it's applied to the database by the writer thread.
+
+    Args:
+        record (dict): the record, see persistence.py
+    """
+    group_commit.append(statements(record))
+
+
+def wait():
+    """ Block until every record appended by the current thread is applied """
+    group_commit.wait()
+
+
+def write_batch(batch):
+    """ Apply the statements of a batch of records in one transaction """
+    global next_log_order
+
+    with connection:
+        for record_statements in batch:
+            for sql, params in record_statements:
+                if sql is UPSERT_MESSAGE:
+                    params = params[:4] + (next_log_order,) + params[5:]
+                    next_log_order += 1
+                connection.execute(sql, params)
+
+
+def close():
+    """ Apply the buffered records and close the database """
+    global connection, database, lock_file
+
+    group_commit.stop()
+    connection.close()
+    connection = database = None
+    lock_file.close()
+    lock_file = None
@@ -11,31 +11,53 @@ import users_channels as uc
 import error
 from user import user_profile
 import channel as ch
+import persistence
+import scheduler
+from locks import channel_lock
 from message import message_send
 import time
-from threading import Timer
 from datetime import datetime, timezone
 
 
 def standup_occurs(channel_id):
     '''
-    Description: Checks every second if any channel is done standup_active
+    Description: Sends the messages of the standup once it finishes,
+    run by the scheduler when the standup is due
     No parameters or returns
     '''
   
-    token = uc.channel[channel_id]['standup']['token']
-    message = '\n'.join(uc.channel[channel_id]['standup']['messages']) 
-    #send all in standup as normal message
-    #if len(message) > 1:
-    #    message_send(token, channelId, message)
+    with channel_lock(channel_id):
+        uc.standup_jobs.pop(channel_id, None)
+        token = uc.channel[channel_id]['standup']['token']
+        message = '\n'.join(uc.channel[channel_id]['standup']['messages']) 
+        #send all in standup as normal message
+        #if len(message) > 1:
+        #    message_send(token, channelId, message)
    
-    #clear all of the standup in that channel 
-    uc.channel[channel_id]['standup']['is_active'] = False
-    uc.channel[channel_id]['standup']['time_finish'] = None
-    uc.channel[channel_id]['standup']['messages'] = []
+        #clear all of the standup in that channel 
+        uc.channel[channel_id]['standup']['is_active'] = False
+        uc.channel[channel_id]['standup']['time_finish'] = None
+        uc.channel[channel_id]['standup']['messages'] = []
+        persistence.channel_changed(channel_id)
     #send all in standup as normal message
     if len(message) > 1:
         return message_send(token, channel_id, message)
+def schedule_active_standups():
+    '''
+    Description: schedules the end of every active standup,
+    e.g. the standups recovered by persistence.open_storage
+    No parameters or returns
+    '''
+    for channel_id, channel_info in uc.channel.items():
+        if channel_info['standup']['is_active']:
+            with channel_lock(channel_id):
+                job_id = uc.standup_jobs.pop(channel_id, None)
+                if job_id is not None:
+                    scheduler.cancel(job_id)
+                uc.standup_jobs[channel_id] = scheduler.schedule(
+                    channel_info['standup']['time_finish'], standup_occurs, channel_id)
+
+
 def standup_start(token, channel_id, length):
     '''
     Description: starts a standup in a certain channel for a length of time
@@ -47,18 +69,21 @@ def standup_start(token, channel_id, length):
     #if the channel is invalid raise input error
     ch.is_channel_id_valid(channel_id)
 
-    #if the channel currently have a standup raise input error
-    if uc.channel[channel_id]['standup']['is_active'] == True:
-        raise error.InputError("Already active standup (standup_start)")
-
-    #make standup active
-    uc.channel[channel_id]['standup']['is_active'] = True
-    uc.channel[channel_id]['standup']['token'] = token
-    #make a time stamp for when it finishes
-    timestamp = int(time.time()) + length
-    uc.channel[channel_id]['standup']['time_finish'] = timestamp
-    t = Timer(length, standup_occurs,[channel_id])
-    t.start() 
+    with channel_lock(channel_id):
+        #if the channel currently have a standup raise input error
+        if uc.channel[channel_id]['standup']['is_active'] == True:
+            raise error.InputError("Already active standup (standup_start)")
+
+        #make standup active
+        uc.channel[channel_id]['standup']['is_active'] = True
+        uc.channel[channel_id]['standup']['token'] = token
+        #make a time stamp for when it finishes
+        timestamp = int(time.time()) + length
+        uc.channel[channel_id]['standup']['time_finish'] = timestamp
+        persistence.channel_changed(channel_id)
+        # one scheduler thread runs every standup instead of a thread each
+        uc.standup_jobs[channel_id] = scheduler.schedule(
+            time.time() + length, standup_occurs, channel_id)
     #returns the time the standup finishes
     return {
         'time_finish': uc.channel[channel_id]['standup']['time_finish']
@@ -102,17 +127,19 @@ def standup_send(token, channel_id, message):
     if not ch.is_user_member(u_id, channel_id):
         raise error.AccessError("not member of channel (standup_send)")
     
-    # standup not currently active
-    if uc.channel[channel_id]['standup']['is_active'] == False:
-        raise error.InputError("No active standup (standup_send)")
+    with channel_lock(channel_id):
+        # standup not currently active
+        if uc.channel[channel_id]['standup']['is_active'] == False:
+            raise error.InputError("No active standup (standup_send)")
     
-    # message too long (> 1000 char)
-    if len(message) > 1000:
-        raise error.InputError("Message to long (standup_send)")
+        # message too long (> 1000 char)
+        if len(message) > 1000:
+            raise error.InputError("Message to long (standup_send)")
 
-    username = user_profile(token, u_id)['user']['handle_str']
-    concat_msg = f"{username}: {message}"
+        username = user_profile(token, u_id)['user']['handle_str']
+        concat_msg = f"{username}: {message}"
 
-    uc.channel[channel_id]['standup']['messages'].append(concat_msg)
+        uc.channel[channel_id]['standup']['messages'].append(concat_msg)
+        persistence.channel_changed(channel_id)
 
     return {}
@@ -14,8 +14,11 @@ import other as o
 import user as u
 import standup as su
 
+import scheduler
+
 # Library
 import pytest
+import threading
 import time
 import other as o
 from datetime import datetime, timezone
@@ -71,6 +74,20 @@ def test_startstandup(_pre_setup_):
     }
     time.sleep(1)
 
+def test_startstandup_scheduled(_pre_setup_):
+    '''standups are run by the scheduler thread instead of a thread each'''
+    a_reg, __, a_channel_id, b_channel_id = _pre_setup_
+    threads = threading.active_count()
+    for channel_id in (a_channel_id['channel_id'], b_channel_id['channel_id']):
+        su.standup_start(a_reg['token'], channel_id, 60)
+
+    assert threading.active_count() <= max(threads, 2)
+    assert [job['args'] for job in scheduler.pending_jobs()
+            if job['name'] == 'standup_occurs'] == [(a_channel_id['channel_id'],),
+                                                    (b_channel_id['channel_id'],)]
+    o.clear()
+    assert scheduler.pending_jobs() == []
+
 #------tests for standup_active-------
 
 def test_standupactive_invalidtoken(_pre_setup_):
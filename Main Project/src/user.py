@@ -13,15 +13,15 @@ user_profile_uploadphoto().
 # Libraries
 import re
 import pytest
-from PIL import Image
-import os
-import urllib
-import requests
 
 # Src files
 from channel import token_to_uid, is_uid_valid
+from auth import normalise_email, email_to_uid
 import users_channels as uc
 import error
+import persistence
+import images
+from locks import users_lock
 
 
 def user_profile(token, u_id):
@@ -69,9 +69,11 @@ def user_profile_setname(token, name_first, name_last):
     #if the last name is not between 1-50 characters cause input error
     if len(name_last) < 1 or len(name_last) > 50:
         raise error.InputError("Invalid last name. Last name should be between 1-50 charactesrs. (user_setname)")
-    #update the token's first and last name
-    uc.users[user_uid]['name_first'] = name_first
-    uc.users[user_uid]['name_last'] = name_last
+    with users_lock:
+        #update the token's first and last name
+        uc.users[user_uid]['name_first'] = name_first
+        uc.users[user_uid]['name_last'] = name_last
+        persistence.user_changed(user_uid)
 
     return {}
 
@@ -88,14 +90,17 @@ def user_profile_setemail(token, email):
     #if the email is not valid raise input error
     if '@' not in email:
         raise error.InputError("Invalid email adress. (user_profile_setemail)")
-    #if the email address is already being used by another user raise input error
-    u_id = 0
-    for u_id in uc.users:
-        if uc.users[u_id]['email'] == email:
+    with users_lock:
+        #if the email address is already being used by another user raise input error
+        if email_to_uid(email) is not None:
             raise error.InputError("Email already exist. (user_profile_setemail)")
-    u_id += 1
-    #update the users email address
-    uc.users[user_uid]['email'] = email
+        #update the users email address and the email index
+        #the session in uc.tokens is keyed by the decoded token rather than the
+        #email, so the user stays logged in with the current token
+        del uc.emails[normalise_email(uc.users[user_uid]['email'])]
+        uc.emails[normalise_email(email)] = user_uid
+        uc.users[user_uid]['email'] = email
+        persistence.user_changed(user_uid)
 
     return {}
 
@@ -114,13 +119,16 @@ def user_profile_sethandle(token, handle_str):
     if len(handle_str) < 3 or len(handle_str) > 20:
         raise error.InputError("Invalid handle, handle should be between 3-20 characters in length. (user_profile_sethandle)")
 
-    # check handle not taken
-    for __, user_info in uc.users.items():
-        if user_info['username'] == handle_str:
+    with users_lock:
+        # check handle not taken
+        if handle_str in uc.handles:
             raise error.InputError("Handle already taken. (user_profile_sethandle)")
 
-    # set new handle
-    uc.users[u_id]['username'] = handle_str
+        # set new handle
+        del uc.handles[uc.users[u_id]['username']]
+        uc.handles[handle_str] = u_id
+        uc.users[u_id]['username'] = handle_str
+        persistence.user_changed(u_id)
 
     return {}
 
@@ -149,31 +157,59 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
     if img_url[-3:] != 'jpg':
         raise error.InputError("Invalid file type.")
 
-    if requests.get(img_url).status_code != 200:
-        raise error.InputError("Can't access the url")
-
-    # Get the image
-    # Change the name to make it harder to have duplicate names
-    file_name = str(f'{token[-5:]}' + img_url.split('/')[-1])
-    target_folder = f'src/static/{file_name}'
-    urllib.request.urlretrieve(img_url, target_folder)
-
-    # Open the image and get its size
-    full_path = os.path.join(os.getcwd(), target_folder)
-    photo = Image.open(full_path)
-    width, height = photo.size
-
-    # Invalid dimensions
-    if any(point < 0 for point in (x_end, x_start, y_end, y_start)) or \
-       any(point > width for point in (x_end, x_start)) or \
-       any(point > height for point in (y_end, y_start)):
-        os.remove(full_path)
-        raise error.InputError("Invalid Image cropping dimension.")
-
-    # Crop and save the image
-    cropped = photo.crop((x_start, y_start, x_end, y_end))
-    cropped.save('src/static/' + file_name)
-
-    # Not sure to return 'full_path' or 'file_name'
-    uc.users[uid]['profile_img_url'] = file_name
+    # Stored by its content, see images.py
+    images.upload_image(uid, img_url, (x_start, y_start, x_end, y_end))
     return {}
+
+
+def user_profile_uploadphoto_start(token, img_url, x_start, y_start, x_end, y_end):
+    """ Same as user_profile_uploadphoto, but the image is downloaded and
+        cropped in the background. Poll user_profile_uploadphoto_status
+        for the outcome.
+
+    Args:
+        same as user_profile_uploadphoto
+
+    Returns:
+        job_id (int): id of the upload job
+    """
+
+    uid = token_to_uid(token)
+
+    if img_url[-3:] != 'jpg':
+        raise error.InputError("Invalid file type.")
+
+    job_id = images.start_job(uid, img_url, (x_start, y_start, x_end, y_end))
+    return {'job_id': job_id}
+
+
+def user_profile_uploadphoto_status(token, job_id):
+    """ Status of an upload job started by user_profile_uploadphoto_start
+
+    Args:
+        token (str): the token of the user who started the job
+        job_id (int): id of the upload job
+
+    Returns:
+        status (str): 'pending', 'running', 'done' or 'failed'
+        error (str): why the job failed, '' otherwise
+        profile_img_url (str): the photo uploaded by the job once it's done
+                               (even if the user changed photo since), '' otherwise
+
+    Raises:
+        InputError: job_id is not a job (or it finished over an hour ago)
+        AccessError: the job was started by another user
+    """
+
+    uid = token_to_uid(token)
+    job = uc.upload_jobs.get(job_id)
+    if job is None:
+        raise error.InputError("Invalid job_id")
+    if job['u_id'] != uid:
+        raise error.AccessError("The job was started by another user")
+
+    return {
+        'status': job['status'],
+        'error': job['error'],
+        'profile_img_url': job['path'],
+    }
@@ -11,6 +11,7 @@ Reviewed by Yue Dai (10/11/2020)
 
 """
 
+import io
 import re
 import json
 import os
@@ -373,12 +374,22 @@ def test_valid_email(url, _pre_setup):
     assert new_response['user']['email'] == "newemail@gmail.com"
 
 
+def remove_photo(file_name):
+    """ Remove the uploaded photo and its variants from src/static,
+        so the photo isn't used by the next tests
+    """
+    for path in (file_name, *(file_name[:-4] + f'-{size}.jpg' for size in (32, 64, 256))):
+        os.remove(os.path.join('src', 'static', path))
+    os.removedirs(os.path.dirname(os.path.join('src', 'static', file_name)))
+
+
 @pytest.fixture
-def upload_data(_pre_setup):
+def upload_data(_pre_setup, image_server):
     """ Pytest fixtures for data of user_profile_uploadphoto
 
     Args:
         _pre_setup (tuple): pytest fixtures with registration
+        image_server (tuple): pytest fixture serving the image locally
 
     Returns:
         upload_data (dict): dictionary with parameters for user_profile_uploadphoto
@@ -386,8 +397,7 @@ def upload_data(_pre_setup):
     user_1, __ = _pre_setup
     upload_data = {
         'token': user_1['token'],
-        'img_url': 'https://media.geeksforgeeks.org/wp-content/'\
-                   'uploads/20190715231713/flower11.jpg',
+        'img_url': image_server[0] + '/photo.jpg',
         'x_start': 0,
         'y_start': 0,
         'x_end': 200,
@@ -431,6 +441,8 @@ def test_upload_img_normal(url, _pre_setup, upload_data):
         # No such directory
         pass
 
+    remove_photo(uploaded_url.split('/static/')[-1])
+
 
 def test_upload_img_invalid_http_code(url, _pre_setup, upload_data):
     """ Testing for img_url returns an HTTP status other than 200.
@@ -439,7 +451,7 @@ def test_upload_img_invalid_http_code(url, _pre_setup, upload_data):
             InputError
     """
 
-    upload_data['img_url'] = 'http://www.bilibili.com/none'
+    upload_data['img_url'] = upload_data['img_url'].replace('photo.jpg', 'none.jpg')
     resp = requests.post(url + 'user/profile/uploadphoto', json=upload_data)
 
     assert resp.status_code == 400
@@ -479,8 +491,48 @@ def test_uploadphoto_invalid_file_type(url, _pre_setup, upload_data):
         Raises:
             InputError
     """
-    upload_data['img_url'] = 'https://www.pngkit.com/png/detail/300-3003753'\
-                             '_jager-png-jager-rainbow-six-png.png'
+    upload_data['img_url'] = upload_data['img_url'].replace('photo.jpg', 'photo.png')
     resp = requests.post(url + 'user/profile/uploadphoto', json=upload_data)
 
     assert resp.status_code == 400
+
+
+def test_upload_img_async(url, _pre_setup, image_server):
+    """ With "async": true the upload returns a job_id, and the status
+        of the job gives the url of the photo once done
+    """
+    user_1, __ = _pre_setup
+    server_url, __ = image_server
+    upload_data = {'token': user_1['token'], 'img_url': server_url + '/photo.jpg',
+                   'x_start': 0, 'y_start': 0, 'x_end': 30, 'y_end': 40, 'async': True}
+
+    job_id = requests.post(url + 'user/profile/uploadphoto', json=upload_data).json()['job_id']
+    params = {'token': user_1['token'], 'job_id': job_id}
+    for __ in range(500):
+        status = requests.get(url + 'user/profile/uploadphoto/status', params=params).json()
+        if status['status'] in ('done', 'failed'):
+            break
+        sleep(0.01)
+
+    assert status['status'] == 'done'
+    profile = requests.get(url + 'user/profile', params=user_1).json()
+    assert status['profile_img_url'] == profile['user']['profile_img_url'] != ''
+
+    img = requests.get(status['profile_img_url'])
+    params_small = {**user_1, 'img_size': 32}
+    small_url = requests.get(url + 'user/profile', params=params_small).json()['user']['profile_img_url']
+    small = requests.get(small_url)
+    params_small['img_size'] = 33
+    assert requests.get(url + 'user/profile', params=params_small).status_code == 400
+
+    remove_photo(status['profile_img_url'].split('/static/')[-1])
+
+    assert img.status_code == 200
+    assert 'immutable' in img.headers['Cache-Control']
+    assert Image.open(io.BytesIO(img.content)).size == (30, 40)
+    assert small_url.endswith('-32.jpg')
+    assert Image.open(io.BytesIO(small.content)).size == (24, 32)
+
+    params['job_id'] = job_id + 1
+    resp = requests.get(url + 'user/profile/uploadphoto/status', params=params)
+    assert resp.status_code == 400
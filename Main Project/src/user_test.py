@@ -15,6 +15,8 @@ Reviewed by Yue Dai (10/11/2020)
 import pytest
 from PIL import Image, ImageChops
 import os
+import io
+import time
 import urllib
 import requests
 
@@ -25,6 +27,8 @@ import auth as au
 import user as u
 import other as o
 import error
+import config
+import images
 
 
 @pytest.fixture
@@ -144,6 +148,20 @@ def test_valid_email(_pre_setup):
     assert test['user']['email'] == "newemail@gmail.com"
 
 
+def test_setemail_login(_pre_setup):
+    '''
+    the user can only login with the new email after updating the email,
+    and emails are compared case-insensitively
+    '''
+    user1, user2 = _pre_setup
+    u.user_profile_setemail(user1['token'], "newemail@gmail.com")
+    with pytest.raises(error.InputError):
+        au.auth_login("miabueno@gmail.com", "Password123")
+    assert au.auth_login("newemail@gmail.com", "Password123")['u_id'] == user1['u_id']
+    with pytest.raises(error.InputError):
+        u.user_profile_setemail(user2['token'], "NewEmail@gmail.com")
+
+
 @pytest.fixture
 def _pre_setup():
     '''
@@ -296,19 +314,44 @@ def test_user_profile_sethandle_taken(_pre_setup):
         u.user_profile_sethandle(user2['token'], user1_handle)
 
 
+def test_user_profile_sethandle_frees_old_handle(_pre_setup):
+    '''
+    once a user changes their handle, the old handle can be taken by others
+    and a new user with the same name still gets a unique handle
+    '''
+    user1, user2 = _pre_setup
+    user1_handle = u.user_profile(user1['token'], user1['u_id'])['user']['handle_str']
+
+    u.user_profile_sethandle(user1['token'], "newmia")
+    u.user_profile_sethandle(user2['token'], user1_handle)
+    with pytest.raises(error.InputError):
+        u.user_profile_sethandle(user2['token'], "newmia")
+
+    user3 = au.auth_register("miabueno3@gmail.com", "Password123", "Mia", "Bueno")
+    user3_handle = u.user_profile(user3['token'], user3['u_id'])['user']['handle_str']
+    assert user3_handle not in (user1_handle, "newmia")
+
+
+@pytest.fixture
+def static_dir(tmp_path, monkeypatch):
+    """ Save the uploaded photos into tmp_path instead of src/static """
+    monkeypatch.setattr(images, 'IMG_FOLDER', str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture
-def images_url():
-    """ Pytest fixture that stores url for image online
+def images_url(image_server, static_dir):
+    """ Pytest fixture that stores url for images served by the local
+        image server, the uploaded photos are saved into static_dir
 
     Returns:
         [dict]: dictionary that contains url of images.
     """
+    server_url = image_server[0]
     images = {
-        0:  'https://media.geeksforgeeks.org/wp-content/'\
-            'uploads/20190715231713/flower11.jpg',
-        1:  'https://upload.wikimedia.org/wikipedia/commons'\
-            '/4/47/PNG_transparency_demonstration_1.png',
-        2:  'http://www.bilibili.com/none.jpg',
+        0:  server_url + '/photo.jpg',
+        1:  server_url + '/photo.png',
+        2:  server_url + '/none.jpg',
     }
     return images
 
@@ -378,3 +421,162 @@ def test_uploadphoto_invalid_file_type(_pre_setup, images_url):
 
     with pytest.raises(error.InputError):
         u.user_profile_uploadphoto(token_1, images_url[1], 0, 0, 200, 200)
+
+
+def test_uploadphoto_local_single_fetch(_pre_setup, image_server, static_dir):
+    """ The photo is downloaded once, and only the cropped photo is saved """
+    user_1, __ = _pre_setup
+    server_url, requested = image_server
+
+    u.user_profile_uploadphoto(user_1['token'], server_url + '/photo.jpg', 10, 20, 110, 70)
+
+    assert requested == ['/photo.jpg']
+    file_name = u.user_profile(user_1['token'], user_1['u_id'])['user']['profile_img_url']
+    assert images.is_image_path(file_name)
+    assert sorted(str(path.relative_to(static_dir)) for path in static_dir.rglob('*.*')) == \
+        sorted(images.variant_path(file_name, size) for size in (None, 32, 64, 256))
+    for size, expected in ((None, (100, 50)), (32, (32, 16)), (64, (64, 32)), (256, (100, 50))):
+        with Image.open(static_dir / images.variant_path(file_name, size)) as cropped:
+            assert cropped.size == expected
+
+
+def test_uploadphoto_local_errors(_pre_setup, image_server, static_dir, monkeypatch):
+    """ Missing photos, photos too large and invalid crops save nothing """
+    token_1 = _pre_setup[0]['token']
+    server_url, __ = image_server
+
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto(token_1, server_url + '/none.jpg', 0, 0, 10, 10)
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto(token_1, server_url + '/photo.jpg', 0, 0, 301, 10)
+    monkeypatch.setattr(config, 'IMG_MAX_BYTES', 100)
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto(token_1, server_url + '/photo.jpg', 0, 0, 10, 10)
+
+    assert os.listdir(static_dir) == []
+    assert u.user_profile(token_1, _pre_setup[0]['u_id'])['user']['profile_img_url'] == ''
+
+
+def test_uploadphoto_streamed_limits(_pre_setup, image_server, static_dir, monkeypatch):
+    """ Photos sent without Content-Length are limited while they are
+        downloaded, by their size and by the time they take
+    """
+    token_1 = _pre_setup[0]['token']
+    server_url, __ = image_server
+
+    u.user_profile_uploadphoto(token_1, server_url + '/stream.jpg', 0, 0, 10, 10)
+    assert u.user_profile(token_1, _pre_setup[0]['u_id'])['user']['profile_img_url'] != ''
+
+    monkeypatch.setattr(config, 'IMG_MAX_BYTES', 1000)
+    with pytest.raises(error.InputError, match="Image is too large"):
+        u.user_profile_uploadphoto(token_1, server_url + '/stream.jpg', 0, 0, 10, 10)
+
+    monkeypatch.setattr(config, 'IMG_MAX_BYTES', 10 * 1024 * 1024)
+    monkeypatch.setattr(config, 'IMG_TIMEOUT', 0.5)
+    start = time.time()
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto(token_1, server_url + '/slow.jpg', 0, 0, 10, 10)
+    assert time.time() - start < 2
+
+
+def test_uploadphoto_stored_once(_pre_setup, image_server, static_dir):
+    """ The same photo is stored once however many users use it, and deleted
+        once none uses it anymore
+    """
+    user_1, user_2 = _pre_setup
+    photo_url = image_server[0] + '/photo.jpg'
+
+    u.user_profile_uploadphoto(user_1['token'], photo_url, 0, 0, 50, 50)
+    u.user_profile_uploadphoto(user_2['token'], photo_url, 0, 0, 50, 50)
+    shared = u.user_profile(user_1['token'], user_1['u_id'])['user']['profile_img_url']
+    assert u.user_profile(user_2['token'], user_2['u_id'])['user']['profile_img_url'] == shared
+    # the photo and its 3 variants
+    assert len(list(static_dir.rglob('*.jpg'))) == 4
+
+    u.user_profile_uploadphoto(user_1['token'], photo_url, 0, 0, 60, 60)
+    assert (static_dir / shared).exists()
+    assert len(list(static_dir.rglob('*.jpg'))) == 8
+
+    u.user_profile_uploadphoto(user_2['token'], photo_url, 0, 0, 60, 60)
+    assert not (static_dir / shared).exists()
+    assert len(list(static_dir.rglob('*.jpg'))) == 4
+
+
+def test_profile_img_url_cached(_pre_setup, image_server, static_dir):
+    """ The url of the photo is cached per base url and size, until the
+        user uploads another photo
+    """
+    user_1, user_2 = _pre_setup
+    photo_url = image_server[0] + '/photo.jpg'
+    base_url = 'http://flockr.test/'
+
+    assert images.profile_img_url(user_1['u_id'], base_url) == ''
+    u.user_profile_uploadphoto(user_1['token'], photo_url, 0, 0, 50, 50)
+    path = u.user_profile(user_1['token'], user_1['u_id'])['user']['profile_img_url']
+
+    assert images.profile_img_url(user_1['u_id'], base_url) == base_url + 'static/' + path
+    assert images.profile_img_url(user_1['u_id'], base_url, 64) == \
+        base_url + 'static/' + images.variant_path(path, 64)
+    assert images.profile_img_url(user_2['u_id'], base_url) == ''
+    assert len(au.users[user_1['u_id']]['img_urls']) == 2
+
+    u.user_profile_uploadphoto(user_1['token'], photo_url, 0, 0, 60, 60)
+    new_path = u.user_profile(user_1['token'], user_1['u_id'])['user']['profile_img_url']
+    assert new_path != path
+    assert images.profile_img_url(user_1['u_id'], base_url) == base_url + 'static/' + new_path
+
+
+def wait_for_job(token, job_id):
+    """ Poll the status of the upload job until it's finished """
+    for __ in range(500):
+        status = u.user_profile_uploadphoto_status(token, job_id)
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.01)
+    raise AssertionError('upload job not finished')
+
+
+def test_uploadphoto_job(_pre_setup, image_server, static_dir):
+    """ The upload job crops the photo in the background, and sets it as
+        the profile photo once done
+    """
+    user_1, user_2 = _pre_setup
+    server_url, __ = image_server
+
+    job_id = u.user_profile_uploadphoto_start(user_1['token'], server_url + '/photo.jpg',
+                                              0, 0, 30, 40)['job_id']
+    with pytest.raises(error.AccessError):
+        u.user_profile_uploadphoto_status(user_2['token'], job_id)
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto_status(user_1['token'], job_id + 1)
+
+    status = wait_for_job(user_1['token'], job_id)
+    file_name = u.user_profile(user_1['token'], user_1['u_id'])['user']['profile_img_url']
+    assert status == {'status': 'done', 'error': '', 'profile_img_url': file_name}
+    with Image.open(static_dir / file_name) as cropped:
+        assert cropped.size == (30, 40)
+
+    # the status keeps the photo of the job after the user changes photo
+    next_id = u.user_profile_uploadphoto_start(user_1['token'], server_url + '/photo.jpg',
+                                               0, 0, 40, 30)['job_id']
+    next_file_name = wait_for_job(user_1['token'], next_id)['profile_img_url']
+    assert next_file_name not in ('', file_name)
+    assert u.user_profile_uploadphoto_status(user_1['token'], job_id) == status
+
+
+def test_uploadphoto_job_failed(_pre_setup, image_server, static_dir):
+    """ Errors of the upload job are reported by its status """
+    token_1 = _pre_setup[0]['token']
+    server_url, __ = image_server
+
+    with pytest.raises(error.InputError):
+        u.user_profile_uploadphoto_start(token_1, server_url + '/photo.png', 0, 0, 10, 10)
+
+    job_id = u.user_profile_uploadphoto_start(token_1, server_url + '/none.jpg',
+                                              0, 0, 10, 10)['job_id']
+    assert wait_for_job(token_1, job_id) == {
+        'status': 'failed', 'error': "Can't access the url", 'profile_img_url': ''}
+
+    job_id = u.user_profile_uploadphoto_start(token_1, server_url + '/photo.jpg',
+                                              0, 0, 10, 500)['job_id']
+    assert wait_for_job(token_1, job_id)['error'] == "Invalid Image cropping dimension."
@@ -30,8 +30,48 @@ V.1.2: The data structure prototype. 22/9/2020
     1.  Add global variable 'REACTIONS', a list of implemented reaction in current
         iteration.
 
+# 18/10/2026:
+    1.  Add global variable 'tokens', an index of the decoded token of every
+        logged in user to its uid.
+    2.  Add global variable 'verified_tokens', a bounded LRU cache of jwt
+        tokens that are already verified.
+    3.  Add global variable 'emails', an index of lowercased email to uid.
+    4.  Add global variable 'messages', an index of message_id to the channel_id
+        and the message's dictionary.
+    5.  'messages' of a channel is an append-only log (oldest first) and removed
+        messages are tombstones (None), counted by 'msg_tombstones'.
+        The index 'messages' also stores the position of the message in the log.
+    6.  Add global variable 'pending_msgs', messages scheduled by
+        message_send_later that are not due yet.
+    7.  Add global variable 'search_words', an inverted index of the words
+        in the messages used by other.search.
+    8.  Add global variable 'search_trigrams', an inverted index of the
+        trigrams (substrings of length 3) in the messages.
+    9.  'members' and 'owners' of a channel, and 'in_channels' of a user are
+        ordered sets, i.e. dictionaries with the ids as keys and None as values.
+        'msg_sent' is a set.
+    10. Add global variable 'handles', an index of handle to uid, and
+        'handle_counters', the next numerical suffix of each base handle.
+    11. Add global variable 'standup_jobs', the scheduler job of each
+        active standup.
+    12. Add global variable 'upload_jobs', the status of the background jobs
+        started by user_profile_uploadphoto_start.
+    13. 'profile_img_url' of a user is the path of a content addressed photo.
+        Add global variable 'img_refs', the amount of users using each photo.
+    14. Add 'img_urls' to the users, a cache of the absolute urls of their
+        photo for each base url and size.
+    15. Add 'log_seq' to the messages, their sequence number in the log of
+        the channel, 'msg_seqs' (the sequence number of each position of the
+        log) and 'next_seq' to the channels, and global variable
+        'removed_msgs', the sequence number of the recently removed messages.
+    16. 'members' of a channel maps each member to their join number (taken
+        from 'join_ids'), so the order of 'in_channels' can be recovered.
+
 """
 
+import itertools
+from collections import OrderedDict
+
 # A dictionary of users_info_dictionaries
 users = {
     # Format of normal user's info dictionary
@@ -43,14 +83,114 @@ users = {
     #     'email': '',                # str
     #     'password': '',             # str
     #     'permission_id': 1 or 2,    # int
-    #     'in_channels': [],          # id of channels
-    #     'msg_sent': [],             # list of msg_id
-    #     'profile_img_url': '',      # str
+    #     'in_channels': {},          # id of channels, ordered set
+    #     'msg_sent': set(),          # set of msg_id
+    #     'profile_img_url': '',      # str, path of the photo in images.py
+    #     'img_urls': {},             # cache of the urls of the photo, see images.py
     # },
 }
 
+# Index of the active sessions, maps the decoded token (i.e. email) to the uid.
+# Must be kept in sync with users[uid]['token'].
+tokens = {
+    # Format only, not actual data
+    # 'z5555555@ad.unsw.edu.au': 0,
+}
+
+# Index of the registered emails, maps the lowercased email to the uid.
+# Must be kept in sync with users[uid]['email'].
+emails = {
+    # Format only, not actual data
+    # 'z5555555@ad.unsw.edu.au': 0,
+}
+
+# Index of the handles in use, maps the handle to the uid.
+# Must be kept in sync with users[uid]['username'].
+handles = {
+    # Format only, not actual data
+    # 'haydenjacobs0': 0,
+}
+
+# Next numerical suffix to try for each base handle (lowercased first name +
+# last name, at most 18 characters). See auth.handle_generate
+handle_counters = {
+    # Format only, not actual data
+    # 'haydenjacobs': 1,
+}
+
+# jwt tokens that passed the HMAC verification, maps the token to its decoded
+# email. Ordered from the least to the most recently used.
+verified_tokens = OrderedDict()
+# maximum number of tokens kept in verified_tokens
+TOKEN_CACHE_SIZE = 4096
+
+# Index of every message, maps the message_id to a list of
+# [channel_id, message's dictionary, position in channel[channel_id]['messages']]
+# See message_log.py
+messages = {
+    # Format only, not actual data
+    # 1: [0, {'message_id': 1, 'u_id': 1, ...}, 0],
+}
+
+# Sequence number of the recently removed messages of each channel, so pages
+# of channel_messages can still start at them. Maps the channel_id to a
+# dictionary of message_id to 'log_seq', oldest removal first.
+# See message_log.py
+removed_msgs = {
+    # Format only, not actual data
+    # 0: {3: 2, 4: 5},
+}
+
+# Messages sent by message_send_later that are not published yet,
+# maps the message_id to a tuple of (channel_id, message's dictionary)
+pending_msgs = {
+    # Format only, not actual data
+    # 2: (0, {'message_id': 2, 'u_id': 1, 'time_created': 1582426789, ...}),
+}
+
+# Inverted index of the published messages, maps each word to the set of
+# message_ids that contains the word. See search_index.py
+search_words = {
+    # Format only, not actual data
+    # 'Hello': {1, 2},
+}
+
+# Inverted index of the published messages, maps each substring of length 3
+# to the set of message_ids that contains the substring. See search_index.py
+search_trigrams = {
+    # Format only, not actual data
+    # 'Hel': {1, 2},
+}
+
+# The job of each active standup in scheduler.py, maps the channel_id to the
+# job_id of its standup_occurs
+standup_jobs = {
+    # Format only, not actual data
+    # 0: 5,
+}
+
+# Status of each upload job, see images.py. Maps the job_id to
+# {'u_id': user who started the job, 'status': 'pending', 'running', 'done'
+#  or 'failed', 'error': why the job failed,
+#  'path': path of the photo uploaded by the job once done}
+upload_jobs = {
+    # Format only, not actual data
+    # 0: {'u_id': 0, 'status': 'done', 'error': '', 'path': '9f/86/9f86d0...08.jpg'},
+}
+
+# Amount of users using each photo as their profile photo, maps the path of
+# the photo (see images.py) to the amount. Rebuilt from the users on recovery
+img_refs = {
+    # Format only, not actual data
+    # '9f/86/9f86d0...08.jpg': 2,
+}
+
 # stores the # of msg on the server, gives the newest msg_id
 TOTAL_MSG = 0
+
+# Join numbers of the channel members, in the order they joined,
+# see channel.add_member
+join_ids = itertools.count()
 # stores list of valid reactions currently implemented
 REACTIONS = [1]
 
@@ -63,10 +203,10 @@ channel = {
     # Format only, not actual data
     # 0: {
     #     'name': 'name',
-    #     'members': [1, 2, 3],
-    #     'owners': [1],
+    #     'members': {1: 0, 2: 4, 3: 7},  # ordered set of uid, to the join number
+    #     'owners': {1: None},                     # ordered set of uid
     #     'is_public': True,
-    #     'messages': [
+    #     'messages': [                 # oldest first, see message_log.py
     #         {
     #          'message_id': 1,
     #          'u_id': 1,
@@ -74,8 +214,13 @@ channel = {
     #          'time_created': 1582426789,
     #          'reacts': [],             # list of dictionaries
     #          'is_pinned': True,       # boolean
+    #          'log_seq': 0,            # sequence number in the log
     #         },
+    #         None,                     # tombstone of a removed message
     #     ],
+    #     'msg_seqs': [0, 1],           # 'log_seq' of each position of 'messages'
+    #     'next_seq': 2,                # 'log_seq' of the next message
+    #     'msg_tombstones': 1,          # amount of None in 'messages'
     #     'standup': {
     #         'is_active': False,
     #         'token': '',
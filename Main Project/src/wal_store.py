@@ -0,0 +1,191 @@
+""" Write-ahead log (WAL) and snapshot storage used by persistence.py
+
+    Layout of the data directory:
+        snapshot.jsonl      the records needed to rebuild the whole data, one
+                            JSON per line. The first line is
+                            {'wal_segment': n}, the first segment of the WAL
+                            that is not included in the snapshot.
+        wal-<n>.jsonl       segments of the WAL, the records appended
+                            after the snapshot, one JSON per line.
+
+    Records are written by group_commit.py, every batch with one write
+    and one fsync.
+
+    Once config.SNAPSHOT_EVERY records are written, the writer moves on to a
+    new segment, and a snapshot of the data is written by another thread.
+    The older segments are deleted once the snapshot is in place, so a
+    recovery only replays the records written after the latest snapshot.
+
+@date 18/10/2026
+"""
+
+import glob
+import json
+import os
+import threading
+
+import config
+import group_commit
+
+SNAPSHOT_FILE = 'snapshot.jsonl'
+
+# directory of the data, None when the storage is not opened
+data_dir = None
+# function returning an iterable of the records of the whole data
+state_records = None
+
+# the WAL segment records are written to, only used by the writer thread
+segment = 0
+wal_file = None
+# amount of records written since the latest snapshot
+since_snapshot = 0
+
+snapshot_thread = None
+
+
+def segment_path(number):
+    """ Return the path of the WAL segment """
+    return os.path.join(data_dir, f'wal-{number:08d}.jsonl')
+
+
+def segments():
+    """ Return the numbers of the WAL segments in the data directory, sorted """
+    paths = glob.glob(os.path.join(data_dir, 'wal-*.jsonl'))
+    return sorted(int(os.path.basename(path)[4:-6]) for path in paths)
+
+
+def read_records(path):
+    """ Yield the records stored in the file.
+        A crash can leave the last line partially written,
+        the records from there on are ignored.
+    """
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            yield record
+
+
+def open_store(path, records):
+    """ Open the storage in the directory, creating it if needed.
+
+    Args:
+        path (str): the data directory
+        records (function): returns an iterable of the records of the whole
+                            data, used to write the snapshots
+    """
+    global data_dir, state_records
+
+    os.makedirs(path, exist_ok=True)
+    data_dir = path
+    state_records = records
+
+
+def load():
+    """ Yield every stored record, from the oldest to the newest """
+    global since_snapshot
+
+    first = 0
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    if os.path.exists(snapshot_path):
+        records = read_records(snapshot_path)
+        first = next(records)['wal_segment']
+        yield from records
+
+    since_snapshot = 0
+    for number in segments():
+        if number >= first:
+            for record in read_records(segment_path(number)):
+                since_snapshot += 1
+                yield record
+
+
+def start():
+    """ Start writing the appended records into a new WAL segment.
+        Called once the stored records are loaded.
+    """
+    global segment, wal_file
+
+    segment = max(segments(), default=0) + 1
+    wal_file = open(segment_path(segment), 'a')
+    group_commit.start(write_batch)
+
+
+def append(record):
+    """ Append the record to the WAL, it's written by the writer thread.
+
+    Args:
+        record (dict): the record, must be serializable to JSON
+    """
+    group_commit.append(json.dumps(record))
+
+
+def wait():
+    """ Block until every record appended by the current thread is written """
+    group_commit.wait()
+
+
+def write_batch(lines):
+    """ Write the serialized records at the end of the WAL """
+    global since_snapshot
+
+    wal_file.write('\n'.join(lines) + '\n')
+    wal_file.flush()
+    if config.WAL_FSYNC:
+        os.fsync(wal_file.fileno())
+
+    since_snapshot += len(lines)
+    if since_snapshot >= config.SNAPSHOT_EVERY and \
+       (snapshot_thread is None or not snapshot_thread.is_alive()):
+        start_snapshot()
+
+
+def start_snapshot():
+    """ Move on to a new WAL segment and write the snapshot on another thread.
+        Only called by the writer thread.
+    """
+    global segment, wal_file, since_snapshot, snapshot_thread
+
+    wal_file.close()
+    segment += 1
+    wal_file = open(segment_path(segment), 'a')
+    since_snapshot = 0
+
+    snapshot_thread = threading.Thread(target=write_snapshot, args=(segment,),
+                                       daemon=True)
+    snapshot_thread.start()
+
+
+def write_snapshot(first_segment):
+    """ Write the snapshot of the whole data and
+        delete the WAL segments older than first_segment.
+
+        Every record in the older segments is already applied to the data.
+        The snapshot may also contain some changes of the newer segments,
+        replaying them again is harmless since records are upserts.
+    """
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    with open(snapshot_path + '.tmp', 'w') as file:
+        file.write(json.dumps({'wal_segment': first_segment}) + '\n')
+        for record in state_records():
+            file.write(json.dumps(record) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(snapshot_path + '.tmp', snapshot_path)
+
+    for number in segments():
+        if number < first_segment:
+            os.remove(segment_path(number))
+
+
+def close():
+    """ Write the buffered records and close the storage """
+    global snapshot_thread, wal_file, data_dir
+
+    group_commit.stop()
+    if snapshot_thread is not None:
+        snapshot_thread.join()
+    wal_file.close()
+    snapshot_thread = wal_file = data_dir = None